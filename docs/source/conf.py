@@ -53,6 +53,9 @@ extensions = [
     'sphinx.ext.napoleon',
 ]
 
+# Optional dependencies that are not needed to build the documentation
+autodoc_mock_imports = ['aiohttp']
+
 # Add any paths that contain templates here, relative to this directory.
 templates_path = ['_templates']
 
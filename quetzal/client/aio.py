@@ -0,0 +1,734 @@
+""" Asynchronous Quetzal API client
+
+This module implements :py:class:`AsyncClient`, a client with the same
+shortcut methods as :py:class:`quetzal.client.Client` whose operations are
+coroutines that send their requests with aiohttp on the running event loop,
+instead of blocking a thread on each request. It also has asynchronous
+versions of the most common helpers: :py:func:`download`, :py:func:`upload`,
+:py:func:`iter_query`, :py:func:`query` and :py:func:`wait_for_workspace`.
+
+aiohttp is an optional dependency. It can be installed with the ``aio``
+extra of this package.
+
+Example::
+
+    async with AsyncClient(config) as client:
+        workspaces = await client.workspace_fetch()
+        async for row in aio.iter_query(client, wid, 'SELECT id FROM base'):
+            ...
+
+"""
+import asyncio
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import ssl
+import sys
+import time
+import urllib.parse
+import weakref
+
+from requests import codes
+
+try:
+    import aiohttp
+except ImportError as _ex:
+    raise ImportError('The aiohttp package is needed for quetzal.client.aio. Install it, '
+                      'or install quetzal-client[aio].') from _ex
+
+from quetzal.client.base import (Client, MultipartStream, TransferBudget, _call_api_operation,
+                                 _log_auth_backoff, _retry_details, _sent_token)
+from quetzal.client.config import get_option
+from quetzal.client.exceptions import QuetzalAPIException, RetryableException
+from quetzal.client.helpers._paging import _Body, server_page_size
+from quetzal.client.helpers.file import _is_up_to_date, _remove_quietly, _reserve_partial_download
+from quetzal.openapi_client.rest import ApiException
+from quetzal.client.utils import get_data_dir, update_checksum_index
+
+
+logger = logging.getLogger(__name__)
+
+
+async def _retry_login(details):
+    client = details['args'][0]
+    if getattr(details.get('exception'), 'status', None) != codes.unauthorized:
+        return
+    if not client.configuration.username:
+        logger.debug('Will not retry a login, there is no username set')
+        return
+    if details['tries'] > 1:
+        logger.debug('Will not retry a login, there was already a previous attempt')
+        return
+    try:
+        logger.debug('Refreshing access token...')
+        await client.refresh_token(_sent_token.get(None))
+    except Exception:
+        logger.warning('Could not login')
+
+
+def _running_loop():
+    """Get the running event loop, or ``None`` outside of an event loop"""
+    if sys.version_info < (3, 7):
+        # asyncio.get_running_loop needs Python 3.7
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return None
+        return loop if loop.is_running() else None
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _start_background_refresh(client_ref, token):
+    client = client_ref()
+    if client is None:
+        return
+    client._refresh_task = asyncio.ensure_future(_refresh_token_in_background(client, token))
+
+
+async def _refresh_token_in_background(client, token):
+    if not client._tokens.used:
+        logger.debug('Access token was not used since its last renewal, it will not be renewed')
+        return
+    try:
+        logger.debug('Renewing access token before it expires...')
+        await client.refresh_token(token)
+    except Exception:
+        logger.warning('Could not renew the access token, it will be renewed by the next request',
+                       exc_info=True)
+
+
+def _auth_retry_decorator(func):
+    """Retry the API calls of a client as :py:meth:`quetzal.client.Client.call_api` does"""
+    @functools.wraps(func)
+    async def wrapper(client, *args, **kwargs):
+        policy = client.retry_policy
+        resource_path, method = _call_api_operation(args, kwargs)
+        policy.on_request()
+        start = time.monotonic()
+        tries = 0
+        while True:
+            tries += 1
+            try:
+                return await func(client, *args, **kwargs)
+            except RetryableException as ex:
+                elapsed = time.monotonic() - start
+                wait = policy.delay(ex, tries)
+                if not policy.should_retry(ex, method, resource_path, tries, elapsed, wait):
+                    raise
+                details = _retry_details(func, client, args, kwargs, tries, elapsed, wait, ex)
+                _log_auth_backoff(details)
+                await _retry_login(details)
+                await asyncio.sleep(wait)
+
+    return wrapper
+
+
+class AsyncClient(Client):
+    """Asynchronous client of the Quetzal API
+
+    All the shortcut methods of :py:class:`quetzal.client.Client`, such as
+    :py:meth:`workspace_fetch` or :py:meth:`public_query_create`, return a
+    coroutine that sends the request when awaited. Requests are retried and
+    the client logs in as :py:meth:`quetzal.client.Client.call_api` does, and
+    the caches of the configuration are used in the same way.
+
+    The requests share an :py:class:`aiohttp.ClientSession`, created on the
+    first request, with at most `connection_pool_maxsize` connections as set
+    on the configuration. The client must be closed with :py:meth:`close`,
+    or used as an asynchronous context manager.
+
+    Transfers are not limited by the `max_bytes_in_flight` budget of the
+    configuration, since waiting on it would block the event loop; the flow
+    control of aiohttp keeps the memory usage of each transfer bounded
+    instead.
+
+    """
+
+    def __init__(self, configuration=None, *args, **kwargs):
+        super().__init__(configuration, *args, **kwargs)
+        self.transfer_budget = TransferBudget(None)
+        self._session = None
+        self._auth_lock = None
+        self._refresh_task = None
+
+    def _new_rest_client(self):
+        # Requests are sent with the aiohttp session instead
+        return None
+
+    @property
+    def pool_stats(self):
+        """Not available: the connections are managed by aiohttp"""
+        return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def session(self):
+        """The :py:class:`aiohttp.ClientSession` of the requests of this client"""
+        if self._session is None or self._session.closed:
+            config = self.configuration
+            if not config.verify_ssl:
+                ssl_context = False
+            else:
+                ssl_context = ssl.create_default_context(cafile=config.ssl_ca_cert)
+                if config.cert_file:
+                    ssl_context.load_cert_chain(config.cert_file, keyfile=config.key_file)
+            connector = aiohttp.TCPConnector(limit=config.connection_pool_maxsize or 100, ssl=ssl_context)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Close the connections of this client"""
+        self._tokens.set_timer(None)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def login(self):
+        if not self.can_login:
+            return
+        response = await self.auth_get_token()
+        self.set_token(response.token)
+
+    async def refresh_token(self, stale=None):
+        """Restore or obtain a new access token, once for all the concurrent requests
+
+        See :py:meth:`quetzal.client.Client.refresh_token`.
+        """
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            current = self._tokens.current
+            if current is not None and current.token != stale:
+                return
+            if not self._restore_token(exclude=stale):
+                await self.login()
+
+    def _schedule_token_refresh(self, saved):
+        """Renew the access token in a task of the event loop before it expires"""
+        delay = self._token_refresh_delay(saved)
+        if delay is None:
+            return
+        loop = _running_loop()
+        if loop is None:
+            # Outside of the event loop, the next request renews the token
+            return
+        self._tokens.set_timer(loop.call_later(delay, _start_background_refresh,
+                                               weakref.ref(self), saved.token))
+
+    def call_api(self, resource_path, method, path_params=None, query_params=None,
+                 header_params=None, body=None, post_params=None, files=None,
+                 response_type=None, auth_settings=None, async_req=None,
+                 _return_http_data_only=None, collection_formats=None,
+                 _preload_content=True, _request_timeout=None, _host=None):
+        # The generated API methods return the result of this method, which is
+        # a coroutine for this client
+        return self._call_api(resource_path, method, path_params, query_params, header_params,
+                              body, post_params, files, response_type, auth_settings,
+                              _return_http_data_only, collection_formats, _preload_content,
+                              _request_timeout, _host)
+
+    @_auth_retry_decorator
+    async def _call_api(self, resource_path, method, path_params, query_params, header_params,
+                        body, post_params, files, response_type, auth_settings,
+                        _return_http_data_only, collection_formats, _preload_content,
+                        _request_timeout, _host):
+        config = self.configuration
+
+        # Patch for query create. The openapi-generator incorrectly assumes that
+        # its response type is an ProblemType
+        if resource_path == '/data/workspaces/{wid}/queries/' and method == 'POST':
+            response_type = 'Query'
+
+        # Remove bearer authentication when there is a api key
+        auth_settings = auth_settings or []
+        if 'bearer' in auth_settings and 'apiKey' in auth_settings and config.api_key:
+            auth_settings = [a for a in auth_settings if a != 'bearer']
+
+        # Restore a token or login before trying a bearer-protected endpoint,
+        # only once for all the concurrent requests
+        if 'bearer' in auth_settings and not config.api_key:
+            saved = self._tokens.current
+            if saved is None and not config.access_token:
+                await self.refresh_token()
+            elif self._token_expiring(saved):
+                await self.refresh_token(saved.token)
+            _sent_token.set(self.access_token)
+            self._tokens.touch()
+
+        try:
+            result = await self._request(resource_path, method, path_params, query_params, header_params,
+                                         body, post_params, files, response_type, auth_settings,
+                                         _return_http_data_only, collection_formats, _preload_content,
+                                         _request_timeout, _host)
+        except ApiException as api_ex:
+            self._forget_deleted_workspace(path_params, status=api_ex.status)
+            may_retry_to_authorize = (resource_path != '/auth/token')
+            raise QuetzalAPIException.from_api_exception(api_ex, authorize_ok=may_retry_to_authorize) from api_ex
+        self._forget_deleted_workspace(path_params, result=result)
+        return result
+
+    async def _request(self, resource_path, method, path_params, query_params, header_params,
+                       body, post_params, files, response_type, auth_settings,
+                       _return_http_data_only, collection_formats, _preload_content,
+                       _request_timeout, _host):
+        """Prepare and send a request as ApiClient.__call_api does, with aiohttp"""
+        config = self.configuration
+
+        header_params = dict(header_params or {})
+        header_params.update(self.default_headers)
+        if self.cookie:
+            header_params['Cookie'] = self.cookie
+        header_params = dict(self.parameters_to_tuples(self.sanitize_for_serialization(header_params),
+                                                       collection_formats))
+
+        if path_params:
+            path_params = self.parameters_to_tuples(self.sanitize_for_serialization(path_params),
+                                                    collection_formats)
+            for k, v in path_params:
+                resource_path = resource_path.replace(
+                    '{%s}' % k, urllib.parse.quote(str(v), safe=config.safe_chars_for_path_param))
+
+        query_params = self.parameters_to_tuples(self.sanitize_for_serialization(query_params or []),
+                                                 collection_formats)
+        if post_params or files:
+            post_params = self.prepare_post_parameters(post_params, files)
+            post_params = self.parameters_to_tuples(self.sanitize_for_serialization(post_params),
+                                                    collection_formats)
+
+        self.update_params_for_auth(header_params, query_params, auth_settings)
+        if body:
+            body = self.sanitize_for_serialization(body)
+        url = (_host or config.host) + resource_path
+
+        data = None
+        content_type = header_params.setdefault('Content-Type', 'application/json')
+        if isinstance(body, MultipartStream):
+            data = _iterate(body)
+        elif method in ('POST', 'PUT', 'PATCH', 'OPTIONS', 'DELETE'):
+            if re.search('json', content_type, re.IGNORECASE):
+                data = None if body is None else json.dumps(body)
+            elif content_type == 'application/x-www-form-urlencoded':
+                data = dict(post_params or [])
+            elif content_type == 'multipart/form-data':
+                del header_params['Content-Type']
+                data = aiohttp.FormData()
+                for name, value in post_params or []:
+                    if isinstance(value, tuple):
+                        data.add_field(name, value[1], filename=value[0], content_type=value[2])
+                    else:
+                        data.add_field(name, value)
+            elif isinstance(body, str):
+                data = body
+
+        timeout = None
+        if isinstance(_request_timeout, (int, float)):
+            timeout = aiohttp.ClientTimeout(total=_request_timeout)
+        elif isinstance(_request_timeout, tuple) and len(_request_timeout) == 2:
+            timeout = aiohttp.ClientTimeout(connect=_request_timeout[0], sock_read=_request_timeout[1])
+
+        response = await self.session.request(
+            method, url, params=[(k, _query_value(v)) for k, v in query_params],
+            headers=header_params, data=data, proxy=config.proxy,
+            timeout=timeout or aiohttp.ClientTimeout(total=None))
+
+        if not 200 <= response.status <= 299:
+            try:
+                error_body = await response.text()
+            finally:
+                response.release()
+            api_ex = ApiException(status=response.status, reason=response.reason)
+            api_ex.body = error_body
+            api_ex.headers = response.headers
+            raise api_ex
+
+        if not _preload_content:
+            return_data = response
+        else:
+            try:
+                response_data = (await response.read()).decode('utf8')
+            finally:
+                response.release()
+            return_data = self.deserialize(_Body(response_data), response_type) if response_type else None
+
+        if _return_http_data_only:
+            return return_data
+        return return_data, response.status, response.headers
+
+    async def call_api_raw(self, func, *args, **kwargs):
+        """Call an API method and get the undecoded body of its response
+
+        See :py:meth:`quetzal.client.Client.call_api_raw`.
+        """
+        response = await func(*args, _preload_content=False, **kwargs)
+        try:
+            return await response.read()
+        finally:
+            response.release()
+
+    async def call_api_json(self, func, *args, **kwargs):
+        """Call an API method and decode its response as plain objects
+
+        See :py:meth:`quetzal.client.Client.call_api_json`.
+        """
+        return json.loads(await self.call_api_raw(func, *args, **kwargs))
+
+
+def _query_value(value):
+    # aiohttp only accepts strings and numbers as query parameter values
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return value
+    return str(value)
+
+
+async def _iterate(chunks):
+    """Iterate over the chunks of a streamed body, read outside of the event loop"""
+    loop = asyncio.get_event_loop()
+    iterator = iter(chunks)
+    end = object()
+    while True:
+        chunk = await loop.run_in_executor(None, next, iterator, end)
+        if chunk is end:
+            return
+        yield chunk
+
+
+def _write_chunk(file_obj, hashobj, chunk):
+    file_obj.write(chunk)
+    hashobj.update(chunk)
+
+
+async def metadata(client, file_id, wid=None):
+    """ Get the metadata of a file.
+
+    Unlike :py:func:`quetzal.client.helpers.file.metadata`, this function
+    does not use the metadata cache of the client.
+    """
+    if wid is None:
+        response = await client.public_file_details(uuid=file_id, _accept='application/json')
+    else:
+        response = await client.workspace_file_details(wid=wid, uuid=file_id, _accept='application/json')
+    return response['metadata']
+
+
+async def download(client, file_id, wid=None, *, output=None, output_dir=None,
+                   chunk_size=None, checksum_index=False, max_resumes=5):
+    """ Download a file.
+
+    This is the asynchronous version of
+    :py:func:`quetzal.client.helpers.file.download`. The contents are
+    streamed to a partial download file, which is renamed to `output` once
+    its checksum has been verified. Downloads interrupted by a connection
+    error are resumed with a `Range` request, at most `max_resumes` times;
+    unlike the synchronous version, a download interrupted by the end of the
+    process starts again from the beginning. Files that are already
+    downloaded, or that are in the download cache of the client, are not
+    downloaded again. Files are read and written in the default executor of
+    the event loop, so that the disk does not block the loop.
+
+    Returns
+    -------
+    str
+        Absolute path of the downloaded file.
+
+    """
+    if output is None and output_dir is None:
+        output_dir = get_data_dir()
+
+    base = (await metadata(client, file_id, wid))['base']
+    if output_dir is not None:
+        output = pathlib.Path(output_dir) / base['path'] / base['filename']
+    else:
+        output = pathlib.Path(output)
+
+    config = client.configuration
+    chunk_size = chunk_size or get_option(config, 'chunk_size')
+    # Checking a local file reads it completely, and restoring it from the
+    # download cache may copy it: both run outside of the event loop
+    loop = asyncio.get_event_loop()
+    if await loop.run_in_executor(None, _is_up_to_date, output, base, checksum_index,
+                                  get_option(config, 'read_buffer_size')):
+        logger.debug('File %s already downloaded in %s', file_id, output)
+        return str(output.resolve())
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    store = client.download_cache
+    if store is not None and await loop.run_in_executor(None, store.materialize, base['checksum'],
+                                                        output) is not None:
+        logger.debug('File %s restored in %s from the download cache', file_id, output)
+        if checksum_index:
+            await loop.run_in_executor(None, update_checksum_index, output, base['checksum'], base['size'])
+        return str(output.resolve())
+
+    if wid is None:
+        func = client.public_file_details
+        kwargs = {'uuid': file_id}
+    else:
+        func = client.workspace_file_details
+        kwargs = {'wid': wid, 'uuid': file_id}
+
+    part, state_file, lock = await loop.run_in_executor(None, _reserve_partial_download, output)
+    progress = client.new_transfer('download', base['filename'], base['size'])
+    md5 = hashlib.md5()
+    size = 0
+    resumes = 0
+    progress.start()
+    try:
+        with part.open('wb') as fd:
+            while True:
+                headers = {'Range': f'bytes={size}-'} if size else {}
+                response = await func(_accept='application/octet-stream', _preload_content=False,
+                                      _headers=headers, **kwargs)
+                if size and response.status != codes.partial_content:
+                    # The server ignored the range request: start over
+                    logger.debug('Server did not accept a range request, restarting '
+                                 'download of file %s', file_id)
+                    fd.seek(0)
+                    await loop.run_in_executor(None, fd.truncate)
+                    md5, size = hashlib.md5(), 0
+                    progress.retry(offset=0)
+                try:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        await loop.run_in_executor(None, _write_chunk, fd, md5, chunk)
+                        size += len(chunk)
+                        progress.chunk(len(chunk))
+                    break
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError) as ex:
+                    if resumes >= max_resumes:
+                        raise
+                    resumes += 1
+                    logger.debug('Download of %s interrupted at byte %d, resuming', file_id, size)
+                    progress.retry(ex, offset=size)
+                finally:
+                    response.release()
+
+        if (md5.hexdigest(), size) != (base['checksum'], base['size']):
+            logger.warning('File %s was downloaded in %s but is corrupted', file_id, output)
+            raise ValueError('Download resulted in corrupted local file')
+    except Exception as ex:
+        progress.fail(ex)
+        _remove_quietly(part)
+        raise
+    else:
+        progress.finish()
+        os.replace(str(part), str(output))
+        if state_file is not None:
+            _remove_quietly(state_file)
+    finally:
+        if lock is not None:
+            os.close(lock)
+    if store is not None:
+        try:
+            await loop.run_in_executor(None, store.add, output, base['checksum'], base['size'])
+        except OSError:
+            logger.warning('Could not add file %s to the download cache', file_id, exc_info=True)
+    if checksum_index:
+        await loop.run_in_executor(None, update_checksum_index, output, base['checksum'], base['size'])
+    return str(output.resolve())
+
+
+async def upload(client, wid, file, **kwargs):
+    """ Upload a file to a workspace.
+
+    This is the asynchronous version of
+    :py:func:`quetzal.client.helpers.workspace.upload`, without the
+    deduplication option. The file is sent as a stream of chunks, read in
+    the default executor of the event loop.
+
+    Returns
+    -------
+    quetzal.openapi_client.models.BaseMetadata
+        Uploaded file details.
+
+    """
+    if not hasattr(file, 'read') or not hasattr(file, 'name'):
+        raise ValueError('file must have a read method and name attribute.')
+    return await client.workspace_file_create(wid, content=file, **kwargs)
+
+
+class AsyncQueryIterator:
+    """Asynchronous iterator over the rows of a metadata query
+
+    See :py:func:`iter_query`.
+
+    Attributes
+    ----------
+    total: int
+        The total number of rows of the query. It is ``None`` until the first
+        page has been received.
+
+    """
+
+    def __init__(self, client, wid, query_obj, limit=None, per_page=100, prefetch=2):
+        self.total = None
+        self.limit = limit
+        self.per_page = per_page if limit is None else min(per_page, limit)
+        self.prefetch = prefetch
+        self._client = client
+        self._wid = wid
+        self._query_obj = query_obj
+        self._generator = self._generate()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._generator.__anext__()
+
+    async def aclose(self):
+        """Stop the iteration and cancel the pages requested in advance"""
+        await self._generator.aclose()
+
+    async def _create(self):
+        client = self._client
+        if self._wid is None:
+            return await client.call_api_json(client.public_query_create, self._query_obj,
+                                              per_page=self.per_page)
+        return await client.call_api_json(client.workspace_query_create, self._wid, self._query_obj,
+                                          per_page=self.per_page)
+
+    async def _fetch(self, query_id, page, per_page):
+        client = self._client
+        if self._wid is None:
+            return await client.call_api_json(client.public_query_details, query_id,
+                                              page=page, per_page=per_page)
+        return await client.call_api_json(client.workspace_query_details, self._wid, query_id,
+                                          page=page, per_page=per_page)
+
+    async def _generate(self):
+        first = await self._create()
+        self.total = first['total']
+        end = self.total if self.limit is None else min(self.total, self.limit)
+        count = 0
+        pending = collections.deque()
+        try:
+            first_rows = (first['results'] or [])[:end]
+            if 0 < len(first_rows) < min(self.per_page, end):
+                # The server sent fewer rows than requested: it may limit the
+                # page size
+                self.per_page = len(first_rows)
+            for row in first_rows:
+                yield row
+                count += 1
+
+            # Continue at the page of the next row. The query creation may not
+            # honor per_page, so this page may have rows already yielded
+            page = count // self.per_page + 1
+            while count < end:
+                while len(pending) < max(self.prefetch, 1) and (page - 1) * self.per_page < end:
+                    future = asyncio.ensure_future(self._fetch(first['id'], page, self.per_page))
+                    pending.append((page, self.per_page, future))
+                    page += 1
+                number, per_page, future = pending.popleft()
+                response = await future
+                results = response['results'] or []
+                if not results:
+                    return
+                offset = (number - 1) * per_page
+                capped = server_page_size(number, per_page, response['total'], len(results),
+                                          response.get('pages'))
+                if capped is not None or offset > count:
+                    # The page offsets of the server do not correspond to the
+                    # requested page size: request the next pages again
+                    if capped is not None:
+                        logger.debug('Server limits the page size to %d rows', capped)
+                        self.per_page = capped
+                    while pending:
+                        pending.popleft()[2].cancel()
+                    page = count // self.per_page + 1
+                    continue
+                rows = results[count - offset:end - offset]
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+                    count += 1
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+def iter_query(client, wid, query_contents, dialect='postgresql', limit=None, per_page=100, prefetch=2):
+    """Iterate asynchronously over the results of a metadata query.
+
+    This is the asynchronous version of
+    :py:func:`quetzal.client.helpers.query.iter_query`. The query is created
+    when the iteration starts, and its results are requested `per_page` rows
+    at a time, with at most `prefetch` pages requested concurrently in
+    advance. Rows are decoded as plain objects and yielded in order. When
+    the server sends fewer rows per page than requested, the page size is
+    lowered to its maximum page size.
+
+    Returns
+    -------
+    AsyncQueryIterator
+        Asynchronous iterator over the rows of the query results.
+
+    """
+    query_obj = {
+        'dialect': dialect,
+        'query': query_contents,
+    }
+    return AsyncQueryIterator(client, wid, query_obj, limit=limit, per_page=per_page, prefetch=prefetch)
+
+
+async def query(client, wid, query_contents, dialect='postgresql', limit=None, prefetch=2):
+    """ Query metadata.
+
+    This is the asynchronous version of
+    :py:func:`quetzal.client.helpers.query.query`.
+
+    Returns
+    -------
+    results, total: list, int
+        Rows of the query results, and the total number of rows.
+
+    """
+    rows = iter_query(client, wid, query_contents, dialect, limit=limit, prefetch=prefetch)
+    results = [row async for row in rows]
+    return results, rows.total or 0
+
+
+async def wait_for_workspace(client, wid, retry_predicate, progress=None, interval=1):
+    """ Poll the details of a workspace until a predicate is no longer true.
+
+    This is the asynchronous version of
+    :py:func:`quetzal.client.helpers.workspace.wait_for_workspace`. The
+    workspace details are requested every `interval` seconds.
+
+    Returns
+    -------
+    w_details: quetzal.openapi_client.models.Workspace
+        Details on the workspace; the result of the latest workspace detail
+        call.
+
+    """
+    progress = progress or {}
+    progress_func = progress.get('func')
+    progress_clear = progress.get('clear')
+    progress_args = progress.get('args', ())
+    progress_kwargs = progress.get('kwargs', {})
+
+    while True:
+        w_details = await client.workspace_details(wid)
+        if progress_func:
+            progress_func(w_details, *progress_args, **progress_kwargs)
+        if not retry_predicate(w_details):
+            break
+        await asyncio.sleep(interval)
+
+    if progress_clear:
+        progress_clear(w_details, *progress_args, **progress_kwargs)
+    return w_details
@@ -1,26 +1,39 @@
 import functools
+import inspect
 import io
+import json
 import logging
+import mimetypes
+import os
 import re
+import socket
 import textwrap
+import threading
+import time
 import urllib.parse
 import warnings
+import weakref
 
-import backoff
 import six
 import urllib3
 from requests import codes
 
 from quetzal.openapi_client.api_client import ApiClient
-from quetzal.openapi_client.rest import RESTClientObject
+from quetzal.openapi_client.rest import RESTClientObject, RESTResponse
 from quetzal.openapi_client.api import AuthenticationApi, DataApi
+from quetzal.openapi_client.models import Workspace
 from quetzal.openapi_client.rest import ApiException
+from quetzal.client.cache import BlobStore, MetadataCache, WorkspaceIdCache
+from quetzal.client.config import Configuration, DEFAULT_CHUNK_SIZE, get_option
 from quetzal.client.exceptions import QuetzalAPIException, RetryableException
+from quetzal.client.retry import RetryPolicy
+from quetzal.client.tokens import SavedToken, TokenManager, TokenStore, token_expiration
 
 logger = logging.getLogger(__name__)
 
-# Size of chunk for uploading data as chunked multi-part
-CHUNK_SIZE = (32 << 20)  # 32 Mb
+# Default size of chunk for uploading data as chunked multi-part. The size used
+# by a client is set by its configuration chunk_size
+CHUNK_SIZE = DEFAULT_CHUNK_SIZE
 
 
 def _log_auth_backoff(details):
@@ -36,6 +49,8 @@ def _retry_login(details):
     client = args[0]
     config = client.configuration
     tries = details['tries']
+    if getattr(details.get('exception'), 'status', None) != codes.unauthorized:
+        return
     if not config.username:
         logger.debug('Will not retry a login, there is no username set')
         return
@@ -44,28 +59,73 @@ def _retry_login(details):
         return
     try:
         logger.debug('Refreshing access token...')
-        client.login()
+        client.refresh_token(_sent_token.get(None))
     except:
         logger.warning('Could not login')
 
 
-def _should_giveup(e):
-    if isinstance(e, RetryableException):
-        if e.status == codes.unauthorized:
-            logger.debug('Retrying due to unauthorized error')
-        return False
-    return True
+class _ThreadLocalVar(threading.local):
+    """Per-thread replacement of contextvars.ContextVar, before Python 3.7"""
+
+    def get(self, default=None):
+        return getattr(self, 'value', default)
+
+    def set(self, value):
+        self.value = value
 
 
-_auth_retry_decorator = backoff.on_exception(
-    backoff.expo,
-    RetryableException,
-    max_tries=10,
-    max_time=30,
-    giveup=_should_giveup,
-    on_backoff=[_log_auth_backoff, _retry_login],
-    max_value=5,
-)
+# Access token sent by the last request of the current thread or task, so that
+# a login after a 401 response only replaces that token
+try:
+    import contextvars
+    _sent_token = contextvars.ContextVar('_sent_token')
+except ImportError:
+    _sent_token = _ThreadLocalVar()
+
+
+def _auth_retry_decorator(func):
+    """Retry the API calls of a client that fail with a RetryableException
+
+    Retries follow the :py:class:`quetzal.client.retry.RetryPolicy` of the
+    client, and unauthorized calls are retried after a login.
+    """
+    @functools.wraps(func)
+    def wrapper(client, *args, **kwargs):
+        policy = client.retry_policy
+        resource_path, method = _call_api_operation(args, kwargs)
+        policy.on_request()
+        start = time.monotonic()
+        tries = 0
+        while True:
+            tries += 1
+            try:
+                return func(client, *args, **kwargs)
+            except RetryableException as ex:
+                elapsed = time.monotonic() - start
+                wait = policy.delay(ex, tries)
+                if not policy.should_retry(ex, method, resource_path, tries, elapsed, wait):
+                    raise
+                details = _retry_details(func, client, args, kwargs, tries, elapsed, wait, ex)
+                _log_auth_backoff(details)
+                _retry_login(details)
+                time.sleep(wait)
+
+    return wrapper
+
+
+def _call_api_operation(args, kwargs):
+    """Get the resource path and method of the arguments of call_api"""
+    resource_path = args[0] if args else kwargs.get('resource_path')
+    method = args[1] if len(args) > 1 else kwargs.get('method')
+    return resource_path, method
+
+
+def _retry_details(func, client, args, kwargs, tries, elapsed, wait, exception):
+    """Details of a retry given to its handlers, as the backoff package does"""
+    return {
+        'target': func, 'args': (client, ) + tuple(args), 'kwargs': kwargs,
+        'tries': tries, 'elapsed': elapsed, 'wait': wait, 'exception': exception,
+    }
 
 
 class CustomDataApi(DataApi):
@@ -76,12 +136,126 @@ class CustomDataApi(DataApi):
     "application/json" even if we want "application/octet-stream". This is
     handled by re-writing the workspace_file_details_with_http_info and
     the public_file_details_with_http_info functions.
+
+    These functions also accept a `_headers` keyword argument with extra
+    headers for the request, such as a `Range` header to download only a part
+    of the file contents.
+
+    Moreover, the generated code reads the complete contents of a file in
+    memory when uploading it. The workspace_file_create_with_http_info
+    function is re-written to send the file contents as a stream instead.
     """
 
+    def workspace_file_create_with_http_info(self, wid, **kwargs):
+        """Workaround of the original workspace_file_create_with_http_info
+
+        Sends the `content` file, which can be a filename or a file object,
+        as a :py:class:`MultipartStream` body instead of a form parameter
+        that would be read completely in memory.
+        """
+        content = kwargs.pop('content', None)
+        if content is None:
+            return super().workspace_file_create_with_http_info(wid, **kwargs)
+
+        if isinstance(content, (str, os.PathLike)):
+            file_obj = open(content, 'rb')
+            try:
+                result = self._workspace_file_create_stream(wid, file_obj, **kwargs)
+            except BaseException:
+                file_obj.close()
+                raise
+            if inspect.isawaitable(result):
+                # The file is read when the coroutine of an asynchronous
+                # client is awaited: close it afterwards
+                return _close_after(result, file_obj)
+            file_obj.close()
+            return result
+        return self._workspace_file_create_stream(wid, content, **kwargs)
+
+    def _workspace_file_create_stream(self, wid, file_obj, **kwargs):
+        local_var_params = locals()
+
+        all_params = ['wid', 'path', 'temporary']  # noqa: E501
+        all_params.append('async_req')
+        all_params.append('_return_http_data_only')
+        all_params.append('_preload_content')
+        all_params.append('_request_timeout')
+
+        for key, val in six.iteritems(local_var_params['kwargs']):
+            if key not in all_params:
+                raise TypeError(
+                    "Got an unexpected keyword argument '%s'"
+                    " to method workspace_file_create" % key
+                )
+            local_var_params[key] = val
+        del local_var_params['kwargs']
+        # verify the required parameter 'wid' is set
+        if ('wid' not in local_var_params or
+                local_var_params['wid'] is None):
+            raise ValueError("Missing the required parameter `wid` when calling `workspace_file_create`")  # noqa: E501
+
+        collection_formats = {}
+
+        path_params = {}
+        if 'wid' in local_var_params:
+            path_params['wid'] = local_var_params['wid']  # noqa: E501
+
+        query_params = []
+        if 'path' in local_var_params:
+            query_params.append(('path', local_var_params['path']))  # noqa: E501
+        if 'temporary' in local_var_params:
+            query_params.append(('temporary', local_var_params['temporary']))  # noqa: E501
+
+        header_params = {}
+
+        body_params = MultipartStream('content', file_obj,
+                                      chunk_size=get_option(self.api_client.configuration, 'chunk_size'),
+                                      budget=self.api_client.transfer_budget)
+        transfer = self.api_client.new_transfer(
+            'upload', os.path.basename(getattr(file_obj, 'name', 'content')), body_params.size)
+        body_params.transfer = transfer
+        # HTTP header `Accept`
+        header_params['Accept'] = self.api_client.select_header_accept(
+            ['application/json', 'application/problem+json'])  # noqa: E501
+
+        # HTTP header `Content-Type`
+        header_params['Content-Type'] = body_params.content_type
+
+        # Authentication setting
+        auth_settings = ['apiKey', 'bearer']  # noqa: E501
+
+        transfer.start()
+        try:
+            result = self.api_client.call_api(
+                '/data/workspaces/{wid}/files/', 'POST',
+                path_params,
+                query_params,
+                header_params,
+                body=body_params,
+                post_params=[],
+                files={},
+                response_type='BaseMetadata',  # noqa: E501
+                auth_settings=auth_settings,
+                async_req=local_var_params.get('async_req'),
+                _return_http_data_only=local_var_params.get('_return_http_data_only'),  # noqa: E501
+                _preload_content=local_var_params.get('_preload_content', True),
+                _request_timeout=local_var_params.get('_request_timeout'),
+                collection_formats=collection_formats)
+        except Exception as ex:
+            transfer.fail(ex)
+            raise
+        if inspect.isawaitable(result):
+            # Asynchronous clients return a coroutine: the upload happens
+            # when it is awaited
+            return _await_transfer(result, transfer)
+        transfer.finish()
+        return result
+
     def workspace_file_details_with_http_info(self, wid, uuid, **kwargs):
         """Copy/paste and workaround the original workspace_file_details_with_http_info
 
          Accepts an application/octet-stream according to the _accept kwarg
+         and extra request headers according to the _headers kwarg
          """
         local_var_params = locals()
 
@@ -91,6 +265,7 @@ class CustomDataApi(DataApi):
         all_params.append('_preload_content')
         all_params.append('_request_timeout')
         all_params.append('_accept')
+        all_params.append('_headers')
 
         for key, val in six.iteritems(local_var_params['kwargs']):
             if key not in all_params:
@@ -129,6 +304,7 @@ class CustomDataApi(DataApi):
         header_params['Accept'] = local_var_params.get('_accept', self.api_client.select_header_accept(
             ['application/json', 'application/octet-stream', 'application/problem+json'])  # noqa: E501
         )
+        header_params.update(local_var_params.get('_headers') or {})
 
         # Authentication setting
         auth_settings = ['apiKey', 'bearer']  # noqa: E501
@@ -153,6 +329,7 @@ class CustomDataApi(DataApi):
         """Copy/paste and workaround the original public_file_details_with_http_info
 
          Accepts an application/octet-stream according to the _accept kwarg
+         and extra request headers according to the _headers kwarg
          """
 
         local_var_params = locals()
@@ -163,6 +340,7 @@ class CustomDataApi(DataApi):
         all_params.append('_preload_content')
         all_params.append('_request_timeout')
         all_params.append('_accept')
+        all_params.append('_headers')
 
         for key, val in six.iteritems(local_var_params['kwargs']):
             if key not in all_params:
@@ -195,6 +373,7 @@ class CustomDataApi(DataApi):
         header_params['Accept'] = local_var_params.get('_accept', self.api_client.select_header_accept(
             ['application/json', 'application/octet-stream', 'application/problem+json'])  # noqa: E501
         )
+        header_params.update(local_var_params.get('_headers') or {})
 
         # Authentication setting
         auth_settings = ['apiKey', 'bearer']  # noqa: E501
@@ -216,6 +395,23 @@ class CustomDataApi(DataApi):
             collection_formats=collection_formats)
 
 
+async def _await_transfer(coroutine, transfer):
+    try:
+        result = await coroutine
+    except Exception as ex:
+        transfer.fail(ex)
+        raise
+    transfer.finish()
+    return result
+
+
+async def _close_after(coroutine, file_obj):
+    try:
+        return await coroutine
+    finally:
+        file_obj.close()
+
+
 class MetaClient(type):
     """Metaclass that converts the API operation methods to a shorter name
 
@@ -267,12 +463,40 @@ class MetaClient(type):
 
 class Client(ApiClient, metaclass=MetaClient):
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, configuration=None, header_name=None, header_value=None,
+                 cookie=None, pool_threads=1):
+        if configuration is None:
+            configuration = Configuration()
+        # Set the attributes of ApiClient.__init__ without calling it: it
+        # creates a REST client and its connection pools, which are replaced
+        # by the ones of _new_rest_client
+        self.configuration = configuration
+        self.pool_threads = pool_threads
+        self.default_headers = {}
+        if header_name is not None:
+            self.default_headers[header_name] = header_value
+        self.cookie = cookie
+        self.user_agent = 'OpenAPI-Generator/0.1.0/python'
         self._auth_api = AuthenticationApi(self)
         self._data_api = CustomDataApi(self)
         self.default_headers['Cache-Control'] = 'no-cache'
-        self.rest_client = CustomRestClient(self.configuration)
+        self.rest_client = self._new_rest_client()
+        self.transfer_budget = TransferBudget(get_option(configuration, 'max_bytes_in_flight'),
+                                              shared_with=PROCESS_TRANSFER_BUDGET)
+        self.transfer_listeners = []
+        self.retry_policy = get_option(configuration, 'retry_policy') or RetryPolicy()
+        self._metadata_cache = None
+        self._download_cache = None
+        self._workspace_cache = None
+        self._token_store = None
+        # Access token obtained by a login or restored from the token store,
+        # with its expiration time
+        self._tokens = TokenManager()
+        self._cache_lock = threading.Lock()
+
+    def _new_rest_client(self):
+        """Create the object that sends the requests of this client"""
+        return CustomRestClient(self.configuration)
 
     @property
     def auth_api(self):
@@ -282,6 +506,19 @@ class Client(ApiClient, metaclass=MetaClient):
     def data_api(self):
         return self._data_api
 
+    @property
+    def pool_stats(self):
+        """Statistics of the connection pools of this client
+
+        Returns
+        -------
+        PoolStats
+            Counters of the connections created, reused, discarded and
+            waited for by the requests of this client.
+
+        """
+        return self.rest_client.stats
+
     @_auth_retry_decorator
     def call_api(self, *args, **kwargs):
         # Patch for query create. The openapi-generator incorrectly assumes that
@@ -300,18 +537,27 @@ class Client(ApiClient, metaclass=MetaClient):
             kwargs['auth_settings'] = auth_settings
 
         # Patch in to login with basic authentication before trying a
-        # bearer-protected endpoint
-        if 'bearer' in auth_settings and not self.configuration.access_token and not self.configuration.api_key:
-            logger.debug('Trying to access an endpoint with bearer authentication, '
-                         'but there is no saved access_token. Logging in...')
-            self.login()
+        # bearer-protected endpoint, or when the token is about to expire
+        if 'bearer' in auth_settings and not self.configuration.api_key:
+            saved = self._tokens.current
+            if saved is None and not self.configuration.access_token:
+                logger.debug('Trying to access an endpoint with bearer authentication, '
+                             'but there is no access_token. Restoring it or logging in...')
+                self.refresh_token()
+            elif self._token_expiring(saved):
+                logger.debug('Access token is about to expire. Logging in...')
+                self.refresh_token(saved.token)
+            _sent_token.set(self.access_token)
+            self._tokens.touch()
 
         # Call the api, but check for 401 errors that may be retried with the
         # correct authentication; that is, by doing a login again because the
         # token may be outdated
+        path_params = args[2] if len(args) > 2 else kwargs.get('path_params') or {}
         try:
-            return super().call_api(*args, **kwargs)
+            result = super().call_api(*args, **kwargs)
         except ApiException as api_ex:
+            self._forget_deleted_workspace(path_params, status=api_ex.status)
             may_retry_to_authorize = (resource_path != '/auth/token')
             raise QuetzalAPIException.from_api_exception(api_ex, authorize_ok=may_retry_to_authorize) from api_ex
         except urllib3.exceptions.MaxRetryError as ex:
@@ -320,77 +566,821 @@ class Client(ApiClient, metaclass=MetaClient):
                               'insecure option if you are using a local '
                               'https server', UserWarning)
             raise
+        self._forget_deleted_workspace(path_params, result=result)
+        return result
+
+    def _forget_deleted_workspace(self, path_params, status=None, result=None):
+        """Remove a workspace from the workspace cache when a request shows it was deleted
+
+        Deleted workspaces keep their identifier, with a *DELETED* status. The
+        workspace of a request is forgotten when the request fails with a
+        *404* error, or with a *400* or *412* error as the requests on deleted
+        workspaces do, and when the response has the details of a deleted
+        workspace.
+        """
+        if isinstance(result, tuple):
+            result = result[0] if result else None
+        wid = None
+        if isinstance(result, Workspace) and result.status == 'DELETED':
+            wid = result.id
+        elif 'wid' in (path_params or {}) and (status in (codes.bad_request, codes.precondition_failed) or
+                                               status == codes.not_found and set(path_params) == {'wid'}):
+            wid = path_params['wid']
+        if wid is None:
+            return
+        cache = self.workspace_cache
+        if cache is not None:
+            cache.invalidate(self.configuration.host, int(wid))
+
+    def sanitize_for_serialization(self, obj):
+        # Streamed bodies are sent as they are
+        if isinstance(obj, MultipartStream):
+            return obj
+        return super().sanitize_for_serialization(obj)
+
+    @property
+    def metadata_cache(self):
+        """Local cache of file metadata, or ``None`` when it is not enabled
+
+        The cache is enabled by the `metadata_cache` option of the client
+        configuration, and created when it is first used.
+        """
+        config = self.configuration
+        if not get_option(config, 'metadata_cache'):
+            return None
+        with self._cache_lock:
+            if self._metadata_cache is None:
+                self._metadata_cache = MetadataCache(get_option(config, 'metadata_cache_path'),
+                                                     max_entries=get_option(config, 'metadata_cache_size'))
+            return self._metadata_cache
+
+    @property
+    def download_cache(self):
+        """Local store of downloaded files, or ``None`` when it is not enabled
+
+        The store is enabled by the `download_cache` option of the client
+        configuration, and created when it is first used.
+        """
+        config = self.configuration
+        if not get_option(config, 'download_cache'):
+            return None
+        with self._cache_lock:
+            if self._download_cache is None:
+                self._download_cache = BlobStore(get_option(config, 'download_cache_path'),
+                                                 max_size=get_option(config, 'download_cache_size'))
+            return self._download_cache
+
+    @property
+    def workspace_cache(self):
+        """Local cache of workspace identifiers, or ``None`` when it is not enabled
+
+        The cache is enabled by the `workspace_cache` option of the client
+        configuration. Entries of a workspace are removed when a request shows
+        that it was deleted (see :py:meth:`_forget_deleted_workspace`).
+        """
+        config = self.configuration
+        if not get_option(config, 'workspace_cache'):
+            return None
+        with self._cache_lock:
+            if self._workspace_cache is None:
+                self._workspace_cache = WorkspaceIdCache(get_option(config, 'workspace_cache_path'))
+            return self._workspace_cache
+
+    @property
+    def token_store(self):
+        """Local store of access tokens, or ``None`` when it is not enabled
+
+        The store is enabled by the `token_cache` option of the client
+        configuration. Tokens obtained by :py:meth:`login` are saved there and
+        reused by later clients of the same user, instead of logging in again.
+        """
+        config = self.configuration
+        if not get_option(config, 'token_cache'):
+            return None
+        with self._cache_lock:
+            if self._token_store is None:
+                self._token_store = TokenStore(get_option(config, 'token_cache_path'),
+                                               lifetime=get_option(config, 'token_lifetime'))
+            return self._token_store
+
+    def call_api_raw(self, func, *args, **kwargs):
+        """Call an API method and get the undecoded body of its response
+
+        Parameters
+        ----------
+        func: callable
+            Method of this client, such as :py:meth:`workspace_file_fetch`.
+        *args, **kwargs
+            Arguments of `func`.
+
+        Returns
+        -------
+        bytes
+            The body of the response.
+
+        """
+        response = func(*args, _preload_content=False, **kwargs)
+        try:
+            return response.data
+        finally:
+            response.release_conn()
+
+    def call_api_json(self, func, *args, **kwargs):
+        """Call an API method and decode its JSON response as plain objects
+
+        The generated API methods deserialize every response into model
+        objects. For bulk reads, such as long lists of files, this is costly
+        and unnecessary when the results are used as dictionaries. This method
+        decodes the response of `func` directly into dictionaries and lists,
+        without creating any model object. Note that values such as dates are
+        not converted and remain strings.
+
+        Parameters
+        ----------
+        func: callable
+            Method of this client, such as :py:meth:`workspace_file_fetch`.
+        *args, **kwargs
+            Arguments of `func`.
+
+        Returns
+        -------
+        dict or list
+            The decoded response.
+
+        """
+        return json.loads(self.call_api_raw(func, *args, **kwargs))
+
+    def add_transfer_listener(self, listener):
+        """Register a :py:class:`TransferListener` for all transfers of this client"""
+        self.transfer_listeners.append(listener)
+
+    def remove_transfer_listener(self, listener):
+        self.transfer_listeners.remove(listener)
+
+    def new_transfer(self, direction, name, total=None):
+        """Create a :py:class:`Transfer` that notifies the listeners of this client"""
+        return Transfer(direction, name, total, self.transfer_listeners)
 
     @property
     def can_login(self):
         return self.configuration.username and self.configuration.password
 
+    @property
+    def access_token(self):
+        """Access token sent by the requests of this client
+
+        This is the token obtained by the last login of this client, or the
+        `access_token` of its configuration when it did not login.
+        """
+        saved = self._tokens.current
+        return saved.token if saved is not None else self.configuration.access_token
+
     def login(self):
         if not self.can_login:
             return
         response = self.auth_get_token()
-        self.configuration.access_token = response.token
+        self.set_token(response.token)
+
+    def refresh_token(self, stale=None):
+        """Restore or obtain a new access token, once for all the threads
+
+        Threads that find that the `stale` token has expired, or was rejected
+        by the server, call this method at the same time: the first one
+        restores a token from the token store, or does a login, and the
+        others use its token.
+
+        Parameters
+        ----------
+        stale: str, optional
+            The outdated access token, or ``None`` when there is no token.
+
+        """
+        def obtain():
+            if not self._restore_token(exclude=stale):
+                self.login()
+
+        self._tokens.refresh(stale, obtain)
+
+    def set_token(self, token):
+        """Use an access token obtained by a login, and save it in the token store"""
+        config = self.configuration
+        store = self.token_store
+        if store is not None and config.username:
+            saved = store.put(config.host, config.username, token)
+        else:
+            saved = SavedToken(token, token_expiration(token))
+        self._tokens.set(saved)
+        config.access_token = token
+        self._schedule_token_refresh(saved)
+
+    def clear_token(self):
+        """Forget the access token, also in the token store"""
+        config = self.configuration
+        self._tokens.set_timer(None)
+        self._tokens.set(None)
+        config.access_token = ''
+        if self.token_store is not None and config.username:
+            self.token_store.remove(config.host, config.username)
+
+    def update_params_for_auth(self, headers, querys, auth_settings):
+        super().update_params_for_auth(headers, querys, auth_settings)
+        # Send the access token of this client rather than the one of its
+        # configuration, which may be shared with other clients
+        if auth_settings and 'bearer' in auth_settings and self._tokens.current is not None:
+            headers['Authorization'] = 'Bearer ' + self._tokens.current.token
+
+    def _restore_token(self, exclude=None):
+        """Use the saved access token of the user, if there is one still valid
+
+        A saved token equal to `exclude`, such as a token just rejected by
+        the server, is not used.
+        """
+        config = self.configuration
+        store = self.token_store
+        if store is None or not config.username:
+            return False
+        saved = store.get(config.host, config.username, margin=get_option(config, 'token_refresh_margin'))
+        if saved is None or saved.token == exclude:
+            return False
+        logger.debug('Using saved access token of %s', config.username)
+        self._tokens.set(saved)
+        config.access_token = saved.token
+        self._schedule_token_refresh(saved)
+        return True
+
+    def _schedule_token_refresh(self, saved):
+        """Renew the access token in a background thread before it expires"""
+        delay = self._token_refresh_delay(saved)
+        if delay is None:
+            return
+        timer = threading.Timer(delay, _refresh_token_in_background, args=(weakref.ref(self), saved.token))
+        timer.daemon = True
+        self._tokens.set_timer(timer)
+        timer.start()
+
+    def _token_refresh_delay(self, saved):
+        """Seconds until the background refresh of a token, or ``None`` when it is not renewed
+
+        Tokens are renewed when they expire in less than twice the refresh
+        margin, so that requests never find them about to expire, or in the
+        middle of their remaining lifetime for tokens that are shorter than
+        that.
+        """
+        config = self.configuration
+        if not get_option(config, 'token_background_refresh') or saved.expires is None or not self.can_login:
+            return None
+        remaining = saved.expires - time.time()
+        return max(remaining - 2 * get_option(config, 'token_refresh_margin'), remaining / 2, 0)
+
+    def _token_expiring(self, saved=None):
+        """Whether the access token expires in less than the refresh margin"""
+        saved = saved or self._tokens.current
+        if saved is None or saved.expires is None or not self.can_login:
+            return False
+        return saved.expires - get_option(self.configuration, 'token_refresh_margin') <= time.time()
+
+
+def _refresh_token_in_background(client_ref, token):
+    # The timer only keeps a weak reference to the client, so that clients
+    # that are not used anymore are not kept alive until their token expires
+    client = client_ref()
+    if client is None:
+        return
+    if not client._tokens.used:
+        logger.debug('Access token was not used since its last renewal, it will not be renewed')
+        return
+    try:
+        logger.debug('Renewing access token before it expires...')
+        client.refresh_token(token)
+    except Exception:
+        logger.warning('Could not renew the access token, it will be renewed by the next request',
+                       exc_info=True)
 
 
 class CustomRestClient(RESTClientObject):
 
-    def __init__(self, configuration, pools_size=4, maxsize=None):
+    def __init__(self, configuration, pools_size=None, maxsize=None):
+        if pools_size is None:
+            pools_size = get_option(configuration, 'connection_pools')
         super().__init__(configuration, pools_size, maxsize)
 
+        # Statistics of the connection pools, shared by all the pools of
+        # this client
+        self.stats = PoolStats()
+
+        pool_kw = {
+            k: v for k, v in self.pool_manager.connection_pool_kw.items()
+            if not k.startswith('_proxy')
+        }
+        pool_kw['block'] = get_option(configuration, 'connection_pool_block')
+        if get_option(configuration, 'keep_alive'):
+            pool_kw['socket_options'] = _keep_alive_socket_options(get_option(configuration, 'keep_alive_idle'))
+
         # override https pool manager
         if configuration.proxy:
             self.pool_manager = CustomProxyManager(
+                proxy_url=configuration.proxy,
                 num_pools=pools_size,
-                **self.pool_manager.connection_pool_kw
+                stats=self.stats,
+                chunk_size=get_option(configuration, 'chunk_size'),
+                **pool_kw
             )
         else:
             self.pool_manager = CustomPoolManager(
                 num_pools=pools_size,
-                **self.pool_manager.connection_pool_kw
+                stats=self.stats,
+                chunk_size=get_option(configuration, 'chunk_size'),
+                **pool_kw
             )
 
+    def request(self, method, url, query_params=None, headers=None,
+                body=None, post_params=None, _preload_content=True,
+                _request_timeout=None):
+        if not isinstance(body, MultipartStream):
+            return super().request(method, url, query_params=query_params, headers=headers,
+                                   body=body, post_params=post_params,
+                                   _preload_content=_preload_content,
+                                   _request_timeout=_request_timeout)
+
+        # Streamed multipart body: send it with a chunked transfer encoding
+        headers = dict(headers or {})
+        headers['Content-Type'] = body.content_type
+        if query_params:
+            url += '?' + urllib.parse.urlencode(query_params)
+
+        timeout = None
+        if isinstance(_request_timeout, int):
+            timeout = urllib3.Timeout(total=_request_timeout)
+        elif isinstance(_request_timeout, tuple) and len(_request_timeout) == 2:
+            timeout = urllib3.Timeout(connect=_request_timeout[0], read=_request_timeout[1])
+
+        try:
+            r = self.pool_manager.urlopen(method, url, body=iter(body), headers=headers,
+                                          chunked=True, preload_content=_preload_content,
+                                          timeout=timeout)
+        except urllib3.exceptions.SSLError as e:
+            msg = "{0}\n{1}".format(type(e).__name__, str(e))
+            raise ApiException(status=0, reason=msg)
+
+        if _preload_content:
+            r = RESTResponse(r)
+            r.data = r.data.decode('utf8')
+            logger.debug('response body: %s', r.data)
+
+        if not 200 <= r.status <= 299:
+            raise ApiException(http_resp=r)
+
+        return r
+
+
+class PoolStats:
+    """Counters of the connections of the pools of a client
+
+    Use them to size the connection pools of a client shared by many
+    threads: connections are reused when :py:attr:`connections_reused` is
+    close to :py:attr:`requests`. Many discarded connections mean that
+    the pools are too small for the number of threads and that connections
+    are opened and closed for each request; many waits mean that requests
+    of blocking pools are waiting for a free connection.
+
+    Attributes
+    ----------
+    requests: int
+        Number of connections taken from the pools.
+    connections_created: int
+        Number of new connections opened.
+    connections_discarded: int
+        Number of connections closed because their pool was full.
+    waits: int
+        Number of times that a request waited for a free connection of a
+        blocking pool.
+    wait_time: float
+        Total time, in seconds, spent waiting for a free connection.
+
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_discarded = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def connections_reused(self):
+        """Number of requests that used a connection opened before"""
+        return max(self.requests - self.connections_created, 0)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'connections_created': self.connections_created,
+                'connections_reused': self.connections_reused,
+                'connections_discarded': self.connections_discarded,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+            }
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={v!r}' for k, v in self.as_dict().items())
+        return f'{self.__class__.__name__}({fields})'
+
+    def _add(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
 
-class CustomPoolManager(urllib3.PoolManager):
+class _StatsPoolMixin:
+    """Counts the connections of a urllib3 connection pool in a PoolStats"""
+
+    stats = None
+
+    def _new_conn(self):
+        if self.stats is not None:
+            self.stats._add('connections_created')
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        if self.stats is None:
+            return super()._get_conn(timeout)
+        must_wait = self.block and self.pool is not None and self.pool.empty()
+        start = time.monotonic()
+        conn = super()._get_conn(timeout)
+        self.stats._add('requests')
+        if must_wait:
+            self.stats._add('waits')
+            self.stats._add('wait_time', time.monotonic() - start)
+        return conn
+
+    def _put_conn(self, conn):
+        if self.stats is not None and conn is not None and self.pool is not None and self.pool.full():
+            self.stats._add('connections_discarded')
+        super()._put_conn(conn)
+
+
+class _StatsHTTPConnectionPool(_StatsPoolMixin, urllib3.HTTPConnectionPool):
+    pass
+
+
+class _StatsHTTPSConnectionPool(_StatsPoolMixin, urllib3.HTTPSConnectionPool):
+    pass
+
+
+class _StatsPoolManagerMixin:
+    """Creates connection pools that count their connections in a PoolStats
+
+    Request bodies that are not streamed are sent in chunks of `chunk_size`
+    bytes.
+    """
+
+    def __init__(self, *args, stats=None, chunk_size=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.pool_classes_by_scheme = {
+            'http': _StatsHTTPConnectionPool,
+            'https': _StatsHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, *args, **kwargs):
+        pool = super()._new_pool(*args, **kwargs)
+        pool.stats = self.stats
+        return pool
+
+
+class CustomPoolManager(_StatsPoolManagerMixin, urllib3.PoolManager):
 
     def urlopen(self, method, url, redirect=True, **kw):
-        kw = _patch_urlopen_keywords(method, url, redirect, kw)
+        kw = _patch_urlopen_keywords(method, url, redirect, kw, self.chunk_size)
         return super().urlopen(method, url, redirect, **kw)
 
 
-class CustomProxyManager(urllib3.ProxyManager):
+class CustomProxyManager(_StatsPoolManagerMixin, urllib3.ProxyManager):
 
     def urlopen(self, method, url, redirect=True, **kw):
-        kw = _patch_urlopen_keywords(method, url, redirect, kw)
+        kw = _patch_urlopen_keywords(method, url, redirect, kw, self.chunk_size)
         return super().urlopen(method, url, redirect, **kw)
 
 
-def _patch_urlopen_keywords(method, url, redirect, kw):
+def _keep_alive_socket_options(idle=None):
+    """Socket options that enable TCP keep-alive probes on idle connections"""
+    options = list(urllib3.connection.HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    if idle:
+        # Not all platforms can set the keep-alive intervals
+        idle = max(int(idle), 1)
+        for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', max(idle // 4, 1)),
+                            ('TCP_KEEPCNT', 4)):
+            if hasattr(socket, name):
+                options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+def _patch_urlopen_keywords(method, url, redirect, kw, chunk_size=CHUNK_SIZE):
     """urlopen patch to follow 303 responses and keep the Authorization header"""
     path = urllib.parse.urlparse(url).path
+    retries = kw.get('retries')
+    if not isinstance(retries, urllib3.util.retry.Retry):
+        retries = urllib3.util.retry.Retry.from_int(retries, redirect=redirect)
+    # Responses with a Retry-After header are retried by the retry policy of
+    # the client, not by urllib3
+    retries = retries.new(respect_retry_after_header=False)
+    kw['retries'] = retries
     if method == 'POST' and re.match('^/api/v1/data/(?:workspaces/[0-9]*/)?queries/?$', path):
         # Patch 303 retry strategy for queries, inside or outside a workspace
-        retries = kw.get('retries')
-        if not isinstance(retries, urllib3.util.retry.Retry):
-            retries = urllib3.util.retry.Retry.from_int(retries, redirect=redirect)
         retries.remove_headers_on_redirect = ()
-        kw['retries'] = retries
     elif method == 'POST' and re.match('^/api/v1/data/workspaces/[0-9]*/files/$', path):
-        # Patch 303 retry strategy for file upload
+        # Send file uploads as chunked multi-part. Streamed bodies are
+        # already an iterable of chunks
         kw['chunked'] = True
-        kw['body'] = _chunked_body_generator(kw.pop('body'))
+        body = kw.pop('body')
+        if isinstance(body, (bytes, str)):
+            body = _chunked_body_generator(body, chunk_size)
+        kw['body'] = body
     return kw
 
 
-def _chunked_body_generator(data):
+def _chunked_body_generator(data, chunk_size=CHUNK_SIZE):
     foo = io.BytesIO(data)
-    chunk = foo.read(CHUNK_SIZE)
-    n = len(data)
-    # import tqdm
-    # progress = tqdm.tqdm('Uploading file', total=n, unit='bytes')
+    chunk = foo.read(chunk_size)
     while chunk:
-        # progress.update(len(chunk))
         yield chunk
-        chunk = foo.read(CHUNK_SIZE)
-    # progress.clear()
-    # print('Finished uploading?')
+        chunk = foo.read(chunk_size)
+
+
+class TransferBudget:
+    """A limit on the number of bytes held in memory by concurrent transfers
+
+    Transfers acquire the size of a chunk before reading it and release it
+    once the chunk has been sent or written. When the limit is reached,
+    :py:meth:`acquire` blocks until other transfers release their chunks,
+    which creates a backpressure on concurrent uploads and downloads that
+    share the same budget. A single chunk larger than the limit is allowed
+    when there are no other bytes in flight, so that transfers never block
+    forever.
+
+    A budget can share its bytes in flight with another one: the limit of
+    each budget then applies to the bytes in flight of all of them. The
+    budgets of the clients share the bytes of :py:data:`PROCESS_TRANSFER_BUDGET`,
+    so that the limit holds for all the transfers of the process, whatever
+    the number of clients.
+
+    Parameters
+    ----------
+    max_bytes: int, optional
+        Maximum number of bytes in flight. When ``None``, there is no limit
+        and the bytes of this budget are not counted.
+    shared_with: TransferBudget, optional
+        Budget whose bytes in flight are shared.
+
+    """
+
+    def __init__(self, max_bytes=None, shared_with=None):
+        self.max_bytes = max_bytes
+        self._state = shared_with._state if shared_with is not None else _BudgetState()
+
+    @property
+    def in_flight(self):
+        """Number of bytes in flight of all the budgets that share them"""
+        return self._state.in_flight
+
+    def acquire(self, num_bytes):
+        if self.max_bytes is None:
+            return
+        state = self._state
+        with state.condition:
+            while state.in_flight and state.in_flight + num_bytes > self.max_bytes:
+                state.condition.wait()
+            state.in_flight += num_bytes
+
+    def release(self, num_bytes):
+        if self.max_bytes is None:
+            return
+        state = self._state
+        with state.condition:
+            state.in_flight -= num_bytes
+            state.condition.notify_all()
+
+
+class _BudgetState:
+    """Bytes in flight shared by several transfer budgets"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+
+# Budget whose bytes in flight are shared by the budgets of all the clients
+PROCESS_TRANSFER_BUDGET = TransferBudget()
+
+
+class TransferListener:
+    """Interface of the objects notified of the progress of transfers
+
+    Listeners are registered on a client with
+    :py:meth:`Client.add_transfer_listener` and receive the events of all
+    uploads and downloads made with that client. Subclasses only need to
+    override the methods of the events they are interested in. All methods
+    receive the :py:class:`Transfer` concerned by the event, whose attributes
+    give its direction, name, byte counts and timing.
+
+    Events of concurrent transfers are sent from the threads that perform
+    them, so listeners shared by several transfers must be thread-safe. An
+    exception raised by a listener is logged and does not interrupt the
+    transfer.
+    """
+
+    def on_start(self, transfer):
+        """Called when a transfer starts"""
+
+    def on_chunk(self, transfer, num_bytes):
+        """Called when a chunk of `num_bytes` bytes was sent or received"""
+
+    def on_retry(self, transfer, error):
+        """Called when a transfer is restarted or resumed after an `error`
+
+        The `error` may be ``None`` when the reason is not known, for example
+        when an upload body is sent again by a retried request.
+        """
+
+    def on_finish(self, transfer):
+        """Called when a transfer has finished successfully"""
+
+    def on_error(self, transfer, error):
+        """Called when a transfer has failed with an `error`"""
+
+
+class Transfer:
+    """An upload or download whose events are sent to transfer listeners
+
+    Parameters
+    ----------
+    direction: str
+        Either ``'upload'`` or ``'download'``.
+    name: str
+        Name of the transferred file, used to identify the transfer.
+    total: int, optional
+        Total number of bytes to transfer, when known.
+    listeners: sequence of TransferListener, optional
+        Listeners notified of the events of this transfer.
+
+    Attributes
+    ----------
+    transferred: int
+        Number of bytes transferred so far. It goes back when an upload is
+        restarted, or when a download is resumed from an earlier offset.
+    retries: int
+        Number of times that the transfer was restarted or resumed.
+    start_time: float
+        Value of :py:func:`time.monotonic` when the transfer started.
+    end_time: float
+        Value of :py:func:`time.monotonic` when the transfer finished or
+        failed, ``None`` while in progress.
+    thread_name: str
+        Name of the thread that created the transfer, which identifies the
+        worker of concurrent transfers.
+
+    """
+
+    def __init__(self, direction, name, total=None, listeners=()):
+        self.direction = direction
+        self.name = name
+        self.total = total
+        self.transferred = 0
+        self.retries = 0
+        self.start_time = None
+        self.end_time = None
+        self.thread_name = threading.current_thread().name
+        self._listeners = list(listeners)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<Transfer {self.direction} {self.name!r} {self.transferred}/{self.total}>'
+
+    @property
+    def elapsed(self):
+        """Number of seconds since the transfer started"""
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time if self.end_time is not None else time.monotonic()
+        return end_time - self.start_time
+
+    @property
+    def rate(self):
+        """Average transfer rate, in bytes per second"""
+        elapsed = self.elapsed
+        return self.transferred / elapsed if elapsed > 0 else 0.0
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self._notify('on_start')
+
+    def chunk(self, num_bytes):
+        with self._lock:
+            self.transferred += num_bytes
+        self._notify('on_chunk', num_bytes)
+
+    def retry(self, error=None, offset=None):
+        with self._lock:
+            self.retries += 1
+            if offset is not None:
+                self.transferred = offset
+        self._notify('on_retry', error)
+
+    def finish(self):
+        self.end_time = time.monotonic()
+        self._notify('on_finish')
+
+    def fail(self, error):
+        self.end_time = time.monotonic()
+        self._notify('on_error', error)
+
+    def _notify(self, event, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(self, *args)
+            except Exception:
+                logger.warning('Transfer listener %r failed on %s', listener, event, exc_info=True)
+
+
+class MultipartStream:
+    """A multipart/form-data request body with a single file
+
+    This object generates the multipart framing and the contents of a file
+    on the fly, reading the file in chunks of `chunk_size` bytes. It is meant
+    to be sent as a chunked request body, so that uploading a file does not
+    need to load it completely in memory.
+
+    Iterating over this object starts from the initial position of the file,
+    so the body can be sent again when a request is retried.
+
+    Parameters
+    ----------
+    name: str
+        Name of the form field.
+    file_obj: file-like
+        File object. It needs the `read`, `seek` and `tell` methods. When it
+        has a `name` attribute, its base name is used as the filename of the
+        form field.
+    chunk_size: int, optional
+        Number of bytes read from the file at each iteration. By default,
+        :py:data:`CHUNK_SIZE`.
+    budget: TransferBudget, optional
+        Budget of bytes in flight. Each chunk is acquired on this budget
+        before being read, and released after it has been sent.
+    transfer: Transfer, optional
+        Transfer notified of each chunk sent. Sending the body again is
+        notified as a retry of the transfer.
+
+    """
+
+    def __init__(self, name, file_obj, chunk_size=None, budget=None, transfer=None):
+        self.file_obj = file_obj
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.budget = budget or TransferBudget()
+        self.transfer = transfer
+        self.boundary = urllib3.filepost.choose_boundary()
+        self._position = file_obj.tell()
+        self._iterations = 0
+
+        filename = os.path.basename(getattr(file_obj, 'name', name))
+        field = urllib3.fields.RequestField(name=name, data=b'', filename=filename)
+        field.make_multipart(content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        self._header = f'--{self.boundary}\r\n'.encode('latin-1') + field.render_headers().encode('latin-1')
+        self._footer = f'\r\n--{self.boundary}--\r\n'.encode('latin-1')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    @property
+    def size(self):
+        """Number of bytes of the file that will be sent"""
+        try:
+            return os.fstat(self.file_obj.fileno()).st_size - self._position
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            end = self.file_obj.seek(0, io.SEEK_END)
+            self.file_obj.seek(self._position)
+            return end - self._position
+
+    def __iter__(self):
+        if self._iterations and self.transfer is not None:
+            self.transfer.retry(offset=0)
+        self._iterations += 1
+        self.file_obj.seek(self._position)
+        yield self._header
+        while True:
+            self.budget.acquire(self.chunk_size)
+            try:
+                chunk = self.file_obj.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+                if self.transfer is not None:
+                    self.transfer.chunk(len(chunk))
+            finally:
+                self.budget.release(self.chunk_size)
+        yield self._footer
 
@@ -0,0 +1,438 @@
+""" Local persistent caches of Quetzal API responses and file contents
+
+"""
+import collections
+import errno
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+from quetzal.client.utils import get_data_dir
+
+
+logger = logging.getLogger(__name__)
+
+CacheEntry = collections.namedtuple('CacheEntry', ['value', 'etag', 'stored'])
+CacheEntry.__doc__ = """An entry of a :py:class:`MetadataCache`
+
+Attributes
+----------
+value: dict
+    Cached value.
+etag: str
+    Entity tag sent by the server with the value, or ``None``.
+stored: float
+    Time, as a Unix timestamp, when the value was received or last
+    validated by the server.
+"""
+
+BlobEntry = collections.namedtuple('BlobEntry', ['checksum', 'size', 'accessed', 'path'])
+BlobEntry.__doc__ = """An entry of a :py:class:`BlobStore`
+
+Attributes
+----------
+checksum: str
+    MD5 checksum of the contents.
+size: int
+    Size of the contents, in bytes.
+accessed: float
+    Time, as a Unix timestamp, when the entry was last added or used.
+path: pathlib.Path
+    Path of the file that holds the contents in the store.
+"""
+
+# ioctl request of Linux to clone a file in copy-on-write file systems,
+# such as Btrfs and XFS
+_FICLONE = 0x40049409
+
+
+def get_cache_dir():
+    """Get the directory of the local caches, under the user's data directory"""
+    return os.path.join(get_data_dir(), 'cache')
+
+
+class MetadataCache:
+    """A persistent cache of file metadata with a least-recently-used limit
+
+    Entries are saved in a SQLite database, so that they persist across
+    processes. When there are more than `max_entries` entries, the least
+    recently used ones are removed. Entries can be used concurrently from
+    several threads and processes.
+
+    This object only stores the entries: the policy of when an entry is
+    valid is implemented by :py:func:`quetzal.client.helpers.file.metadata`.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path, optional
+        Path of the database file. By default, a file in the directory of
+        :py:func:`get_cache_dir`.
+    max_entries: int, optional
+        Maximum number of entries.
+
+    """
+
+    def __init__(self, path=None, max_entries=10000):
+        if path is None:
+            path = pathlib.Path(get_cache_dir()) / 'metadata.sqlite3'
+        self.path = pathlib.Path(path)
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                             'key TEXT PRIMARY KEY, value TEXT, etag TEXT, '
+                             'stored REAL, accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed)')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+    def get(self, key):
+        """Get an entry, or ``None`` when it is not in the cache"""
+        with self._lock:
+            row = self._db.execute('SELECT value, etag, stored FROM metadata WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE metadata SET accessed = ? WHERE key = ?', (time.time(), key))
+        return CacheEntry(json.loads(row[0]), row[1], row[2])
+
+    def put(self, key, value, etag=None):
+        """Add or replace an entry, removing the least recently used ones if needed"""
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO metadata (key, value, etag, stored, accessed) '
+                             'VALUES (?, ?, ?, ?, ?)', (key, json.dumps(value), etag, now, now))
+            self._db.execute('DELETE FROM metadata WHERE key IN ('
+                             'SELECT key FROM metadata ORDER BY accessed DESC, rowid DESC LIMIT -1 OFFSET ?)',
+                             (self.max_entries,))
+
+    def touch(self, key):
+        """Mark an entry as validated by the server"""
+        with self._lock:
+            now = time.time()
+            self._db.execute('UPDATE metadata SET stored = ?, accessed = ? WHERE key = ?', (now, now, key))
+
+    def invalidate(self, key):
+        """Remove an entry"""
+        with self._lock:
+            self._db.execute('DELETE FROM metadata WHERE key = ?', (key,))
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._db.execute('DELETE FROM metadata')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class WorkspaceIdCache:
+    """A persistent map of workspace names to workspace identifiers
+
+    Identifiers are saved in a small JSON file, keyed by the server host, the
+    workspace owner and the workspace name. The file is read on each access
+    and updated atomically, so that concurrent processes, such as the
+    commands of a script, share their entries. When there are more than
+    `max_entries` entries, the least recently added ones are removed.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path, optional
+        Path of the JSON file. By default, a file in the directory of
+        :py:func:`get_cache_dir`.
+    max_entries: int, optional
+        Maximum number of entries.
+
+    """
+
+    def __init__(self, path=None, max_entries=1000):
+        if path is None:
+            path = pathlib.Path(get_cache_dir()) / 'workspaces.json'
+        self.path = pathlib.Path(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._read())
+
+    def get(self, host, owner, name):
+        """Get the identifier of a workspace, or ``None`` when it is not in the cache"""
+        return self._read().get(self._key(host, owner, name))
+
+    def put(self, host, owner, name, wid):
+        """Save the identifier of a workspace"""
+        with self._lock:
+            entries = self._read()
+            entries.pop(self._key(host, owner, name), None)
+            entries[self._key(host, owner, name)] = wid
+            while len(entries) > self.max_entries:
+                entries.pop(next(iter(entries)))
+            self._write(entries)
+
+    def invalidate(self, host, wid):
+        """Remove the entries of a workspace identifier"""
+        with self._lock:
+            entries = self._read()
+            prefix = f'{host}|'
+            remaining = {k: v for k, v in entries.items() if not (k.startswith(prefix) and v == wid)}
+            if len(remaining) != len(entries):
+                logger.debug('Removing workspace %s from the workspace cache', wid)
+                self._write(remaining)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._write({})
+
+    @staticmethod
+    def _key(host, owner, name):
+        return f'{host}|{owner or ""}|{name}'
+
+    def _read(self):
+        try:
+            with self.path.open('r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=str(self.path.parent), prefix=f'{self.path.name}.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_name, str(self.path))
+        except OSError:
+            logger.debug('Could not save workspace cache', exc_info=True)
+
+
+class BlobStore:
+    """A content-addressed store of file contents with a size limit
+
+    Files are saved under a name derived from the MD5 checksum of their
+    contents, the same checksum that Quetzal keeps in the base metadata of
+    each file. Files with the same contents are thus stored once, regardless
+    of their workspace, path or filename.
+
+    Contents are added and retrieved as links when possible, so that neither
+    operation copies any data. The `link` methods are tried in order:
+
+    * ``'reflink'``: a copy-on-write clone, on file systems that support it.
+      The clone is independent of the stored file.
+    * ``'hardlink'``: a hard link. The linked file shares its contents with
+      the stored one; a change on one of them changes the other. The store
+      keeps the size and modification time of its files, and discards any
+      file that was modified this way.
+    * ``'copy'``: a regular copy.
+
+    When the total size of the files is over `max_size` bytes, the least
+    recently used files are removed. An index of the files and their last
+    access time is saved in a SQLite database in the store directory.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path, optional
+        Directory of the store. By default, a ``blobs`` directory in the
+        directory of :py:func:`get_cache_dir`.
+    max_size: int, optional
+        Maximum total size of the stored files, in bytes.
+    link: sequence of str, optional
+        Methods used to add and retrieve files, in order of preference.
+
+    """
+
+    link_methods = ('reflink', 'hardlink', 'copy')
+
+    def __init__(self, path=None, max_size=(10 << 30), link=None):
+        if path is None:
+            path = pathlib.Path(get_cache_dir()) / 'blobs'
+        self.path = pathlib.Path(path)
+        self.max_size = max_size
+        self.link = tuple(link or self.link_methods)
+        unknown = set(self.link) - set(self.link_methods)
+        if unknown:
+            raise ValueError(f'Unknown link methods: {", ".join(sorted(unknown))}')
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path / 'index.sqlite3'), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS blobs ('
+                             'checksum TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                             'accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+
+    def __contains__(self, checksum):
+        return self._valid_path(checksum) is not None
+
+    @property
+    def size(self):
+        """Total size of the stored files, in bytes"""
+        with self._lock:
+            return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def blob_path(self, checksum):
+        """Get the path where the contents with `checksum` are stored"""
+        return self.path / checksum[:2] / checksum
+
+    def entries(self):
+        """Get the entries of the store, the most recently used first"""
+        with self._lock:
+            rows = self._db.execute('SELECT checksum, size, accessed FROM blobs '
+                                    'ORDER BY accessed DESC, rowid DESC').fetchall()
+        return [BlobEntry(checksum, size, accessed, self.blob_path(checksum))
+                for checksum, size, accessed in rows]
+
+    def add(self, source, checksum, size=None):
+        """Add the contents of the file `source`, whose MD5 is `checksum`
+
+        Returns the path of the stored file, or ``None`` when the file is
+        larger than the maximum size of the store.
+        """
+        existing = self._valid_path(checksum, touch=True)
+        if existing is not None:
+            return existing
+        if size is None:
+            size = os.stat(source).st_size
+        if size > self.max_size:
+            logger.debug('File %s is larger than the store, not adding it', source)
+            return None
+
+        path = self.blob_path(checksum)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._link(source, path)
+        stat = path.stat()
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO blobs (checksum, size, mtime, accessed) '
+                             'VALUES (?, ?, ?, ?)', (checksum, stat.st_size, stat.st_mtime_ns, now))
+        self.prune()
+        return path
+
+    def materialize(self, checksum, destination):
+        """Create `destination` with the stored contents whose MD5 is `checksum`
+
+        Returns the link method used, or ``None`` when the contents are not
+        in the store.
+        """
+        path = self._valid_path(checksum, touch=True)
+        if path is None:
+            return None
+        return self._link(path, destination)
+
+    def remove(self, checksum):
+        """Remove the contents whose MD5 is `checksum`"""
+        with self._lock:
+            self._db.execute('DELETE FROM blobs WHERE checksum = ?', (checksum,))
+        _unlink_quietly(self.blob_path(checksum))
+
+    def prune(self, max_size=None):
+        """Remove the least recently used files until the total size is under `max_size`
+
+        By default, `max_size` is the maximum size of the store. Returns the
+        number of files and bytes removed.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        removed = []
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total > max_size:
+                rows = self._db.execute('SELECT checksum, size FROM blobs '
+                                        'ORDER BY accessed ASC, rowid ASC').fetchall()
+                for checksum, size in rows:
+                    if total <= max_size:
+                        break
+                    removed.append((checksum, size))
+                    total -= size
+                self._db.executemany('DELETE FROM blobs WHERE checksum = ?',
+                                     [(checksum,) for checksum, _ in removed])
+        for checksum, _ in removed:
+            _unlink_quietly(self.blob_path(checksum))
+        return len(removed), sum(size for _, size in removed)
+
+    def clear(self):
+        """Remove all the stored files"""
+        return self.prune(0)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _valid_path(self, checksum, touch=False):
+        """Get the path of the stored contents, checking that they were not modified"""
+        with self._lock:
+            row = self._db.execute('SELECT size, mtime FROM blobs WHERE checksum = ?',
+                                   (checksum,)).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(checksum)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            stat = None
+        if stat is None or (stat.st_size, stat.st_mtime_ns) != tuple(row):
+            logger.warning('Stored file %s is missing or was modified, removing it', path)
+            self.remove(checksum)
+            return None
+        if touch:
+            with self._lock:
+                self._db.execute('UPDATE blobs SET accessed = ? WHERE checksum = ?', (time.time(), checksum))
+        return path
+
+    def _link(self, source, destination):
+        """Link or copy `source` to `destination` with the first method that works
+
+        The destination is replaced atomically, through a temporary file in
+        its directory. Returns the method used.
+        """
+        destination = pathlib.Path(destination)
+        temp = destination.with_name(f'.{destination.name}.{uuid.uuid4().hex}.tmp')
+        for method in self.link:
+            try:
+                if method == 'reflink':
+                    _reflink(source, temp)
+                elif method == 'hardlink':
+                    os.link(str(source), str(temp))
+                else:
+                    shutil.copyfile(str(source), str(temp))
+            except OSError as ex:
+                logger.debug('Could not %s %s to %s: %s', method, source, destination, ex)
+                _unlink_quietly(temp)
+                continue
+            os.replace(str(temp), str(destination))
+            return method
+        raise OSError(f'Could not link or copy {source} to {destination}')
+
+
+def _reflink(source, destination):
+    """Clone a file with the copy-on-write ioctl of Linux"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _unlink_quietly(path):
+    try:
+        os.unlink(str(path))
+    except FileNotFoundError:
+        pass
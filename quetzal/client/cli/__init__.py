@@ -1,4 +1,6 @@
 import functools
+import os
+import re
 import traceback
 
 import click
@@ -10,6 +12,9 @@ class State(object):
 
     def __init__(self):
         self.api_config = Configuration()
+        # Commands reuse the access token of previous commands, unless it is
+        # explicitly disabled
+        self.api_config.token_cache = os.getenv('QUETZAL_TOKEN_CACHE', '1').lower() in ('1', 'true', 'yes')
         self.api_client = Client(self.api_config)
         self.verbose_level = 0
 
@@ -51,6 +56,25 @@ class FamilyVersionListType(FamilyVersionType):
         return definitions
 
 
+class ByteSizeType(click.ParamType):
+    name = 'size'
+
+    _units = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*$', value.lower())
+        if match is None:
+            self.fail(f'"{value}" is an invalid size. It must be a number of bytes, '
+                      f'optionally followed by a unit such as K, M or G.',
+                      param, ctx)
+        return int(float(match.group(1)) * self._units[match.group(2)])
+
+    def __repr__(self):
+        return 'ByteSize()'
+
+
 class BaseGroup(click.Group):
     """A group whose `no_args_is_help` option is our custom help function"""
 
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 import functools
 import itertools
+import shutil
+import time
 
 import click
 
+from quetzal.client.base import TransferListener
+
 _PROGRESS_CHARS = '⠇⡆⣄⣠⢰⠸⠙⠋⠇⡇⣇⣧⣷⣾⣽⣻⢿⡿⣟⣯⣷⣯⣟⡿⢿⣻⣽⣾⣷⣧⣇⡇⠇⠋⠙⠸⢰⣠⣄⡆'
 
 
@@ -39,8 +43,66 @@ def scan_progress():
     return generic_progress(clear=custom_clear)
 
 
+def upload_progress():
+
+    def func(result, done, total, stats):
+        if not result.duplicate:
+            stats['bytes'] += result.size or 0
+        elapsed = max(time.monotonic() - stats['start'], 1e-6)
+        click.echo(f'\rUploaded {done} / {total} files, '
+                   f'{stats["bytes"] / (1 << 20):.1f} Mb at '
+                   f'{stats["bytes"] / (1 << 20) / elapsed:.1f} Mb/s ... ',
+                   nl=False)
+
+    def clear(results, stats):
+        elapsed = time.monotonic() - stats['start']
+        num_ok = sum(r.error is None and not r.duplicate for r in results)
+        num_duplicates = sum(r.duplicate for r in results)
+        message = (f'Uploaded {num_ok} out of {len(results)} files '
+                   f'({stats["bytes"] / (1 << 20):.1f} Mb) in {elapsed:.1f} seconds.')
+        if num_duplicates:
+            message += f' Skipped {num_duplicates} files that already existed.'
+        _clear_and_message(message)
+
+    return dict(
+        func=func,
+        kwargs=dict(stats={'start': time.monotonic(), 'bytes': 0}),
+        clear=clear,
+    )
+
+
+class TransferProgress(TransferListener):
+    """Transfer listener that shows the progress of a file upload or download"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self._last_update = 0
+
+    def on_chunk(self, transfer, num_bytes):
+        now = time.monotonic()
+        if now - self._last_update >= self.interval:
+            self._last_update = now
+            self._show(transfer)
+
+    def on_retry(self, transfer, error):
+        self._show(transfer, ' (resumed)' if transfer.direction == 'download' else ' (restarted)')
+
+    def on_finish(self, transfer):
+        _clear_line()
+
+    def on_error(self, transfer, error):
+        _clear_line()
+
+    def _show(self, transfer, suffix=''):
+        verb = 'Uploading' if transfer.direction == 'upload' else 'Downloading'
+        total = f' / {transfer.total / (1 << 20):.1f}' if transfer.total is not None else ''
+        click.echo(f'\r{verb} {transfer.name}: {transfer.transferred / (1 << 20):.1f}{total} Mb '
+                   f'at {transfer.rate / (1 << 20):.1f} Mb/s{suffix} ... ',
+                   nl=False)
+
+
 def _generic_clear(message, *args, **kwargs):
-    term_width, _ = click.get_terminal_size()
+    term_width, _ = shutil.get_terminal_size()
     extra_width = term_width - len(message)  # Count how many whitespaces needed to clear the line
     click.secho('\r' + str(message) + (' ' * extra_width), nl=True, fg='green')
 
@@ -52,6 +114,11 @@ def _generic_message(w_details, char_iterator=None):
 
 
 def _clear_and_message(message):
-    term_width, _ = click.get_terminal_size()
+    term_width, _ = shutil.get_terminal_size()
     extra_width = term_width - len(message)  # Count how many whitespaces needed to clear the line
     click.secho('\r' + str(message) + (' ' * extra_width), nl=True, fg='green')
+
+
+def _clear_line():
+    term_width, _ = shutil.get_terminal_size()
+    click.echo('\r' + ' ' * term_width + '\r', nl=False)
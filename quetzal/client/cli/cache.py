@@ -0,0 +1,89 @@
+import datetime
+
+import click
+
+from quetzal.client.cache import BlobStore
+from quetzal.client.cli import BaseGroup, ByteSizeType, help_options, pass_state, error_wrapper
+from quetzal.client.cli.workspace import _print_table
+
+
+@click.group('cache', options_metavar='[CACHE OPTIONS]', cls=BaseGroup)
+def cache_group():
+    """Local download cache operations."""
+    pass
+
+
+@cache_group.command()
+@error_wrapper
+@help_options
+@pass_state
+def info(state):
+    """Show the size of the download cache"""
+    store = _get_store(state)
+    config = state.api_config
+    click.echo(f'Path:      {store.path}')
+    click.echo(f'Enabled:   {"yes" if config.download_cache else "no"}')
+    click.echo(f'Files:     {len(store)}')
+    click.echo(f'Size:      {_format_size(store.size)}')
+    click.echo(f'Max. size: {_format_size(store.max_size)}')
+
+
+@cache_group.command(name='list')
+@error_wrapper
+@click.option('--limit', type=click.INT, default=10, show_default=True,
+              help='Limit the number of files, the most recently used first.')
+@help_options
+@pass_state
+def list_(state, limit):
+    """List the files of the download cache"""
+    entries = _get_store(state).entries()
+    if not entries:
+        click.secho('The download cache is empty.', fg='yellow')
+        return
+
+    results = [
+        {
+            'checksum': entry.checksum,
+            'size': _format_size(entry.size),
+            'accessed': datetime.datetime.fromtimestamp(entry.accessed),
+        }
+        for entry in entries[:limit]
+    ]
+    columns = {
+        'checksum': {'head': 'CHECKSUM', 'width': 32, 'align': '^'},
+        'size': {'head': 'SIZE', 'width': 10, 'align': '>'},
+        'accessed': {'head': 'LAST USED', 'width': 19, 'align': '^'},
+    }
+    _print_table(results, columns, len(entries))
+
+
+@cache_group.command()
+@error_wrapper
+@click.option('--max-size', type=ByteSizeType(),
+              help='Remove the least recently used files until the cache is smaller '
+                   'than this size, such as 500M or 2G. If not set, the maximum '
+                   'size of the configuration is used.')
+@click.option('--all', 'clear', is_flag=True, help='Remove all the files.')
+@help_options
+@pass_state
+def prune(state, max_size, clear):
+    """Remove files from the download cache"""
+    store = _get_store(state)
+    if clear:
+        max_size = 0
+    count, size = store.prune(max_size)
+    click.secho(f'Removed {count} files, {_format_size(size)}.', fg='green')
+
+
+def _get_store(state):
+    config = state.api_config
+    return state.api_client.download_cache or BlobStore(config.download_cache_path,
+                                                        max_size=config.download_cache_size)
+
+
+def _format_size(size):
+    for unit in ('bytes', 'Kb', 'Mb', 'Gb'):
+        if size < 1024 or unit == 'Gb':
+            break
+        size /= 1024
+    return f'{size} {unit}' if unit == 'bytes' else f'{size:.1f} {unit}'
@@ -1,13 +1,15 @@
+import csv
 import pathlib
 import sys
+import time
 
 import click
 import json
 import yaml
 
 from quetzal.client import helpers
-from quetzal.client.cli import BaseGroup, help_options, pass_state, error_wrapper, MutexOption
-from quetzal.client.cli.workspace import workspace_identifier_options, _get_details
+from quetzal.client.cli import BaseGroup, help_options, pass_state, error_wrapper, MutexOption, _progress
+from quetzal.client.cli.workspace import workspace_identifier_options
 
 
 @click.group('file', options_metavar='[FILE OPTIONS]', cls=BaseGroup)
@@ -27,25 +29,86 @@ def file_group():
                    f'the path and filename entries of the base metadata to '
                    f'save the file as '
                    f'{pathlib.Path("output-dir") / "path" / "filename"}.')
+@click.option('--streams', type=click.IntRange(1), default=1, show_default=True,
+              help='Maximum number of concurrent streams used to download large files.')
 @workspace_identifier_options(required=False)
 @help_options
 @pass_state
-def download(state, file_id, output, output_dir, name, wid):
+def download(state, file_id, output, output_dir, streams, name, wid):
     """Download a file in a workspace"""
     client = state.api_client
 
     if name is not None or wid is not None:
-        w_details = helpers.workspace.details(client, wid, name)
-        if w_details is None:
-            # Can only happen when the name is used and there are no results. Not
-            # with the wid option because it would raise a 404 QuetzalAPIException
+        wid = helpers.workspace.resolve(client, wid, name)
+        if wid is None:
+            # Can only happen when the name is used and there are no results
             raise click.ClickException(f'Workspace named "{name}" does not exist.')
-        wid = w_details.id
 
-    saved_file = helpers.file.download(client, file_id, wid=wid, output=output, output_dir=output_dir)
+    client.add_transfer_listener(_progress.TransferProgress())
+    saved_file = helpers.file.download(client, file_id, wid=wid, output=output, output_dir=output_dir,
+                                       streams=streams)
     click.secho(f'Downloaded file: {saved_file}', fg='green')
 
 
+@file_group.command('download-many')
+@error_wrapper
+@click.option('--input', 'input_file', type=click.File('r'), default='-',
+              help='File with the identifiers of the files to download. It can be '
+                   'a list of identifiers, one per line, or the output of the query '
+                   'command, which must have an "id" column. If not set, the '
+                   'identifiers are read from the standard input.')
+@click.option('--format', 'input_format', type=click.Choice(['lines', 'csv', 'json', 'yaml']),
+              help='Input file format. If not set, it is guessed from the extension.')
+@click.option('--output-dir', default='quetzal-data', show_default=True,
+              help=f'Output directory. Files are saved as '
+                   f'{pathlib.Path("output-dir") / "path" / "filename"}.')
+@click.option('--workers', type=click.IntRange(1), default=8, show_default=True,
+              help='Number of concurrent downloads.')
+@workspace_identifier_options(required=False)
+@help_options
+@pass_state
+def download_many(state, input_file, input_format, output_dir, workers, name, wid):
+    """Download several files"""
+    if input_format is None:
+        ext = pathlib.Path(getattr(input_file, 'name', '')).suffix[1:]
+        input_format = {'csv': 'csv', 'json': 'json', 'yaml': 'yaml', 'yml': 'yaml'}.get(ext, 'lines')
+
+    file_ids = _read_file_ids(input_file, input_format)
+    if not file_ids:
+        click.secho('No files to download.', fg='yellow')
+        return
+
+    client = state.api_client
+
+    if name is not None or wid is not None:
+        wid = helpers.workspace.resolve(client, wid, name)
+        if wid is None:
+            # Can only happen when the name is used and there are no results
+            raise click.ClickException(f'Workspace named "{name}" does not exist.')
+
+    start = time.monotonic()
+    results = helpers.file.download_many(client, file_ids, wid=wid, output_dir=output_dir,
+                                         workers=workers)
+    elapsed = time.monotonic() - start
+
+    failed = [r for r in results if r.error is not None]
+    for result in failed:
+        click.secho(f'Failed to download file {result.file_id}: {result.error}', fg='red')
+    click.secho(f'Downloaded {len(results) - len(failed)} out of {len(results)} files '
+                f'in {elapsed:.1f} seconds.', fg='green' if not failed else 'yellow')
+    if failed:
+        raise click.ClickException(f'{len(failed)} files could not be downloaded.')
+
+
+def _read_file_ids(file, fmt):
+    if fmt == 'csv':
+        return [row['id'] for row in csv.DictReader(file)]
+    elif fmt in ('json', 'yaml'):
+        rows = json.load(file) if fmt == 'json' else yaml.safe_load(file)
+        return [row['id'] if isinstance(row, dict) else str(row) for row in rows or []]
+    return [line.strip() for line in file if line.strip()]
+
+
 @file_group.command()
 @error_wrapper
 @click.argument('file_id')
@@ -70,12 +133,10 @@ def metadata(state, file_id, output, output_format, name, wid):
     client = state.api_client
 
     if name is not None or wid is not None:
-        w_details = helpers.workspace.details(client, wid, name)
-        if w_details is None:
-            # Can only happen when the name is used and there are no results. Not
-            # with the wid option because it would raise a 404 QuetzalAPIException
+        wid = helpers.workspace.resolve(client, wid, name)
+        if wid is None:
+            # Can only happen when the name is used and there are no results
             raise click.ClickException(f'Workspace named "{name}" does not exist.')
-        wid = w_details.id
 
     meta = helpers.file.metadata(client, file_id, wid=wid)
 
@@ -97,12 +158,10 @@ def delete(state, file_id, name, wid):
     client = state.api_client
 
     if name is not None or wid is not None:
-        w_details = helpers.workspace.details(client, wid, name)
-        if w_details is None:
-            # Can only happen when the name is used and there are no results. Not
-            # with the wid option because it would raise a 404 QuetzalAPIException
+        wid = helpers.workspace.resolve(client, wid, name)
+        if wid is None:
+            # Can only happen when the name is used and there are no results
             raise click.ClickException(f'Workspace named "{name}" does not exist.')
-        wid = w_details.id
 
     ctx = click.get_current_context()
 
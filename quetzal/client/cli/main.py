@@ -5,6 +5,7 @@ import click
 from quetzal.client import Client, Configuration
 from quetzal.client.cli import BaseGroup, help_options, State, MutexOption
 from quetzal.client.cli.auth import auth_group
+from quetzal.client.cli.cache import cache_group
 from quetzal.client.cli.file import file_group
 from quetzal.client.cli.query import query_command
 from quetzal.client.cli.workspace import workspace_group
@@ -157,6 +158,7 @@ def cli(*args, **kwargs):
 
 
 cli.add_command(auth_group)
+cli.add_command(cache_group)
 cli.add_command(file_group)
 cli.add_command(query_command)
 cli.add_command(workspace_group)
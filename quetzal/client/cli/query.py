@@ -1,4 +1,5 @@
 import pathlib
+import shutil
 import sys
 
 import click
@@ -7,7 +8,7 @@ from quetzal.client import helpers
 from quetzal.client.cli import error_wrapper, MutexOption, rename_kwargs, \
     help_options, pass_state
 from quetzal.client.cli.workspace import workspace_identifier_options, \
-    _get_details, _save_results, _print_table
+    _save_results, _print_table
 from quetzal.client.utils import HistoryConsole
 
 
@@ -16,7 +17,7 @@ from quetzal.client.utils import HistoryConsole
 @workspace_identifier_options(required=False)
 @click.option('--input', 'query_file', type=click.File('r'),
               help='Input query file. If not set, a query will be requested '
-                   'on the console.', default=sys.stdin)
+                   'on the console.', default='-')
 @click.option('--dialect', default='postgresql', show_default=True,
               help='Dialect of query')
 @click.option('--limit', type=click.INT, default=10, show_default=True,
@@ -27,8 +28,9 @@ from quetzal.client.utils import HistoryConsole
 @click.option('--output', '-o', type=click.File('w'),
               help='File where query results will be saved.')
 @click.option('--format', 'output_format',
-              type=click.Choice(['csv', 'json', 'yaml']),
-              help='Output file format, if not set, it is guessed from the extension.')
+              type=click.Choice(['csv', 'json', 'jsonl', 'yaml', 'parquet', 'feather']),
+              help='Output file format, if not set, it is guessed from the extension. '
+                   'The parquet and feather formats need the pyarrow package.')
 @rename_kwargs(retrieve_all='all')
 @help_options
 @pass_state
@@ -39,7 +41,8 @@ def query_command(state, name, wid, query_file, dialect, limit, retrieve_all, ou
         if hasattr(output, 'name'):
             output_filename = pathlib.Path(output.name)
             ext = output_filename.suffix[1:]
-            if ext not in ('csv', 'json', 'yaml'):
+            ext = {'ndjson': 'jsonl', 'yml': 'yaml'}.get(ext, ext)
+            if ext not in ('csv', 'json', 'jsonl', 'yaml', 'parquet', 'feather'):
                 raise click.BadParameter(f'No format provided: "{ext}" is not supported. '
                                          f'Set the format with --format')
             output_format = ext
@@ -61,26 +64,46 @@ def query_command(state, name, wid, query_file, dialect, limit, retrieve_all, ou
     limit = None if retrieve_all else limit
 
     if name is not None or wid is not None:
-        # Query within a workspace: get the workspace details, in particular its id
-        w_details = _get_details(state, name, wid)
-        wid = w_details.id
+        # Query within a workspace: get its id
+        wid = helpers.workspace.resolve(client, wid, name)
+        if wid is None:
+            raise click.ClickException(f'Workspace named "{name}" does not exist.')
+
+    if output_format in ('parquet', 'feather'):
+        # Binary columnar formats: the output is written by pyarrow, to the
+        # path of the output file
+        if output is None or output.name == '-':
+            raise click.BadParameter(f'The {output_format} format needs an output file.')
+        results = helpers.query_columns(client, wid, query_contents, dialect=dialect, limit=limit)
+        if output_format == 'parquet':
+            results.write_parquet(output.name)
+        else:
+            results.write_feather(output.name)
+        click.secho(f'Saved {len(results)} out of {results.total} results '
+                    f'in {output.name}.')
+        return
+
+    if output is not None:
+        # Write the rows as the pages of results arrive, without keeping them
+        # in memory
+        rows = helpers.iter_query(client, wid, query_contents, dialect=dialect, limit=limit)
+        count = _save_results(rows, output, output_format)
+        if not count:
+            click.secho('No results.', fg='green')
+        else:
+            click.secho(f'Saved {count} out of {rows.total} results '
+                        f'in {output.name}.')
+        return
 
     results, total = helpers.query(client, wid, query_contents, dialect=dialect, limit=limit)
     if not results:
-        _save_results([], output, output_format)
         click.secho('No results.', fg='green')
         return
 
-    total_width, _ = click.get_terminal_size()
+    total_width, _ = shutil.get_terminal_size()
     num_cols = len(results[0])
     columns = {
         col: {'head': col, 'width': total_width // num_cols - 1, 'align': '>'}
         for col in results[0].keys()
     }
-
-    if output is None:
-        _print_table(results, columns, total)
-    else:
-        _save_results(results, output, output_format)
-        click.secho(f'Saved {len(results)} out of {total} results '
-                    f'in {output.name}.')
+    _print_table(results, columns, total)
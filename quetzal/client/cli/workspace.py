@@ -2,6 +2,9 @@ import datetime
 import csv
 import itertools
 import json
+import os
+import shutil
+import textwrap
 
 import backoff
 import click
@@ -14,7 +17,6 @@ from quetzal.client.cli import (
     help_options, OneRequiredOption, MutexOption, pass_state,
     rename_kwargs, State, _progress
 )
-from quetzal.client.exceptions import QuetzalAPIException
 
 
 def name_option(required=True):
@@ -118,7 +120,7 @@ def list_(state, name, owner, deleted, limit):
     """List workspaces."""
     client = state.api_client
 
-    results, total = helpers.workspace.list_(client, name, owner, deleted, limit)
+    results, total = helpers.workspace.list_(client, name, owner, deleted, limit=limit)
     if not results:
         click.secho('No workspaces found.', fg='yellow')
         return
@@ -166,16 +168,15 @@ def commit(state, name, wid, wait):
 
     client = state.api_client
 
-    # Get the workspace details
-    w_details = helpers.workspace.details(client, wid, name)
-    if w_details is None:
-        # Can only happen when the name is used and there are no results. Not
-        # with the wid option because it would raise a 404 QuetzalAPIException
+    # Get the workspace identifier
+    wid = helpers.workspace.resolve(client, wid, name)
+    if wid is None:
+        # Can only happen when the name is used and there are no results
         raise click.ClickException(f'Workspace named "{name}" does not exist.')
 
     # Do the commit
     progress = _progress.commit_progress()
-    w_details = helpers.workspace.commit(client, w_details.id, wait, progress=progress)
+    w_details = helpers.workspace.commit(client, wid, wait, progress=progress)
 
     _print_details(w_details)
 
@@ -192,16 +193,15 @@ def scan(state, name, wid, wait):
 
     client = state.api_client
 
-    # Get the workspace details
-    w_details = helpers.workspace.details(client, wid, name)
-    if w_details is None:
-        # Can only happen when the name is used and there are no results. Not
-        # with the wid option because it would raise a 404 QuetzalAPIException
+    # Get the workspace identifier
+    wid = helpers.workspace.resolve(client, wid, name)
+    if wid is None:
+        # Can only happen when the name is used and there are no results
         raise click.ClickException(f'Workspace named "{name}" does not exist.')
 
     # Do the scan
     progress = _progress.scan_progress()
-    w_details = helpers.workspace.scan(client, w_details.id, wait, progress=progress)
+    w_details = helpers.workspace.scan(client, wid, wait, progress=progress)
 
     _print_details(w_details)
 
@@ -217,15 +217,14 @@ def files(state, name, wid, limit):
     """List files on a workspace."""
     client = state.api_client
 
-    # Get the workspace details
-    w_details = helpers.workspace.details(client, wid, name)
-    if w_details is None:
-        # Can only happen when the name is used and there are no results. Not
-        # with the wid option because it would raise a 404 QuetzalAPIException
+    # Get the workspace identifier
+    wid = helpers.workspace.resolve(client, wid, name)
+    if wid is None:
+        # Can only happen when the name is used and there are no results
         raise click.ClickException(f'Workspace named "{name}" does not exist.')
 
     limit = min(limit, 1000)
-    file_list, total = helpers.workspace.files(client, w_details.id, limit=limit)
+    file_list, total = helpers.workspace.files(client, wid, limit=limit)
 
     if not file_list:
         click.secho('No files have been added on this workspace '
@@ -245,24 +244,55 @@ def files(state, name, wid, limit):
 @workspace_group.command()
 @error_wrapper
 @workspace_identifier_options()
-@click.option('--file', '-f', type=click.File(mode='rb'), required=True,
+@click.option('--file', '-f', type=click.File(mode='rb'),
+              cls=OneRequiredOption, one_of_with=['recursive'],
               help='File to upload.')
+@click.option('--recursive', '-r', type=click.Path(exists=True, file_okay=False),
+              cls=OneRequiredOption, one_of_with=['file'],
+              help='Directory to upload, with all its files and sub-directories. '
+                   'The path of each file relative to this directory is saved '
+                   'as its path metadata.')
+@click.option('--workers', type=click.IntRange(1), default=8, show_default=True,
+              help='Number of concurrent uploads when uploading a directory.')
+@click.option('--deduplicate', is_flag=True,
+              help='Do not upload files whose contents already exist on the '
+                   'workspace or on the committed files.')
 @help_options
 @pass_state
-def upload(state, name, wid, file):
-    """Upload a file to a workspace."""
+def upload(state, name, wid, file, recursive, workers, deduplicate):
+    """Upload a file or a directory to a workspace."""
     client = state.api_client
 
-    # Get the workspace details
-    w_details = helpers.workspace.details(client, wid, name)
-    if w_details is None:
-        # Can only happen when the name is used and there are no results. Not
-        # with the wid option because it would raise a 404 QuetzalAPIException
+    # Get the workspace identifier
+    wid = helpers.workspace.resolve(client, wid, name)
+    if wid is None:
+        # Can only happen when the name is used and there are no results
         raise click.ClickException(f'Workspace named "{name}" does not exist.')
 
-    file_details = helpers.workspace.upload(client, w_details.id, file)
-    click.secho(f'File {file.name} uploaded successfully. Its id is {file_details.id}.',
-                fg='green')
+    if file is not None:
+        duplicate = None
+        if deduplicate:
+            duplicate = helpers.workspace.find_duplicate(client, wid, file, path='',
+                                                         filename=os.path.basename(file.name))
+        if duplicate is not None:
+            click.secho(f'File {file.name} already exists with id {duplicate.id}. Upload skipped.',
+                        fg='green')
+            return
+        client.add_transfer_listener(_progress.TransferProgress())
+        file_details = helpers.workspace.upload(client, wid, file)
+        click.secho(f'File {file.name} uploaded successfully. Its id is {file_details.id}.',
+                    fg='green')
+        return
+
+    progress = _progress.upload_progress()
+    results = helpers.workspace.upload_many(client, wid, recursive,
+                                            workers=workers, progress=progress,
+                                            deduplicate=deduplicate)
+    failed = [r for r in results if r.error is not None]
+    for result in failed:
+        click.secho(f'Failed to upload file {result.filename}: {result.error}', fg='red')
+    if failed:
+        raise click.ClickException(f'{len(failed)} out of {len(results)} files could not be uploaded.')
 
 
 @workspace_group.command()
@@ -277,16 +307,15 @@ def delete(state, name, wid, wait):
 
     client = state.api_client
 
-    # Get the workspace details
-    w_details = helpers.workspace.details(client, wid, name)
-    if w_details is None:
-        # Can only happen when the name is used and there are no results. Not
-        # with the wid option because it would raise a 404 QuetzalAPIException
+    # Get the workspace identifier
+    wid = helpers.workspace.resolve(client, wid, name)
+    if wid is None:
+        # Can only happen when the name is used and there are no results
         raise click.ClickException(f'Workspace named "{name}" does not exist.')
 
     # Delete it
     progress = _progress.generic_progress('Workspace deleted.')
-    helpers.workspace.delete(client, w_details.id, wait=wait, progress=progress)
+    helpers.workspace.delete(client, wid, wait=wait, progress=progress)
 
 
 @workspace_group.command()
@@ -303,19 +332,17 @@ def update_metadata(state, name, wid, file_id, metadata_file):
 
     client = state.api_client
 
-    # Get the workspace details
-    w_details = helpers.workspace.details(client, wid, name)
-    if w_details is None:
-        # Can only happen when the name is used and there are no results. Not
-        # with the wid option because it would raise a 404 QuetzalAPIException
+    # Get the workspace identifier
+    wid = helpers.workspace.resolve(client, wid, name)
+    if wid is None:
+        # Can only happen when the name is used and there are no results
         raise click.ClickException(f'Workspace named "{name}" does not exist.')
 
     metadata_contents = json.load(metadata_file)
-    response = client.workspace_file_update_metadata(wid=w_details.id, uuid=file_id,
-                                                     body=metadata_contents)
+    response = helpers.workspace.update_metadata(client, wid, file_id, metadata_contents)
     click.secho(f'Metadata for file {file_id} successfully changed.', fg='green')
     click.secho('Updated metadata:')
-    click.secho(json.dumps(response, indent=2), fg='blue')
+    click.secho(json.dumps(response.to_dict(), indent=2), fg='blue')
 
 
 def _wait_for_workspace(w, client, func):
@@ -372,7 +399,7 @@ def _print_table(results, schema, total):
         '{' + ('{name}:{align}{max_width}'.format(name=c, max_width=min(max_width[c], schema[c]['width']), **schema[c])) + '}'
         for c in schema)
 
-    term_width, _ = click.get_terminal_size()
+    term_width, _ = shutil.get_terminal_size()
     header = {k: schema[k]['head'] for k in schema}
     head_line = _trim_string(row_format.format(**header), term_width)
     click.secho(head_line, fg='blue')
@@ -385,39 +412,68 @@ def _print_table(results, schema, total):
 
 
 def _save_results(table, file, fmt):
+    """Write rows to a file, one at a time
+
+    The `table` can be any iterable of dictionaries, such as a lazy iterator
+    of query results: rows are written as they are received, without keeping
+    them in memory. Returns the number of rows written.
+    """
     if file is None:
-        return
+        return 0
 
     if fmt == 'json':
-        json.dump(table, file, indent=2)
+        return _json_dump(table, file)
+    elif fmt == 'jsonl':
+        return _jsonl_dump(table, file)
     elif fmt == 'yaml':
-        yaml.safe_dump(table, file, default_flow_style=False)
+        return _yaml_dump(table, file)
     elif fmt == 'csv':
-        _csv_dump(table, file)
+        return _csv_dump(table, file)
     else:
         raise ValueError('Invalid output format')
 
 
-def _csv_dump(table, filename):
-    with open(filename.name, 'w') as f:
-        if not table:
-            return
-        writer = csv.DictWriter(f, table[0].keys())
-        writer.writeheader()
-        writer.writerows(table)
-
-
-def _get_details(state, name, wid):
-    client = state.api_client
-    try:
-        if name:
-            username = state.api_config.username
-            response = client.workspace_fetch(owner=username, name=name)
-            if not response.results:
-                raise click.ClickException('Workspace not found.')
-            w_details = response.results[0]
-        else:
-            w_details = client.workspace_details(wid)
-    except QuetzalAPIException as ex:
-        raise click.ClickException(f'Failed to retrieve workspace:\n{ex}')
-    return w_details
+def _json_dump(table, file):
+    # Same output as json.dump(list(table), file, indent=2)
+    count = 0
+    for row in table:
+        file.write(',\n' if count else '[\n')
+        file.write(textwrap.indent(json.dumps(row, indent=2), '  '))
+        count += 1
+    file.write('\n]' if count else '[]')
+    return count
+
+
+def _jsonl_dump(table, file):
+    count = 0
+    for row in table:
+        file.write(json.dumps(row))
+        file.write('\n')
+        count += 1
+    return count
+
+
+def _yaml_dump(table, file):
+    # Each row is written as an item of a YAML list
+    count = 0
+    for row in table:
+        yaml.safe_dump([row], file, default_flow_style=False)
+        count += 1
+    if not count:
+        yaml.safe_dump([], file, default_flow_style=False)
+    return count
+
+
+def _csv_dump(table, file):
+    count = 0
+    writer = None
+    for row in table:
+        if writer is None:
+            writer = csv.DictWriter(file, row.keys())
+            writer.writeheader()
+        writer.writerow(row)
+        count += 1
+    if writer is None:
+        # Create the file even when there are no results
+        file.write('')
+    return count
@@ -3,6 +3,68 @@ import os
 import quetzal.openapi_client.configuration
 
 
+# Default size of the chunks sent or received when transferring file contents
+DEFAULT_CHUNK_SIZE = (1 << 20)  # 1 Mb
+# Default size of the reads when calculating the checksum of a local file
+DEFAULT_READ_BUFFER_SIZE = (64 << 10)  # 64 Kb
+# Default maximum number of bytes held in memory by all concurrent transfers
+DEFAULT_MAX_BYTES_IN_FLIGHT = (256 << 20)  # 256 Mb
+# Default number of seconds that cached workspace file metadata is used
+# without validating it with the server
+DEFAULT_METADATA_CACHE_TTL = 60
+# Default maximum number of entries of the metadata cache
+DEFAULT_METADATA_CACHE_SIZE = 10000
+# Default maximum size of the files kept in the download cache
+DEFAULT_DOWNLOAD_CACHE_SIZE = (10 << 30)  # 10 Gb
+# Default lifetime, in seconds, of saved access tokens without expiration time
+DEFAULT_TOKEN_LIFETIME = 3600
+# Default number of seconds before its expiration when an access token is
+# renewed
+DEFAULT_TOKEN_REFRESH_MARGIN = 60
+# Default number of connection pools of a client; there is one pool for each
+# server, so this is the number of servers with connections kept open
+DEFAULT_CONNECTION_POOLS = 4
+# Default number of seconds that a connection is idle before TCP keep-alive
+# probes are sent
+DEFAULT_KEEP_ALIVE_IDLE = 60
+
+# Default values of the options of Configuration that the configuration of
+# the generated openapi client does not have
+_OPTION_DEFAULTS = {
+    'chunk_size': DEFAULT_CHUNK_SIZE,
+    'read_buffer_size': DEFAULT_READ_BUFFER_SIZE,
+    'max_bytes_in_flight': DEFAULT_MAX_BYTES_IN_FLIGHT,
+    'metadata_cache': False,
+    'metadata_cache_path': None,
+    'metadata_cache_ttl': DEFAULT_METADATA_CACHE_TTL,
+    'metadata_cache_size': DEFAULT_METADATA_CACHE_SIZE,
+    'download_cache': False,
+    'download_cache_path': None,
+    'download_cache_size': DEFAULT_DOWNLOAD_CACHE_SIZE,
+    'workspace_cache': False,
+    'workspace_cache_path': None,
+    'token_cache': False,
+    'token_cache_path': None,
+    'token_lifetime': DEFAULT_TOKEN_LIFETIME,
+    'token_refresh_margin': DEFAULT_TOKEN_REFRESH_MARGIN,
+    'token_background_refresh': True,
+    'retry_policy': None,
+    'connection_pools': DEFAULT_CONNECTION_POOLS,
+    'connection_pool_block': False,
+    'keep_alive': True,
+    'keep_alive_idle': DEFAULT_KEEP_ALIVE_IDLE,
+}
+
+
+def get_option(configuration, name):
+    """Get an option of a client configuration, or its default value when it is not set
+
+    Clients accept the configuration of the generated openapi client too,
+    which does not have the options added by :py:class:`Configuration`.
+    """
+    return getattr(configuration, name, _OPTION_DEFAULTS[name])
+
+
 class Configuration(quetzal.openapi_client.configuration.Configuration,
                     metaclass=quetzal.openapi_client.configuration.TypeWithDefault):
     # Use this later for particular extensions/modifications on the API
@@ -17,3 +79,79 @@ class Configuration(quetzal.openapi_client.configuration.Configuration,
         api_key = os.getenv('QUETZAL_API_KEY', '')
         if api_key:
             self.api_key['X-API-KEY'] = api_key
+
+        # Transfer options: size of the chunks used for uploads and downloads,
+        # size of the reads of local files, and maximum number of bytes in
+        # memory for all the concurrent transfers of the process (None for no
+        # limit)
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.read_buffer_size = DEFAULT_READ_BUFFER_SIZE
+        self.max_bytes_in_flight = DEFAULT_MAX_BYTES_IN_FLIGHT
+
+        # Metadata cache options: when enabled, file metadata is saved in a
+        # local cache (see quetzal.client.cache.MetadataCache) in the
+        # metadata_cache_path file, or a default file in the user data
+        # directory when None
+        self.metadata_cache = os.getenv('QUETZAL_METADATA_CACHE', '').lower() in ('1', 'true', 'yes')
+        self.metadata_cache_path = None
+        self.metadata_cache_ttl = DEFAULT_METADATA_CACHE_TTL
+        self.metadata_cache_size = DEFAULT_METADATA_CACHE_SIZE
+
+        # Download cache options: when enabled, downloaded files are kept in
+        # a local content-addressed store (see quetzal.client.cache.BlobStore)
+        # in the download_cache_path directory, or a default directory in the
+        # user data directory when None
+        self.download_cache = os.getenv('QUETZAL_DOWNLOAD_CACHE', '').lower() in ('1', 'true', 'yes')
+        self.download_cache_path = None
+        self.download_cache_size = DEFAULT_DOWNLOAD_CACHE_SIZE
+
+        # Workspace cache options: when enabled, the identifiers of workspaces
+        # found by name are saved (see quetzal.client.cache.WorkspaceIdCache)
+        # in the workspace_cache_path file, or a default file in the user data
+        # directory when None
+        self.workspace_cache = os.getenv('QUETZAL_WORKSPACE_CACHE', '').lower() in ('1', 'true', 'yes')
+        self.workspace_cache_path = None
+
+        # Token cache options: when enabled, access tokens obtained with a
+        # login are saved (see quetzal.client.tokens.TokenStore) in the
+        # token_cache_path file, or a default file in the user configuration
+        # directory when None, and reused by other clients until
+        # token_refresh_margin seconds before they expire
+        self.token_cache = os.getenv('QUETZAL_TOKEN_CACHE', '').lower() in ('1', 'true', 'yes')
+        self.token_cache_path = None
+        self.token_lifetime = DEFAULT_TOKEN_LIFETIME
+        self.token_refresh_margin = DEFAULT_TOKEN_REFRESH_MARGIN
+        # Renew the access tokens obtained by a login in the background,
+        # before requests find them about to expire, when they were used
+        # since the last renewal
+        self.token_background_refresh = True
+
+        # Retry policy of the requests that fail with a retryable error (see
+        # quetzal.client.retry.RetryPolicy), or None for the default policy
+        self.retry_policy = None
+
+        # Connection pool options: number of pools (one per server), maximum
+        # number of connections kept open to each server (the
+        # connection_pool_maxsize option of the generated configuration),
+        # whether requests wait for a free connection instead of opening a
+        # connection that is discarded afterwards when all of them are in
+        # use, and whether idle connections send TCP keep-alive probes after
+        # keep_alive_idle seconds, so that they are not dropped by firewalls
+        # and load balancers
+        pool_maxsize = os.getenv('QUETZAL_POOL_MAXSIZE', '')
+        if pool_maxsize:
+            self.connection_pool_maxsize = int(pool_maxsize)
+        self.connection_pools = DEFAULT_CONNECTION_POOLS
+        self.connection_pool_block = os.getenv('QUETZAL_POOL_BLOCK', '').lower() in ('1', 'true', 'yes')
+        self.keep_alive = True
+        self.keep_alive_idle = DEFAULT_KEEP_ALIVE_IDLE
+
+    def __copy__(self):
+        # New configurations are copies of a process-wide default (see
+        # TypeWithDefault). Copy its authentication dictionaries too, so that
+        # changing the credentials of a client does not change the others
+        other = self.__class__.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other.api_key = dict(self.api_key)
+        other.api_key_prefix = dict(self.api_key_prefix)
+        return other
@@ -1,5 +1,7 @@
+import email.utils
 import json
 import textwrap
+import time
 import warnings
 
 from requests import codes
@@ -20,6 +22,9 @@ class QuetzalAPIException(Exception):
         Title of the problem.
     detail:
         Human-readable detailed message on the problem.
+    retry_after: float
+        Seconds to wait before retrying, from the ``Retry-After`` header of
+        *429* and *503* responses, or ``None``.
 
 
     """
@@ -28,6 +33,7 @@ class QuetzalAPIException(Exception):
         self.status = status or 'Unknown status code'
         self.title = title or 'No title provided'
         self.detail = detail or 'No details provided'
+        self.retry_after = None
         super().__init__(f'{self.title} (status={self.status})')
 
     def __reduce__(self):  # Needed for pickleable exceptions
@@ -63,17 +69,23 @@ class QuetzalAPIException(Exception):
         except (json.JSONDecodeError, TypeError):
             pass
 
-        if status == codes.unauthorized:
+        if status == codes.not_modified:
+            cls = NotModifiedException
+        elif status == codes.unauthorized:
             if authorize_ok:
                 cls = RetryableException
             else:
                 cls = UnauthorizedException
         elif status in (codes.bad_request, codes.forbidden, codes.not_found,
-                        codes.precondition_failed, codes.server_error):
+                        codes.precondition_failed, codes.request_entity_too_large,
+                        codes.server_error):
             cls = QuetzalAPIException
         else:
             cls = RetryableException
-        return cls(status, title, detail)
+        exception = cls(status, title, detail)
+        if status in (codes.too_many_requests, codes.service_unavailable):
+            exception.retry_after = _parse_retry_after((api_exception.headers or {}).get('Retry-After'))
+        return exception
 
     def __str__(self):
         error_message = f"""
@@ -85,6 +97,21 @@ class QuetzalAPIException(Exception):
         return textwrap.dedent(error_message).strip()
 
 
+def _parse_retry_after(value):
+    """Get the seconds of a ``Retry-After`` header, given in seconds or as a date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
+
+
 class RetryableException(QuetzalAPIException):
     """A Quetzal API exception to an operation that may be retried."""
     pass
@@ -97,3 +124,8 @@ class RetryableException(QuetzalAPIException):
 class UnauthorizedException(QuetzalAPIException):
     """A Quetzal API exception specific for unauthorized access."""
     pass
+
+
+class NotModifiedException(QuetzalAPIException):
+    """A Quetzal API response to a conditional request on an unchanged resource."""
+    pass
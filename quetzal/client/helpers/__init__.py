@@ -5,14 +5,17 @@ that other libraries using this package do not have to interact with the
 Quetzal client through the command line.
 
 """
-from . import auth, file, workspace
-from .query import query
+from . import auth, columnar, file, workspace
+from .query import query, iter_query, query_columns
 from .misc import get_client
 
 __all__ = (
     'auth',
+    'columnar',
     'file',
     'get_client',
+    'iter_query',
     'query',
+    'query_columns',
     'workspace',
 )
@@ -0,0 +1,352 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import sys
+import threading
+import time
+import types
+
+from requests import codes
+
+from quetzal.client.exceptions import QuetzalAPIException
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of items per page accepted by each server endpoint, as
+# learned by the page sizers. Keys are (host, endpoint) tuples.
+_max_per_page_cache = {}
+_max_per_page_lock = threading.Lock()
+
+_Page = collections.namedtuple('_Page', ['number', 'per_page', 'response', 'elapsed', 'num_bytes'])
+_Body = collections.namedtuple('_Body', ['data'])
+
+
+def fetch_page(client, func, response_type, *args, raw=False, **kwargs):
+    """Call a paginated API function and measure the size of its response
+
+    The response is requested without deserializing it, so that its size is
+    known. It is then deserialized as a `response_type` object or, when
+    `raw` is set, decoded as plain objects without any model (see
+    :py:meth:`quetzal.client.base.Client.call_api_json`).
+
+    Returns the page and its size, in bytes.
+    """
+    data = client.call_api_raw(func, *args, **kwargs)
+    if raw:
+        return types.SimpleNamespace(**json.loads(data)), len(data)
+    return client.deserialize(_Body(data), response_type), len(data)
+
+
+def page_size(client, per_page, endpoint, limit=None):
+    """Get the fixed page size, or a page sizer when `per_page` is ``None``"""
+    if per_page is None:
+        initial = 100 if limit is None else min(limit, 100)
+        return PageSizer(initial, min_per_page=min(initial, 10), key=(client.configuration.host, endpoint))
+    return per_page if limit is None else min(per_page, limit)
+
+
+def server_page_size(number, per_page, total, num_items, pages=None):
+    """Get the page size used by the server when it is smaller than the requested one
+
+    A server that enforces a maximum page size sends fewer items than
+    requested, and computes the offset of each page with its own page size.
+    This is detected when the number of items of a page, or the number of
+    `pages` reported by the server, do not correspond to the requested
+    `per_page`. The first page is not considered, because it may come from
+    an endpoint that does not honor the page size.
+
+    Parameters
+    ----------
+    number: int
+        Page number, starting at 1.
+    per_page: int
+        Requested number of items per page.
+    total: int
+        Total number of items reported by the server.
+    num_items: int
+        Number of items of the page.
+    pages: int, optional
+        Number of pages reported by the server, if any.
+
+    Returns
+    -------
+    int
+        The page size of the server, or ``None`` when it honored `per_page`.
+
+    """
+    if number == 1 or num_items >= per_page:
+        return None
+    if not isinstance(pages, int):
+        pages = None
+    start = (number - 1) * per_page
+    if num_items == max(0, min(per_page, total - start)) and (pages is None or pages == -(-total // per_page)):
+        return None
+    if pages is not None and pages == number:
+        # The last page of the server has the items after its other pages
+        return max(1, (total - num_items) // (pages - 1))
+    return num_items
+
+
+class PageSizer:
+    """Adaptive number of items per page of a paginated endpoint
+
+    The page size grows while pages are fast and small, and shrinks when
+    they take longer than `target_time` seconds or are larger than
+    `target_bytes` bytes. It is also halved when the server rejects a page
+    request with a *413* or *5xx* error.
+
+    When the server rejects a page with a *413* error, or answers with fewer
+    items than requested (see :py:func:`server_page_size`), it is assumed to
+    enforce a maximum page size. This maximum is remembered for the same
+    `key`, usually the server host and endpoint, so that later iterations do
+    not exceed it.
+
+    Parameters
+    ----------
+    per_page: int, optional
+        Initial number of items per page.
+    min_per_page: int, optional
+        Minimum number of items per page.
+    max_per_page: int, optional
+        Maximum number of items per page.
+    target_time: float, optional
+        Target duration of a page request, in seconds.
+    target_bytes: int, optional
+        Target size of a page response, in bytes.
+    key: hashable, optional
+        Key of the learned maximum page size.
+
+    """
+
+    def __init__(self, per_page=100, min_per_page=10, max_per_page=10000,
+                 target_time=1.0, target_bytes=(4 << 20), key=None):
+        self.min_per_page = min_per_page
+        self.max_per_page = max_per_page
+        self.target_time = target_time
+        self.target_bytes = target_bytes
+        self.key = key
+        if key is not None:
+            with _max_per_page_lock:
+                self.max_per_page = min(max_per_page, _max_per_page_cache.get(key, max_per_page))
+            self.min_per_page = min(min_per_page, self.max_per_page)
+        self.per_page = max(min_per_page, min(per_page, self.max_per_page))
+        self._lock = threading.Lock()
+
+    def size_at(self, offset):
+        """Get the page size of a request starting at item `offset`
+
+        Page sizes are aligned to the offset when possible, so that no items
+        are requested twice.
+        """
+        with self._lock:
+            per_page = self.per_page
+        while per_page > self.min_per_page and offset % per_page:
+            per_page //= 2
+        return max(per_page, self.min_per_page)
+
+    def update(self, page, num_items):
+        """Adapt the page size to the measurements of a received page"""
+        with self._lock:
+            if page.elapsed > self.target_time or page.num_bytes > self.target_bytes:
+                self.per_page = max(self.min_per_page, page.per_page // 2)
+            elif (num_items >= page.per_page and page.per_page >= self.per_page and
+                  page.elapsed < self.target_time / 2 and page.num_bytes < self.target_bytes / 2):
+                self.per_page = min(self.max_per_page, page.per_page * 2)
+
+    def backoff(self, per_page, too_large=False):
+        """Shrink the page size after an error, or return ``False`` when not possible
+
+        When the server answered that the page is `too_large`, the smaller
+        page size is also learned as the maximum page size.
+        """
+        if per_page <= self.min_per_page:
+            return False
+        smaller = max(self.min_per_page, per_page // 2)
+        if too_large:
+            self.capped(smaller)
+        with self._lock:
+            self.per_page = min(self.per_page, smaller)
+        return True
+
+    def capped(self, num_items):
+        """Learn that the server does not send more than `num_items` per page"""
+        with self._lock:
+            self.max_per_page = min(self.max_per_page, num_items)
+            self.min_per_page = min(self.min_per_page, self.max_per_page)
+            self.per_page = min(self.per_page, self.max_per_page)
+        if self.key is not None:
+            with _max_per_page_lock:
+                _max_per_page_cache[self.key] = min(num_items, _max_per_page_cache.get(self.key, num_items))
+        logger.debug('Server limits the page size of %s to %d items', self.key, num_items)
+
+
+class PageIterator:
+    """Iterator over the items of a paginated API endpoint
+
+    Pages are requested lazily, only when the items of the previous page have
+    been consumed, so that only one page is kept in memory at a time.
+
+    With the `prefetch` option, the following pages are requested in advance
+    while the items of the current page are consumed. Once the first page has
+    been received, its total number of items determines the pages that remain
+    to be fetched, and at most `prefetch` of them are requested concurrently.
+    Items are still yielded in order, and at most `prefetch` pages are kept in
+    memory besides the current one.
+
+    The number of items per page is either fixed by `per_page`, or adapted
+    from the measurements of each page by a :py:class:`PageSizer`. In both
+    cases, it is lowered to the maximum page size of the server when the
+    server does not honor it.
+
+    Parameters
+    ----------
+    fetch: callable
+        Function that receives a page number, starting at 1, and a number of
+        items per page. It returns the response of the API for that page,
+        which must have `results` and `total` attributes, and its size in
+        bytes. When prefetching, it is called from other threads.
+    per_page: int or PageSizer, optional
+        Number of items requested per page, or a page sizer.
+    limit: int, optional
+        Maximum number of items to iterate over. When ``None``, iterate over
+        all the items.
+    transform: callable, optional
+        Function applied to each item before it is yielded.
+    prefetch: int, optional
+        Maximum number of pages requested in advance.
+
+    Attributes
+    ----------
+    total: int
+        The total number of items reported by the API, which may be higher
+        than the number of items iterated when there is a limit. It is
+        ``None`` until the first page has been fetched.
+
+    """
+
+    def __init__(self, fetch, per_page=100, limit=None, transform=None, prefetch=0):
+        self.sizer = per_page if isinstance(per_page, PageSizer) else None
+        self.per_page = per_page if self.sizer is None else None
+        self.limit = sys.maxsize if limit is None else limit
+        self.prefetch = prefetch
+        self.total = None
+        self._fetch = fetch
+        self._transform = transform
+        self._executor = None
+        self._generator = self._generate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._generator)
+
+    def close(self):
+        """Stop the iteration and cancel the pages requested in advance"""
+        self._generator.close()
+
+    def _generate(self):
+        count = 0
+        next_offset = 0
+        pending = collections.deque()
+        try:
+            while count < self.limit:
+                if not pending:
+                    next_offset = self._submit(pending, next_offset)
+                page = pending.popleft().result()
+                self.total = page.response.total
+                all_results = page.response.results or []
+                if not all_results:
+                    # There are no more items, even if the total announced
+                    # more: items were removed during the iteration
+                    return
+                start = (page.number - 1) * page.per_page
+                end = min(self.total, self.limit)
+
+                capped = server_page_size(page.number, page.per_page, self.total, len(all_results),
+                                          getattr(page.response, 'pages', None))
+                if capped is not None:
+                    # The server sent fewer items than requested: its page
+                    # offsets do not correspond to the requested page size
+                    if self.sizer is not None:
+                        self.sizer.capped(capped)
+                    else:
+                        logger.debug('Server limits the page size to %d items', capped)
+                        self.per_page = capped
+                if start > count or capped is not None:
+                    # There is a gap between the items iterated and this page:
+                    # request again the following pages
+                    self._cancel(pending)
+                    next_offset = count
+                    continue
+
+                # Skip the items already iterated, when a previous page had
+                # more items than its page size, and the ones over the limit
+                results = all_results[count - start:self.limit - start]
+                if not results:
+                    return
+                if self.sizer is not None:
+                    self.sizer.update(page, len(all_results))
+
+                # Request the next pages before yielding the items of this one
+                next_offset = max(next_offset, count + len(results))
+                while self.prefetch and len(pending) < self.prefetch and next_offset < end:
+                    next_offset = self._submit(pending, next_offset)
+
+                for item in results:
+                    yield self._transform(item) if self._transform else item
+                count += len(results)
+                if count >= end:
+                    return
+        finally:
+            self._cancel(pending)
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+
+    def _submit(self, pending, offset):
+        """Request the page that contains the item at `offset`
+
+        Returns the offset of the item after the requested page.
+        """
+        per_page = self.per_page if self.sizer is None else self.sizer.size_at(offset)
+        number = offset // per_page + 1
+        if self.prefetch and self.total is not None:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch)
+            future = self._executor.submit(self._fetch_page, number, per_page)
+        else:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(self._fetch_page(number, per_page))
+            except Exception as ex:
+                future.set_exception(ex)
+        pending.append(future)
+        return number * per_page
+
+    def _fetch_page(self, number, per_page):
+        while True:
+            start = time.monotonic()
+            try:
+                response, num_bytes = self._fetch(number, per_page)
+                return _Page(number, per_page, response, time.monotonic() - start, num_bytes)
+            except QuetzalAPIException as ex:
+                too_large = ex.status == codes.request_entity_too_large
+                retry = (self.sizer is not None and
+                         (too_large or isinstance(ex.status, int) and ex.status >= 500) and
+                         self.sizer.backoff(per_page, too_large))
+                if not retry:
+                    raise
+                # Request the page that contains the same first item with a
+                # smaller page size
+                offset = (number - 1) * per_page
+                per_page = self.sizer.size_at(offset)
+                number = offset // per_page + 1
+                logger.debug('Page request failed with status %s, retrying with %d items per page',
+                             ex.status, per_page)
+
+    @staticmethod
+    def _cancel(pending):
+        while pending:
+            pending.popleft().cancel()
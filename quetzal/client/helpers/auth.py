@@ -26,8 +26,9 @@ def login(client):
 
     """
     response = client.auth_get_token()
-    # Manage success: save the access token
-    client.configuration.access_token = response.token
+    # Manage success: save the access token, also in the token store of the
+    # client when it is enabled
+    client.set_token(response.token)
     return response
 
 
@@ -57,6 +58,7 @@ def logout(client):
 
     """
     client.auth_logout()
-    # Manage success: save the access token
-    client.configuration.access_token = None
+    # Manage success: forget the access token, also in the token store of
+    # the client when it is enabled
+    client.clear_token()
 
@@ -0,0 +1,231 @@
+""" Columnar containers of query results
+
+Query results are lists of rows, each one a dictionary with the same keys.
+Storing many rows this way repeats the keys on every row and keeps every
+value as a Python object. The :py:class:`ColumnarResult` in this module
+stores the results as one typed array per column instead, which is more
+compact and can be exported to NumPy, pandas or Arrow.
+
+NumPy, pandas and pyarrow are optional dependencies, only needed for the
+corresponding export methods. They can be installed with the ``columnar``
+extra of this package.
+
+"""
+import array
+import importlib
+import math
+
+
+def _import_optional(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError as ex:
+        raise ImportError(f'The {name} package is needed for this operation. Install it, '
+                          f'or install quetzal-client[columnar].') from ex
+
+
+# Integers above this magnitude lose precision when stored as floats
+_MAX_EXACT_FLOAT_INT = 1 << 53
+
+
+def _is_exact_float(value):
+    return -_MAX_EXACT_FLOAT_INT <= value <= _MAX_EXACT_FLOAT_INT
+
+
+class _Column:
+    """A column of values that keeps the narrowest type that holds them all
+
+    Integers, floats and booleans are stored in :py:class:`array.array`
+    objects. A column of integers or booleans becomes a column of floats when
+    it receives a float or a missing value, which is stored as NaN. Any other
+    value makes the column a list of objects, and so do integers that a float
+    cannot represent exactly in a column of floats.
+    """
+
+    _typecodes = {'int': 'q', 'float': 'd', 'bool': 'B'}
+
+    def __init__(self, length=0):
+        # Values before the first non-null value are missing
+        self.kind = None
+        self.values = None
+        self.missing = length
+
+    def __len__(self):
+        return self.missing if self.values is None else len(self.values)
+
+    def append(self, value):
+        if self.kind is None:
+            if value is None:
+                self.missing += 1
+                return
+            self._start(self._kind_of(value))
+        elif value is not None and self.kind != 'object' and self._kind_of(value) != self.kind:
+            self._promote(self._kind_of(value))
+        elif value is None and self.kind in ('int', 'bool'):
+            self._promote('float')
+        if self.kind == 'float' and type(value) is int and not _is_exact_float(value):
+            self._promote('object')
+
+        if self.kind == 'float' and value is None:
+            value = math.nan
+        self.values.append(value)
+
+    @staticmethod
+    def _kind_of(value):
+        if isinstance(value, bool):
+            return 'bool'
+        if isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        return 'object'
+
+    def _start(self, kind):
+        self.kind = kind
+        if kind == 'object':
+            self.values = [None] * self.missing
+        elif self.missing:
+            self.kind = 'float'
+            self.values = array.array('d', [math.nan]) * self.missing
+        else:
+            self.values = array.array(self._typecodes[kind])
+
+    def _promote(self, kind):
+        if self.kind == 'int' and kind == 'float' and not all(_is_exact_float(v) for v in self.values):
+            # Keep the exact values instead of rounding them
+            kind = 'object'
+        if {self.kind, kind} <= {'int', 'float'} or {self.kind, kind} <= {'bool', 'float'}:
+            self.kind = 'float'
+            self.values = array.array('d', self.values)
+        else:
+            self.values = [self._to_python(v) for v in self.values]
+            self.kind = 'object'
+
+    def _to_python(self, value):
+        if self.kind == 'bool':
+            return bool(value)
+        if self.kind == 'float' and math.isnan(value):
+            return None
+        return value
+
+    def to_list(self):
+        if self.values is None:
+            return [None] * self.missing
+        if self.kind == 'object':
+            return list(self.values)
+        return [self._to_python(v) for v in self.values]
+
+    def to_numpy(self, copy=True):
+        np = _import_optional('numpy')
+        if self.values is None:
+            return np.full(self.missing, None, dtype=object)
+        if self.kind == 'object':
+            column = np.empty(len(self.values), dtype=object)
+            column[:] = self.values
+            return column
+        column = np.frombuffer(self.values, dtype={'int': np.int64, 'float': np.float64, 'bool': np.uint8}[self.kind])
+        if copy:
+            column = column.copy()
+        return column.view(np.bool_) if self.kind == 'bool' else column
+
+
+class ColumnarResult:
+    """Query results stored as one typed array per column
+
+    Rows are appended, usually one page of results at a time, with
+    :py:meth:`extend`. Columns of integers, floats and booleans are kept in
+    :py:mod:`array` buffers, that are exported to NumPy arrays with
+    :py:meth:`to_numpy`. Missing values of numeric columns are stored as
+    NaN; columns of integers that a float cannot represent exactly are kept
+    as lists instead, so that no value is rounded. Columns of other types,
+    such as strings, are kept as lists.
+
+    Attributes
+    ----------
+    total: int
+        The total number of rows of the query, which may be higher than the
+        number of rows of this object when there was a limit. It is set by
+        :py:func:`quetzal.client.helpers.query.query_columns`.
+
+    """
+
+    def __init__(self, rows=()):
+        self._columns = {}
+        self._length = 0
+        self.total = None
+        self.extend(rows)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        """Get the values of a column as a list"""
+        return self._columns[name].to_list()
+
+    def __iter__(self):
+        """Iterate over the rows, as dictionaries"""
+        columns = {name: column.to_list() for name, column in self._columns.items()}
+        for i in range(self._length):
+            yield {name: values[i] for name, values in columns.items()}
+
+    @property
+    def column_names(self):
+        return list(self._columns)
+
+    def append(self, row):
+        """Append a row, given as a dictionary"""
+        for name in row:
+            if name not in self._columns:
+                self._columns[name] = _Column(self._length)
+        for name, column in self._columns.items():
+            column.append(row.get(name))
+        self._length += 1
+
+    def extend(self, rows):
+        """Append several rows, given as dictionaries"""
+        for row in rows:
+            self.append(row)
+
+    def to_numpy(self, copy=True):
+        """Get the columns as a dictionary of NumPy arrays
+
+        When `copy` is ``False``, numeric columns share the memory of this
+        object instead of being copied. Their buffers cannot be resized
+        while these arrays exist, so :py:meth:`append` and :py:meth:`extend`
+        raise a :py:class:`BufferError` until the arrays are deleted.
+        """
+        return {name: column.to_numpy(copy) for name, column in self._columns.items()}
+
+    def to_pandas(self):
+        """Get the results as a :py:class:`pandas.DataFrame`"""
+        pd = _import_optional('pandas')
+        return pd.DataFrame(self.to_numpy(), columns=self.column_names, copy=False)
+
+    def to_arrow(self):
+        """Get the results as a :py:class:`pyarrow.Table`"""
+        pa = _import_optional('pyarrow')
+        arrays = []
+        for name, column in self._columns.items():
+            if column.kind in ('int', 'float'):
+                arrays.append(pa.array(column.to_numpy(), from_pandas=column.kind == 'float'))
+            else:
+                arrays.append(pa.array(column.to_list()))
+        return pa.Table.from_arrays(arrays, names=self.column_names)
+
+    def write_parquet(self, where, **kwargs):
+        """Write the results to a Parquet file
+
+        Extra keyword arguments are passed to
+        :py:func:`pyarrow.parquet.write_table`.
+        """
+        pq = _import_optional('pyarrow.parquet')
+        pq.write_table(self.to_arrow(), where, **kwargs)
+
+    def write_feather(self, where, **kwargs):
+        """Write the results to a Feather file
+
+        Extra keyword arguments are passed to
+        :py:func:`pyarrow.feather.write_feather`.
+        """
+        feather = _import_optional('pyarrow.feather')
+        feather.write_feather(self.to_arrow(), where, **kwargs)
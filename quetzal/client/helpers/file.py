@@ -1,14 +1,140 @@
+import collections
+import concurrent.futures
 import functools
+import hashlib
+import json
 import logging
+import os
 import pathlib
+import tempfile
+import threading
+import time
 
-from quetzal.client.utils import get_data_dir, get_readable_info
+import urllib3
+from requests import codes
+
+from quetzal.client.config import get_option
+from quetzal.client.exceptions import NotModifiedException, QuetzalAPIException, RetryableException
+from quetzal.client.utils import get_data_dir, get_cached_readable_info, get_readable_info, update_checksum_index
 
 
 logger = logging.getLogger(__name__)
 
+# Minimum size of each byte range when downloading a file with several streams
+MIN_RANGE_SIZE = (8 << 20)  # 8 Mb
+
+DownloadResult = collections.namedtuple('DownloadResult', ['file_id', 'path', 'error'])
+DownloadResult.__doc__ = """Result of a file download in :py:func:`download_many`
+
+Attributes
+----------
+file_id: str
+    File identifier.
+path: str
+    Absolute path of the downloaded file, or ``None`` when it failed.
+error: Exception
+    Exception raised while downloading the file, or ``None`` when it
+    succeeded.
+"""
+
+
+def download(client, file_id=None, wid=None, *, output=None, output_dir=None,
+             chunk_size=None, checksum_index=False, max_resumes=5,
+             streams=1, **kwargs):
+    """ Download a file.
+
+    This function calls the Quetzal API endpoint to retrieve the contents of
+    a file, inside or outside a workspace. The contents are streamed in chunks
+    of `chunk_size` bytes to a partial download file on the same directory as
+    the final output, which is renamed to its final name only when the
+    download has finished successfully. Memory usage does not depend on the
+    file size.
+
+    Downloads are resumable: when the connection is interrupted, the download
+    continues from the last byte received by means of a `Range` request.
+    If the process itself is interrupted, the partial download file and its
+    state file are kept, so that the next call to this function continues
+    where it stopped. The partial download file is locked while it is in
+    use: a concurrent download of the same file to the same output, in
+    another thread or process, uses its own temporary file instead.
+
+    Large files can be downloaded with several concurrent streams, using the
+    `streams` option. In this case, the file is split in byte ranges of at
+    least :py:data:`MIN_RANGE_SIZE` bytes that are downloaded at the same time
+    and written at their offset of a preallocated file. The checksum is then
+    verified by reading the complete file once. Partial downloads with several
+    streams are not kept when the process is interrupted. When the server
+    ignores range requests, the file is downloaded with a single stream.
+
+    The checksum and size of the file are calculated on the fly while the
+    contents are written, so verifying the download does not need to read
+    the file again. When the output file already exists and its size and
+    checksum match the base metadata of the file, the download is skipped.
+    With the `checksum_index` option, the checksum of an existing file is
+    taken from a sidecar index file (see
+    :py:func:`quetzal.client.utils.get_cached_readable_info`) when its size
+    and modification time have not changed, avoiding to read it again.
+
+    The progress of the download is sent to the transfer listeners of the
+    client (see :py:class:`quetzal.client.base.TransferListener`).
+
+    When the download cache of the client is enabled (see
+    :py:attr:`quetzal.client.base.Client.download_cache`), downloaded files
+    are added to a local store indexed by their checksum. A file whose
+    contents are already in the store is not downloaded again, even when it
+    was downloaded from another workspace or to another output: it is linked
+    or copied from the store instead.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    file_id: str, optional
+        File identifier. Do not use with `kwargs`.
+    wid: int, optional
+        Workspace identifier. When ``None``, the file is downloaded from the
+        public (committed) files.
+    output: str or pathlib.Path, optional
+        Output filename. Do not use with `output_dir`.
+    output_dir: str or pathlib.Path, optional
+        Output directory. The file will be saved in this directory, following
+        the path and filename entries of its base metadata. When neither
+        `output` or `output_dir` are set, the user data directory is used.
+    chunk_size: int, optional
+        Number of bytes read from the server response at each iteration. By
+        default, the `chunk_size` of the client configuration. Chunks are
+        acquired on the transfer budget of the client (see
+        :py:class:`quetzal.client.base.TransferBudget`) while they are in
+        memory.
+    checksum_index: bool, optional
+        When ``True``, use and update the checksum index of the output
+        directory. The index is a hidden file written in the output
+        directory, so it is only used when requested.
+    max_resumes: int, optional
+        Maximum number of times that an interrupted download is resumed.
+        When using several streams, this applies to each byte range.
+    streams: int, optional
+        Maximum number of concurrent streams used to download the file.
+    **kwargs
+        Filters on the base metadata of the file, used to find the file when
+        `file_id` is not set. For example, `filename='foo.bin'`.
+
+    Returns
+    -------
+    str
+        Absolute path of the downloaded file.
 
-def download(client, file_id=None, wid=None, *, output=None, output_dir=None, **kwargs):
+    Raises
+    ------
+    ValueError
+        When the file cannot be found, when the filters match several files
+        or when the downloaded file is corrupted.
+    quetzal.client.exceptions.QuetzalAPIException
+        When the API returns an error.
+    urllib3.exceptions.RequestError
+        When there was a problem connecting to the server.
+
+    """
 
     if output is None and output_dir is None:
         # When neither output nor output_file are defined, fall back to a
@@ -36,17 +162,25 @@ def download(client, file_id=None, wid=None, *, output=None, output_dir=None, **
     else:
         output = pathlib.Path(output)
 
+    config = client.configuration
+    chunk_size = chunk_size or get_option(config, 'chunk_size')
+    options = _TransferOptions(chunk_size, get_option(config, 'read_buffer_size'), client.transfer_budget, None)
+
     # Before downloading, check if the file already exists and has the correct
     # size and checksum
-    if output.exists():
-        with output.open('rb') as f:
-            md5, size = get_readable_info(f)
-        if md5 == base['checksum'] and size == base['size']:
-            logger.debug('File %s already downloaded in %s', file_id, output)
+    if _is_up_to_date(output, base, checksum_index, options.read_buffer_size):
+        logger.debug('File %s already downloaded in %s', file_id, output)
+        return str(output.resolve())
+
+    store = client.download_cache
+    if store is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        method = store.materialize(base['checksum'], output)
+        if method is not None:
+            logger.debug('File %s restored in %s from the download cache (%s)', file_id, output, method)
+            if checksum_index:
+                update_checksum_index(output, base['checksum'], base['size'])
             return str(output.resolve())
-        else:
-            logger.debug('File %s already downloaded in %s, but the size and '
-                         'checksum do not match. Downloading it again', file_id, output)
 
     # The file does not exist locally, let's download it
     # Use the file details in workspace or outside workspace function
@@ -55,33 +189,481 @@ def download(client, file_id=None, wid=None, *, output=None, output_dir=None, **
     else:
         func = functools.partial(client.workspace_file_details, wid=wid, uuid=file_id)
 
-    contents = func(_accept='application/octet-stream', _preload_content=False)
     output.parent.mkdir(parents=True, exist_ok=True)
-    with open(output, 'wb') as f:
-        f.write(contents.data)
+    progress = client.new_transfer('download', base['filename'], base['size'])
+    options = options._replace(progress=progress)
+    ranges = _split_ranges(base['size'], streams)
+    part, state_file, lock = _reserve_partial_download(output)
+    try:
+        progress.start()
+        try:
+            if len(ranges) > 1:
+                size, md5 = _download_ranges(func, part, file_id, base, options, max_resumes, ranges)
+            else:
+                size, md5 = _download_contents(func, part, state_file, file_id, base, options, max_resumes)
 
-    # After downloading, check if the file has the correct size and checksum
-    if output.exists():
-        with output.open('rb') as f:
-            md5, size = get_readable_info(f)
-        if (md5, size) != (base['checksum'], base['size']):
-            logger.warning('File %s was downloaded in %s but is corrupted', file_id, output)
-            raise ValueError('Download resulted in corrupted local file')
+            # After downloading, check if the file has the correct size and checksum
+            # before moving it to its final destination
+            if (md5, size) != (base['checksum'], base['size']):
+                logger.warning('File %s was downloaded in %s but is corrupted', file_id, output)
+                raise ValueError('Download resulted in corrupted local file')
+        except Exception as ex:
+            progress.fail(ex)
+            if state_file is None or not _is_resumable(ex):
+                _remove_quietly(part)
+                if state_file is not None:
+                    _remove_quietly(state_file)
+            raise
+        progress.finish()
 
+        os.replace(str(part), str(output))
+        if state_file is not None:
+            _remove_quietly(state_file)
+    finally:
+        if lock is not None:
+            os.close(lock)
+
+    if store is not None:
+        try:
+            store.add(output, base['checksum'], base['size'])
+        except OSError:
+            logger.warning('Could not add file %s to the download cache', file_id, exc_info=True)
+
+    if checksum_index:
+        update_checksum_index(output, base['checksum'], base['size'])
     return str(output.resolve())
 
 
+def download_many(client, file_ids, wid=None, *, output_dir=None, workers=8, **kwargs):
+    """ Download several files concurrently.
+
+    This function downloads a collection of files using a pool of `workers`
+    threads that share the connection pool of the `client`. Each thread
+    requests the metadata and then the contents of a file with
+    :py:func:`download`, so that the requests of different files overlap.
+    Files that were already downloaded and whose size and checksum match
+    their base metadata are not downloaded again.
+
+    An error on a file does not stop the download of the other files. Errors
+    are reported on the result of each file.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    file_ids: iterable of str
+        File identifiers.
+    wid: int, optional
+        Workspace identifier. When ``None``, the files are downloaded from the
+        public (committed) files.
+    output_dir: str or pathlib.Path, optional
+        Output directory. Files are saved following the path and filename
+        entries of their base metadata. When not set, the user data directory
+        is used.
+    workers: int, optional
+        Number of concurrent downloads.
+    **kwargs
+        Extra options passed to :py:func:`download`, such as `chunk_size`.
+
+    Returns
+    -------
+    list of DownloadResult
+        The result of each file, in the same order as `file_ids`.
+
+    """
+    if output_dir is None:
+        output_dir = get_data_dir()
+
+    def download_one(file_id):
+        try:
+            path = download(client, file_id, wid, output_dir=output_dir, **kwargs)
+            return DownloadResult(file_id, path, None)
+        except Exception as ex:
+            logger.debug('Failed to download file %s', file_id, exc_info=True)
+            return DownloadResult(file_id, None, ex)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(download_one, file_ids))
+
+
+def _partial_download_paths(output):
+    """Get the path of the partial download and its state file"""
+    part = output.with_name(f'.{output.name}.part')
+    state_file = output.with_name(f'.{output.name}.part.json')
+    return part, state_file
+
+
+def _reserve_partial_download(output):
+    """Get a partial download file of an output that no other download uses
+
+    The partial download file of an output has a fixed name, so that a later
+    call can resume the download. It is locked while it is in use. When
+    another thread or process holds the lock, a unique partial download file
+    is created instead, without a state file: its download cannot be resumed
+    by a later call.
+
+    Returns the partial download file, its state file or ``None``, and the
+    file descriptor that holds the lock or ``None``. The descriptor must be
+    closed once the partial download file has been renamed or removed.
+    """
+    part, state_file = _partial_download_paths(output)
+    lock = _lock_partial_download(part)
+    if lock is not None:
+        return part, state_file, lock
+    logger.debug('Partial download %s is in use by another download', part)
+    fd, name = tempfile.mkstemp(dir=str(output.parent), prefix=f'.{output.name}.', suffix='.part')
+    os.close(fd)
+    return pathlib.Path(name), None, None
+
+
+def _lock_partial_download(part):
+    """Lock a partial download file, or return ``None`` when it is already locked
+
+    The lock is an exclusive ``flock`` on the file, which the system releases
+    when the process ends. Where ``flock`` is not available, the lock is a
+    file created exclusively next to it, that Windows deletes when it is
+    closed. Returns the file descriptor that holds the lock.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+
+    if fcntl is None:
+        lock_file = part.with_name(f'{part.name}.lock')
+        try:
+            return os.open(str(lock_file), os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_TEMPORARY', 0))
+        except FileExistsError:
+            return None
+
+    fd = os.open(str(part), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The download that held the lock may have renamed the file meanwhile
+        if os.path.samestat(os.fstat(fd), os.stat(str(part))):
+            return fd
+    except OSError:
+        pass
+    os.close(fd)
+    return None
+
+
+def _is_resumable(error):
+    """Whether a download that failed with `error` can be resumed by a later call"""
+    return isinstance(error, (urllib3.exceptions.HTTPError, RetryableException))
+
+
+def _download_contents(func, part, state_file, file_id, base, options, max_resumes):
+    """Download the contents of a file into its partial download file
+
+    The contents are appended to the partial download file. When the
+    connection is interrupted, the download is resumed with a `Range` request
+    starting from the last byte written, at most `max_resumes` times.
+
+    When `state_file` is set, the partial download file may be the one of a
+    download interrupted by a previous call, and it is resumed. The state
+    file is written once the server has answered the first request, so that
+    requests that fail, for example because the file does not exist, do not
+    leave a state file behind.
+
+    Returns the size and md5sum of the downloaded contents.
+    """
+    state = {
+        'id': file_id,
+        'checksum': base['checksum'],
+        'size': base['size'],
+    }
+    if state_file is not None:
+        hashobj, offset = _restore_partial_download(part, state_file, state, options.read_buffer_size)
+    else:
+        hashobj, offset = hashlib.new('md5'), 0
+    saved = offset > 0
+    if offset:
+        options.progress.retry(offset=offset)
+    if offset and offset >= base['size']:
+        # The partial download is complete, but was not finalized: a range
+        # request would be rejected with a 416 error
+        logger.debug('Partial download of file %s is complete', file_id)
+        return offset, hashobj.hexdigest()
+
+    resumes = 0
+    with part.open('ab') as f:
+        while True:
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                response = func(_accept='application/octet-stream', _preload_content=False,
+                                _headers=headers)
+                if state_file is not None and not saved:
+                    with state_file.open('w') as state_f:
+                        json.dump(state, state_f)
+                    saved = True
+                if offset and response.status != codes.partial_content:
+                    # The server ignored the range request: start over
+                    logger.debug('Server did not accept a range request, restarting '
+                                 'download of file %s', file_id)
+                    f.seek(0)
+                    f.truncate()
+                    hashobj, offset = hashlib.new('md5'), 0
+                    options.progress.retry(offset=0)
+                _stream_response(response, f, options, hashobj)
+                f.flush()
+                offset = f.tell()
+                if offset >= base['size']:
+                    break
+                logger.debug('Download of file %s ended prematurely at byte %d', file_id, offset)
+            except urllib3.exceptions.HTTPError as ex:
+                f.flush()
+                offset = f.tell()
+                if resumes >= max_resumes:
+                    raise
+                logger.debug('Download of file %s interrupted at byte %d: %s', file_id, offset, ex)
+                error = ex
+            else:
+                error = None
+
+            if resumes >= max_resumes:
+                break
+            resumes += 1
+            logger.info('Resuming download of file %s from byte %d', file_id, offset)
+            options.progress.retry(error, offset=offset)
+
+    return offset, hashobj.hexdigest()
+
+
+def _split_ranges(size, streams):
+    """Split a file size in at most `streams` ranges of inclusive (start, end) offsets"""
+    num_ranges = max(1, min(streams, size // MIN_RANGE_SIZE))
+    if num_ranges == 1:
+        return [(0, size - 1)]
+    range_size = -(-size // num_ranges)  # ceil division
+    return [(start, min(start + range_size, size) - 1)
+            for start in range(0, size, range_size)]
+
+
+def _download_ranges(func, part, file_id, base, options, max_resumes, ranges):
+    """Download the contents of a file with concurrent range requests
+
+    The partial download file is preallocated to the final file size and each
+    range is written at its offset by a different thread, each one with its
+    own file object. Multi-range downloads are not resumable across calls:
+    the partial download file is removed when the download fails.
+
+    Some servers and proxies ignore range requests and answer with the
+    complete contents. In this case, the other ranges are abandoned and the
+    file is downloaded again with a single stream.
+
+    Returns the size and md5sum of the downloaded contents.
+    """
+    with part.open('wb') as f:
+        f.truncate(base['size'])
+    ranges_ignored = threading.Event()
+
+    def download_range(start, end):
+        resumes = 0
+        with part.open('r+b') as f:
+            f.seek(start)
+            while not ranges_ignored.is_set():
+                offset = f.tell()
+                try:
+                    response = func(_accept='application/octet-stream', _preload_content=False,
+                                    _headers={'Range': f'bytes={offset}-{end}'})
+                    if response.status != codes.partial_content:
+                        # Do not read the complete contents: close the connection
+                        response.close()
+                        response.release_conn()
+                        ranges_ignored.set()
+                        return
+                    _stream_response(response, f, options, _NoHash())
+                except urllib3.exceptions.HTTPError as ex:
+                    if resumes >= max_resumes:
+                        raise
+                    logger.debug('Download of range %d-%d of file %s interrupted at byte %d: %s',
+                                 start, end, file_id, f.tell(), ex)
+                    error = ex
+                else:
+                    error = None
+                if f.tell() > end:
+                    return
+                if resumes >= max_resumes:
+                    raise ValueError(f'Download of range {start}-{end} ended prematurely')
+                resumes += 1
+                options.progress.retry(error)
+
+    logger.debug('Downloading file %s in %d ranges', file_id, len(ranges))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(download_range, start, end) for start, end in ranges]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        if ranges_ignored.is_set():
+            logger.debug('Server did not accept a range request, downloading file %s '
+                         'with a single stream', file_id)
+            with part.open('wb'):
+                pass
+            options.progress.retry(offset=0)
+            return _download_contents(func, part, None, file_id, base, options, max_resumes)
+    except BaseException:
+        _remove_quietly(part)
+        raise
+
+    with part.open('rb') as f:
+        md5, size = get_readable_info(f, options.read_buffer_size)
+    return size, md5
+
+
+_TransferOptions = collections.namedtuple('_TransferOptions', ['chunk_size', 'read_buffer_size', 'budget', 'progress'])
+
+
+class _NoHash:
+    """Hash-like object that ignores its contents"""
+
+    def update(self, data):
+        pass
+
+
+def _restore_partial_download(part, state_file, state, buffer_size):
+    """Recover the state of a previously interrupted download
+
+    A partial download can only be resumed if its state file corresponds to
+    the same file id, checksum and size. Since hash objects cannot be saved,
+    the hash of the partial contents is recalculated from the partial file.
+    Otherwise, a new partial download is prepared and the outdated state
+    file is removed.
+
+    Returns the hash object and the number of bytes already downloaded.
+    """
+    hashobj = hashlib.new('md5')
+    try:
+        with state_file.open('r') as f:
+            saved_state = json.load(f)
+    except (OSError, ValueError):
+        saved_state = None
+
+    if saved_state == state and part.exists() and part.stat().st_size <= state['size']:
+        offset = 0
+        with part.open('rb') as f:
+            for chunk in iter(functools.partial(f.read, buffer_size), b''):
+                hashobj.update(chunk)
+                offset += len(chunk)
+        logger.debug('Found a partial download of file %s with %d bytes', state['id'], offset)
+        return hashobj, offset
+
+    _remove_quietly(state_file)
+    with part.open('wb'):
+        pass
+    return hashobj, 0
+
+
+def _is_up_to_date(output, base, checksum_index=True, buffer_size=(64 << 10)):
+    """Verify if a local file has the size and checksum of its base metadata"""
+    try:
+        if output.stat().st_size != base['size']:
+            # No need to calculate the checksum when the size is different
+            logger.debug('File %s exists but its size does not match', output)
+            return False
+    except FileNotFoundError:
+        return False
+
+    if checksum_index:
+        md5, size = get_cached_readable_info(output, buffer_size)
+    else:
+        with output.open('rb') as f:
+            md5, size = get_readable_info(f, buffer_size)
+    if (md5, size) != (base['checksum'], base['size']):
+        logger.debug('File %s exists but its checksum does not match', output)
+        return False
+    return True
+
+
+def _stream_response(response, file_obj, options, hashobj):
+    """Write the contents of a non-preloaded urllib3 response to a file
+
+    The `hashobj` is updated with the contents while they are written. Each
+    chunk is acquired on the transfer budget before being read, and
+    notified to the transfer progress once written.
+    Returns the number of bytes written.
+    """
+    size = 0
+    try:
+        while True:
+            options.budget.acquire(options.chunk_size)
+            try:
+                chunk = response.read(options.chunk_size)
+                if not chunk:
+                    break
+                file_obj.write(chunk)
+                hashobj.update(chunk)
+                size += len(chunk)
+                options.progress.chunk(len(chunk))
+            finally:
+                options.budget.release(options.chunk_size)
+    finally:
+        response.release_conn()
+    return size
+
+
+def _remove_quietly(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
 def metadata(client, file_id, wid=None):
-    # Use the file details in workspace or outside workspace function
+    """ Get the metadata of a file.
+
+    When the metadata cache of the client is enabled (see
+    :py:attr:`quetzal.client.base.Client.metadata_cache`), the metadata is
+    saved locally. The metadata of public files cannot change, so it is always
+    taken from the cache. The metadata of workspace files is taken from the
+    cache for `metadata_cache_ttl` seconds after it was received; after that,
+    it is validated with a conditional request using the entity tag of the
+    cached entry, which is cheaper than downloading the metadata again when
+    it has not changed.
+    """
+    cache = client.metadata_cache
+    if cache is None:
+        # Use the file details in workspace or outside workspace function
+        if wid is None:
+            func = functools.partial(client.public_file_details, uuid=file_id)
+        else:
+            func = functools.partial(client.workspace_file_details, wid=wid, uuid=file_id)
+
+        metadata_response = func(_accept='application/json')
+        return metadata_response['metadata']
+
+    key = _metadata_cache_key(client, file_id, wid)
+    entry = cache.get(key)
+    headers = {}
+    if entry is not None:
+        if wid is None or time.time() - entry.stored < get_option(client.configuration, 'metadata_cache_ttl'):
+            return entry.value
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+
     if wid is None:
-        func = functools.partial(client.public_file_details, uuid=file_id)
+        func = functools.partial(client.data_api.public_file_details_with_http_info, file_id)
     else:
-        func = functools.partial(client.workspace_file_details, wid=wid, uuid=file_id)
+        func = functools.partial(client.data_api.workspace_file_details_with_http_info, wid, file_id)
+    try:
+        metadata_response, _, response_headers = func(_accept='application/json', _headers=headers)
+    except NotModifiedException:
+        logger.debug('Cached metadata of file %s is still valid', file_id)
+        cache.touch(key)
+        return entry.value
+    except QuetzalAPIException as ex:
+        if ex.status == codes.not_found:
+            cache.invalidate(key)
+        raise
 
-    metadata_response = func(_accept='application/json')
+    cache.put(key, metadata_response['metadata'], (response_headers or {}).get('ETag'))
     return metadata_response['metadata']
 
 
+def _metadata_cache_key(client, file_id, wid):
+    return f'{client.configuration.host}|{"public" if wid is None else wid}|{file_id}'
+
+
 def find(client, wid=None, **kwargs):
     """ Fetch a file details object from the list files endpoint
 
@@ -102,3 +684,6 @@ def find(client, wid=None, **kwargs):
 def delete(client, file_id, wid):
     """ Delete a file"""
     client.workspace_file_delete(wid, file_id)
+    cache = client.metadata_cache
+    if cache is not None:
+        cache.invalidate(_metadata_cache_key(client, file_id, wid))
@@ -3,7 +3,9 @@ import urllib3
 from quetzal.client import Client, Configuration
 
 
-def get_client(url=None, username=None, password=None, insecure=False, api_key=None):
+def get_client(url=None, username=None, password=None, insecure=False, api_key=None,
+               pool_maxsize=None, pool_block=None, pools=None, keep_alive=None,
+               retry_policy=None):
     """ Get a Quetzal client instance.
 
     Prepares a :py:ref:`quetzal.client.Client` instance with the provided
@@ -21,6 +23,19 @@ def get_client(url=None, username=None, password=None, insecure=False, api_key=N
         When ``False``, disables SSL verification of the HTTPS certificate.
     api_key: str, optional
         Quetzal API key. Do not use with username or password.
+    pool_maxsize: int, optional
+        Maximum number of connections kept open to the server. Set it to at
+        least the number of threads that share the client.
+    pool_block: bool, optional
+        When ``True``, requests wait for a free connection when all the
+        connections are in use, instead of opening a connection that is
+        discarded afterwards.
+    pools: int, optional
+        Number of connection pools, one for each server.
+    keep_alive: bool, optional
+        When ``True``, idle connections send TCP keep-alive probes.
+    retry_policy: quetzal.client.retry.RetryPolicy, optional
+        Retry policy of the requests that fail with a retryable error.
 
     Returns
     -------
@@ -38,5 +53,15 @@ def get_client(url=None, username=None, password=None, insecure=False, api_key=N
         config.verify_ssl = False
         # Mute urllib3 warnings
         urllib3.disable_warnings()
+    if pool_maxsize is not None:
+        config.connection_pool_maxsize = pool_maxsize
+    if pool_block is not None:
+        config.connection_pool_block = pool_block
+    if pools is not None:
+        config.connection_pools = pools
+    if keep_alive is not None:
+        config.keep_alive = keep_alive
+    if retry_policy is not None:
+        config.retry_policy = retry_policy
     client = Client(config)
     return client
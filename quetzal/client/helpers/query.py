@@ -1,40 +1,125 @@
 import functools
-import sys
 
+from quetzal.client.helpers._paging import PageIterator, fetch_page, page_size
+from quetzal.client.helpers.columnar import ColumnarResult
 
-def query(client, wid, query_contents, dialect='postgresql', limit=None):
-    """Query metadata."""
 
-    if limit is None:
-        kwargs = dict(per_page=100)
-        limit = sys.maxsize
-    else:
-        kwargs = dict(per_page=min(limit, 100))
+def query(client, wid, query_contents, dialect='postgresql', limit=None, prefetch=2):
+    """Query metadata.
+
+    This function fetches all the results of the query, up to `limit` rows,
+    in a list, with `prefetch` pages requested in advance. See
+    :py:func:`iter_query` to iterate over the results without keeping them in
+    memory.
+
+    Returns
+    -------
+    results: list
+        The rows of the query results.
+    total: int
+        The total number of rows of the query results. Note that this may be
+        higher than the number of rows returned.
+
+    """
+    rows = iter_query(client, wid, query_contents, dialect=dialect, limit=limit, prefetch=prefetch)
+    results = list(rows)
+    return results, rows.total or 0
+
+
+def query_columns(client, wid, query_contents, dialect='postgresql', limit=None, prefetch=2):
+    """Query metadata and store the results in columns.
+
+    This function fetches all the results of the query, up to `limit` rows,
+    in a :py:class:`quetzal.client.helpers.columnar.ColumnarResult`, which
+    stores the rows in typed columns as the pages arrive. This uses less
+    memory than the list of rows of :py:func:`query`, and the results can be
+    exported to NumPy, pandas or Arrow.
+
+    Returns
+    -------
+    quetzal.client.helpers.columnar.ColumnarResult
+        The query results. Its `total` attribute has the total number of
+        rows of the query results, which may be higher than the number of
+        rows fetched.
 
+    """
+    rows = iter_query(client, wid, query_contents, dialect=dialect, limit=limit, prefetch=prefetch)
+    results = ColumnarResult(rows)
+    results.total = rows.total or 0
+    return results
+
+
+def iter_query(client, wid, query_contents, dialect='postgresql', limit=None, per_page=None, prefetch=2):
+    """Iterate over the results of a metadata query.
+
+    The query is created when the iteration starts. Its results are then
+    requested one page at a time, and decoded directly as plain objects
+    without creating any model object. With the `prefetch` option, the following
+    pages are requested in advance while the rows of the current page are
+    consumed, so that the latency of each request overlaps with the
+    processing of the previous rows. Rows are always yielded in order.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    wid: int
+        Workspace identifier. When ``None``, the query is made on the public
+        (committed) metadata.
+    query_contents: str
+        Query code.
+    dialect: str, optional
+        Query dialect.
+    limit: int, optional
+        Maximum number of rows. When ``None``, iterate over all the rows.
+    per_page: int, optional
+        Number of rows to request per page. When ``None``, the number of
+        rows per page is adapted to the duration and size of the responses
+        (see :py:class:`quetzal.client.helpers._paging.PageSizer`).
+    prefetch: int, optional
+        Maximum number of pages requested in advance. When 0, a page is
+        only requested when the rows of the previous page have been
+        consumed.
+
+    Returns
+    -------
+    quetzal.client.helpers._paging.PageIterator
+        Iterator over the rows of the query results. Its `total` attribute
+        has the total number of rows once the iteration has started.
+
+    Raises
+    ------
+    quetzal.client.exceptions.QuetzalAPIException
+        When the API returns an error.
+    urllib3.exceptions.RequestError
+        When there was a problem connecting to the server.
+
+    """
     query_obj = {
         'dialect': dialect,
         'query': query_contents,
     }
 
     if wid is None:
-        query_details = client.public_query_create(query_obj, **kwargs)
+        create_func = functools.partial(client.public_query_create, query_obj)
         details_func = client.public_query_details
+        endpoint = 'public_query_details'
     else:
-        query_details = client.workspace_query_create(wid, query_obj, **kwargs)
+        create_func = functools.partial(client.workspace_query_create, wid, query_obj)
         details_func = functools.partial(client.workspace_query_details, wid)
+        endpoint = 'workspace_query_details'
 
-    results = query_details.results
-    if not results:
-        return [], 0
-
-    # The query POST action redirects to the GET details but does not have
-    # a per_page, so we might get more that we needed
-    if len(results) > limit:
-        results = results[:limit]
+    query_id = None
 
-    while len(results) < limit and len(results) < query_details.total:
-        kwargs['page'] = kwargs.get('page', 1) + 1
-        query_details = details_func(query_details.id, **kwargs)
-        results.extend(query_details.results)
+    def fetch(page, per_page):
+        nonlocal query_id
+        if query_id is None:
+            # The query POST action redirects to the GET details but does not
+            # have a per_page, so we might get more that we needed
+            query_details, num_bytes = fetch_page(client, create_func, 'Query', raw=True, per_page=per_page)
+            query_id = query_details.id
+            return query_details, num_bytes
+        return fetch_page(client, details_func, 'Query', query_id, raw=True, page=page, per_page=per_page)
 
-    return results, query_details.total
+    return PageIterator(fetch, per_page=page_size(client, per_page, endpoint, limit),
+                        limit=limit, prefetch=prefetch)
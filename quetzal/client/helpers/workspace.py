@@ -1,5 +1,39 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import pathlib
+
 import backoff
 
+from quetzal.client.config import get_option
+from quetzal.client.helpers import file as file_helpers
+from quetzal.client.helpers._paging import PageIterator, fetch_page, page_size
+from quetzal.client.utils import CHECKSUM_INDEX_FILENAME, get_readable_info
+
+
+logger = logging.getLogger(__name__)
+
+UploadResult = collections.namedtuple('UploadResult', ['filename', 'size', 'details', 'error', 'duplicate'])
+UploadResult.__doc__ = """Result of a file upload in :py:func:`upload_many`
+
+Attributes
+----------
+filename: str
+    Local path of the file, relative to the uploaded directory.
+size: int
+    Size of the file, in bytes.
+details: quetzal.openapi_client.models.BaseMetadata
+    Uploaded file details, or ``None`` when it failed.
+error: Exception
+    Exception raised while uploading the file, or ``None`` when it
+    succeeded.
+duplicate: bool
+    ``True`` when the upload was skipped because a file with the same
+    contents, path and filename already exists. In this case, `details` are
+    the details of the existing file.
+"""
+
 
 def create(client, name, description, families, temporary=False, wait=False, progress=None):
     """ Create a workspace.
@@ -60,12 +94,13 @@ def create(client, name, description, families, temporary=False, wait=False, pro
     return w_details
 
 
-def list_(client, name=None, owner=None, deleted=False, per_page=100, limit=1000):
+def list_(client, name=None, owner=None, deleted=False, per_page=None, limit=1000, raw=False):
     """ List existing workpaces.
 
     This function calls the Quetzal API endpoint to list workspaces and manages
     the paginated response to retrieve as many results as set by the `limit`
-    parameter.
+    parameter. See :py:func:`iter_workspaces` to iterate over the workspaces
+    without keeping them in memory.
 
     Parameters
     ----------
@@ -78,9 +113,14 @@ def list_(client, name=None, owner=None, deleted=False, per_page=100, limit=1000
     deleted: bool, optional
         When ``True``, include *DELETED* workspaces.
     per_page: int, optional
-        Number of items to request per page.
+        Number of items to request per page. When ``None``, it is adapted to
+        the duration and size of the responses.
     limit: int, optional
         Limit the number of workspaces to fetch.
+    raw: bool, optional
+        When ``True``, decode the responses directly as dictionaries, without
+        creating model objects. This is faster for many items, but values
+        such as dates are kept as strings.
 
     Returns
     -------
@@ -98,7 +138,51 @@ def list_(client, name=None, owner=None, deleted=False, per_page=100, limit=1000
         When there was a problem connecting to the server.
 
     """
-    kwargs = dict(per_page=min(per_page, limit), page=1)
+    workspaces = iter_workspaces(client, name, owner, deleted, per_page=per_page, limit=limit, raw=raw)
+    results = list(workspaces)
+    return results, workspaces.total or 0
+
+
+def iter_workspaces(client, name=None, owner=None, deleted=False, per_page=None, limit=None, prefetch=2,
+                    raw=False):
+    """ Iterate over existing workspaces.
+
+    This function calls the Quetzal API endpoint to list workspaces, one page
+    at a time. With the `prefetch` option, the following pages are requested
+    in advance while the workspaces of the current page are consumed.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    name: str, optional
+        Filter workspaces by this name.
+    owner: str, optional
+        Filter workspaces by this username.
+    deleted: bool, optional
+        When ``True``, include *DELETED* workspaces.
+    per_page: int, optional
+        Number of items to request per page. When ``None``, it is adapted to
+        the duration and size of the responses.
+    limit: int, optional
+        Maximum number of workspaces. When ``None``, iterate over all the
+        workspaces.
+    prefetch: int, optional
+        Maximum number of pages requested in advance.
+    raw: bool, optional
+        When ``True``, decode the responses directly as dictionaries, without
+        creating model objects. This is faster for many items, but values
+        such as dates are kept as strings.
+
+    Returns
+    -------
+    quetzal.client.helpers._paging.PageIterator
+        Iterator over the workspace details as dictionaries. Its `total`
+        attribute has the total number of workspaces once the iteration has
+        started.
+
+    """
+    kwargs = {}
     if name:
         kwargs['name'] = name
     if owner:
@@ -106,15 +190,12 @@ def list_(client, name=None, owner=None, deleted=False, per_page=100, limit=1000
     if deleted:
         kwargs['deleted'] = True
 
-    page = client.workspace_fetch(**kwargs)
+    def fetch(page, per_page):
+        return fetch_page(client, client.workspace_fetch, 'PaginatedWorkspaces',
+                          raw=raw, page=page, per_page=per_page, **kwargs)
 
-    results = [w.to_dict() for w in page.results]  # TODO: reconsider this to_dict here!
-    while len(results) < limit and len(results) < page.total:
-        kwargs['page'] = kwargs.get('page', 1) + 1
-        page = client.workspace_fetch(**kwargs)
-        results.extend([w.to_dict() for w in page.results])
-
-    return results, page.total
+    return PageIterator(fetch, per_page=page_size(client, per_page, 'workspace_fetch', limit),
+                        limit=limit, transform=None if raw else lambda w: w.to_dict(), prefetch=prefetch)
 
 
 def details(client, wid=None, name=None, owner=None):
@@ -162,11 +243,70 @@ def details(client, wid=None, name=None, owner=None):
         if not response.results:
             return None
         w_details = response.results[0]
+        cache = client.workspace_cache
+        if cache is not None:
+            cache.put(client.configuration.host, username, name, w_details.id)
     else:
         w_details = client.workspace_details(wid)
     return w_details
 
 
+def resolve(client, wid=None, name=None, owner=None):
+    """ Get the identifier of a workspace by name or id.
+
+    When the `wid` parameter is set, it is returned as is, without verifying
+    that the workspace exists. When the `name` is set, the workspace is
+    searched by name with :py:func:`details`. This function is meant for
+    operations that only need the workspace identifier.
+
+    When the workspace cache of the client is enabled (see
+    :py:attr:`quetzal.client.base.Client.workspace_cache`), identifiers found
+    by name are saved locally and no request is needed to find them again.
+    Saved identifiers are removed when the workspace is found to be deleted:
+    when a request on it fails with a *404* error, or is rejected with a
+    *400* or *412* error, and when its details have a *DELETED* status.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    wid: int, optional
+        Workspace identifier.
+    name: str, optional
+        Workspace name.
+    owner: str, optional
+        Username of the workspace owner. If not set and `name` is set, it will
+        use the username saved on the `client` configuration object.
+
+    Returns
+    -------
+    wid: int
+        Workspace identifier, or ``None`` when it was not found.
+
+    Raises
+    ------
+    quetzal.client.exceptions.QuetzalAPIException
+        When the API returns an error.
+    urllib3.exceptions.RequestError
+        When there was a problem connecting to the server.
+
+    """
+    if wid is None and name is None:
+        raise ValueError('One of wid or name is needed.')
+
+    if not name:
+        return wid
+
+    cache = client.workspace_cache
+    if cache is not None:
+        cached_wid = cache.get(client.configuration.host, owner or client.configuration.username, name)
+        if cached_wid is not None:
+            return cached_wid
+
+    w_details = details(client, name=name, owner=owner)
+    return None if w_details is None else w_details.id
+
+
 def commit(client, wid, wait=False, progress=None):
     """ Commit a workspace.
 
@@ -257,12 +397,13 @@ def scan(client, wid, wait=False, progress=None):
     return w_details
 
 
-def files(client, wid, per_page=100, limit=1000, **filters):
+def files(client, wid, per_page=None, limit=1000, raw=False, **filters):
     """ List files uploaded or whose metadata has changed on a workspace.
 
     This function calls the Quetzal API endpoint to list workspace files and
     manages the paginated response to retrieve as many results as set by the
-    `limit` parameter.
+    `limit` parameter. See :py:func:`iter_files` to iterate over the files
+    without keeping them in memory.
 
     Parameters
     ----------
@@ -271,9 +412,14 @@ def files(client, wid, per_page=100, limit=1000, **filters):
     wid: int
         Workspace identifier.
     per_page: int, optional
-        Number of items to request per page.
+        Number of items to request per page. When ``None``, it is adapted to
+        the duration and size of the responses.
     limit: int, optional
         Limit the number of workspaces to fetch.
+    raw: bool, optional
+        When ``True``, decode the responses directly as dictionaries, without
+        creating model objects. This is faster for many items, but values
+        such as dates are kept as strings.
     **filters
         Filters on the base metadata of the file. For example,
         `filename='foo.bin', size=1024`
@@ -294,27 +440,74 @@ def files(client, wid, per_page=100, limit=1000, **filters):
         When there was a problem connecting to the server.
 
     """
-    kwargs = dict(per_page=min(per_page, limit), page=1)
+    file_iterator = iter_files(client, wid, per_page=per_page, limit=limit, raw=raw, **filters)
+    file_list = list(file_iterator)
+    return file_list, file_iterator.total or 0
+
+
+def iter_files(client, wid, per_page=None, limit=None, prefetch=2, raw=False, **filters):
+    """ Iterate over the files uploaded or whose metadata has changed on a workspace.
+
+    This function calls the Quetzal API endpoint to list workspace files, one
+    page at a time. With the `prefetch` option, the following pages are
+    requested in advance while the files of the current page are consumed.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    wid: int
+        Workspace identifier.
+    per_page: int, optional
+        Number of items to request per page. When ``None``, it is adapted to
+        the duration and size of the responses.
+    limit: int, optional
+        Maximum number of files. When ``None``, iterate over all the files.
+    prefetch: int, optional
+        Maximum number of pages requested in advance.
+    raw: bool, optional
+        When ``True``, decode the responses directly as dictionaries, without
+        creating model objects. This is faster for many items, but values
+        such as dates are kept as strings.
+    **filters
+        Filters on the base metadata of the file. For example,
+        `filename='foo.bin', size=1024`
+
+    Returns
+    -------
+    quetzal.client.helpers._paging.PageIterator
+        Iterator over the file details as dictionaries. Its `total`
+        attribute has the total number of files once the iteration has
+        started.
+
+    """
+    kwargs = {}
     filter_strings = []
     for k, v in filters.items():
         filter_strings.append(f'{k}={v}')
     if filter_strings:
         kwargs['filters'] = ','.join(filter_strings)
-    page = client.workspace_file_fetch(wid, **kwargs)
-    file_list = [r.to_dict() for r in page.results]
-    while len(file_list) < limit and len(file_list) < page.total:
-        kwargs['page'] = kwargs.get('page', 1) + 1
-        fetch_result = client.workspace_file_fetch(wid, **kwargs)
-        file_list.extend([r.to_dict() for r in fetch_result.results])
 
-    return file_list, page.total
+    def fetch(page, per_page):
+        return fetch_page(client, client.workspace_file_fetch, 'PaginatedFiles', wid,
+                          raw=raw, page=page, per_page=per_page, **kwargs)
+
+    return PageIterator(fetch, per_page=page_size(client, per_page, 'workspace_file_fetch', limit),
+                        limit=limit, transform=None if raw else lambda r: r.to_dict(), prefetch=prefetch)
 
 
-def upload(client, wid, file, **kwargs):
+def upload(client, wid, file, deduplicate=False, **kwargs):
     """ Upload a file to a workspace.
 
     This function calls the Quetzal API endpoint to upload a file into a
-    workspace.
+    workspace. The file contents are streamed in chunks, starting from the
+    current position of the file, so the file is never loaded completely in
+    memory.
+
+    When the `deduplicate` option is set, the file is not uploaded if there
+    is already a file with the same contents, path and filename in the
+    workspace or in the committed files (see :py:func:`find_duplicate`). In
+    this case, the details of the existing file are returned.
 
     Parameters
     ----------
@@ -324,7 +517,13 @@ def upload(client, wid, file, **kwargs):
         Workspace identifier.
     file: file-like object
         A file object, like the returned objects of ``io.Open``. It must have a
-        name attribute (used to set the filename metadata) and a read method.
+        name attribute (used to set the filename metadata) and the read, seek
+        and tell methods.
+    deduplicate: bool, optional
+        When ``True``, skip the upload if the file contents already exist.
+    **kwargs
+        Extra parameters of the upload operation, such as `path` and
+        `temporary`.
 
     Returns
     -------
@@ -341,11 +540,176 @@ def upload(client, wid, file, **kwargs):
     """
     if not hasattr(file, 'read') or not hasattr(file, 'name'):
         raise ValueError('file must have a read method and name attribute.')
-    file_details = client.workspace_file_create(wid, content=file.name, **kwargs)
+    if deduplicate:
+        file_details = find_duplicate(client, wid, file, path=kwargs.get('path', ''),
+                                      filename=os.path.basename(file.name))
+        if file_details is not None:
+            return file_details
+    file_details = client.workspace_file_create(wid, content=file, **kwargs)
     return file_details
 
 
+def find_duplicate(client, wid, file, path=None, filename=None):
+    """ Find a file with the same contents as a local file.
+
+    This function calculates the md5sum and size of the `file` contents,
+    from its current position, and looks for a file with the same checksum
+    and size, first in the workspace and then in the committed files. All
+    the pages of the file lists are considered. Deleted files are ignored.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    wid: int
+        Workspace identifier.
+    file: file-like object
+        A file object. It needs the read, seek and tell methods.
+    path: str, optional
+        When set, only consider the files with this path.
+    filename: str, optional
+        When set, only consider the files with this filename.
+
+    Returns
+    -------
+    file_details: quetzal.openapi_client.models.BaseMetadata
+        Details of the existing file, or ``None`` when there is no file with
+        the same contents, path and filename.
+
+    Raises
+    ------
+    quetzal.client.exceptions.QuetzalAPIException
+        When the API returns an error.
+    urllib3.exceptions.RequestError
+        When there was a problem connecting to the server.
+
+    """
+    md5, size = get_readable_info(file, get_option(client.configuration, 'read_buffer_size'))
+    for lookup_wid in (wid, None):
+        for candidate in _iter_file_details(client, lookup_wid, checksum=md5, size=size):
+            if candidate.state == 'DELETED':
+                continue
+            if path is not None and (candidate.path or '') != path:
+                continue
+            if filename is not None and candidate.filename != filename:
+                continue
+            logger.debug('File %s has the same contents as existing file %s',
+                         getattr(file, 'name', file), candidate.id)
+            return candidate
+    return None
+
+
+def _iter_file_details(client, wid, **filters):
+    """Iterate over the file details of a workspace, or of the committed files when `wid` is ``None``"""
+    kwargs = {'filters': ','.join(f'{k}={v}' for k, v in filters.items())}
+    if wid is None:
+        func, args, endpoint = client.public_file_fetch, (), 'public_file_fetch'
+    else:
+        func, args, endpoint = client.workspace_file_fetch, (wid,), 'workspace_file_fetch'
+
+    def fetch(page, per_page):
+        return fetch_page(client, func, 'PaginatedFiles', *args, page=page, per_page=per_page, **kwargs)
+
+    return PageIterator(fetch, per_page=page_size(client, None, endpoint))
+
+
+def upload_many(client, wid, directory, workers=8, progress=None, deduplicate=False, **kwargs):
+    """ Upload all the files of a directory tree to a workspace.
+
+    This function walks the `directory` tree and uploads each of its files
+    with :py:func:`upload`, using a pool of `workers` threads that share the
+    same `client`. The path of each file relative to `directory` is used as
+    its `path` base metadata. With the `deduplicate` option, files whose
+    contents already exist are not uploaded (see :py:func:`find_duplicate`).
+
+    An error on a file does not stop the upload of the other files. Errors
+    are reported on the result of each file.
+
+    The `progress` parameter follows the same idea as in
+    :py:func:`wait_for_workspace`: it should be ``None`` or a dictionary with
+    the **func**, **clear**, **args** and **kwargs** keys. Here, **func** is
+    called after each file upload with the :py:class:`UploadResult`, the
+    number of files processed and the total number of files as positional
+    arguments, and **clear** is called at the end with the list of results.
+
+    Parameters
+    ----------
+    client: quetzal.client.Client
+        Client object that will be used for the Quetzal API operation.
+    wid: int
+        Workspace identifier.
+    directory: str or pathlib.Path
+        Directory to upload.
+    workers: int, optional
+        Number of concurrent uploads.
+    progress: dict, optional
+        A dictionary with the configuration for progress function callbacks.
+    deduplicate: bool, optional
+        When ``True``, skip the upload of files whose contents already exist.
+    **kwargs
+        Extra parameters of the upload operation, such as `temporary`.
+
+    Returns
+    -------
+    list of UploadResult
+        The result of each file, sorted by filename.
+
+    """
+    directory = pathlib.Path(directory)
+    filenames = sorted(
+        pathlib.Path(root, name).relative_to(directory)
+        for root, _, names in os.walk(str(directory))
+        for name in names if name != CHECKSUM_INDEX_FILENAME
+    )
+
+    if progress is not None:
+        progress_func = progress.get('func', None) or _noop
+        progress_clear = progress.get('clear', None) or _noop
+        progress_args = progress.get('args', ())
+        progress_kwargs = progress.get('kwargs', {})
+    else:
+        progress_func = _noop
+        progress_clear = _noop
+        progress_args = ()
+        progress_kwargs = {}
+
+    def upload_one(filename):
+        size = None
+        path = filename.parent.as_posix() if filename.parent.parts else ''
+        try:
+            with (directory / filename).open('rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                details = None
+                if deduplicate:
+                    details = find_duplicate(client, wid, f, path=path, filename=filename.name)
+                if details is not None:
+                    return UploadResult(str(filename), size, details, None, True)
+                details = upload(client, wid, f, path=path, **kwargs)
+            return UploadResult(str(filename), size, details, None, False)
+        except Exception as ex:
+            logger.debug('Failed to upload file %s', filename, exc_info=True)
+            return UploadResult(str(filename), size, None, ex, False)
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(upload_one, filename) for filename in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            progress_func(result, len(results), len(filenames), *progress_args, **progress_kwargs)
+
+    results.sort(key=lambda r: r.filename)
+    progress_clear(results, *progress_args, **progress_kwargs)
+    return results
+
+
 def update_metadata(client, wid, file_id, metadata):
+    """ Update the metadata of a file in a workspace
+
+    The entry of the file in the metadata cache of the client, if any, is
+    invalidated so that the next :py:func:`quetzal.client.helpers.file.metadata`
+    call receives the updated metadata.
+    """
     # from quetzal.openapi_client.models.metadata_by_family import MetadataByFamily
     # obj = MetadataByFamily(id=file_id, metadata=metadata)
     obj = {
@@ -353,6 +717,9 @@ def update_metadata(client, wid, file_id, metadata):
     }
     response = client.workspace_file_update_metadata(wid=wid, uuid=file_id,
                                                      metadata_by_family=obj)
+    cache = client.metadata_cache
+    if cache is not None:
+        cache.invalidate(file_helpers._metadata_cache_key(client, file_id, wid))
     return response
 
 
@@ -437,6 +804,9 @@ def wait_for_workspace(client, wid, retry_predicate, progress=None):
 def delete(client, wid, wait=False, progress=None):
 
     client.workspace_delete(wid)
+    cache = client.workspace_cache
+    if cache is not None:
+        cache.invalidate(client.configuration.host, wid)
     if wait:
         w_details = wait_for_workspace(client,
                                        wid,
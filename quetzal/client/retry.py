@@ -0,0 +1,215 @@
+""" Retry policies of the requests of the Quetzal API
+
+"""
+import logging
+import random
+import threading
+import time
+
+from requests import codes
+
+from quetzal.client.exceptions import RetryableException
+
+
+logger = logging.getLogger(__name__)
+
+# Operations, as (method, resource path) pairs, whose requests can be sent
+# again even if the server received them: logins and the creation of queries
+# have no side effects that a second request would repeat
+DEFAULT_IDEMPOTENT_OPERATIONS = frozenset([
+    ('POST', '/auth/token'),
+    ('POST', '/data/queries/'),
+    ('POST', '/data/workspaces/{wid}/queries/'),
+])
+
+# HTTP methods whose requests can be sent again (RFC 7231, section 4.2.2)
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class RetryBudget:
+    """A limit on the retries of all the requests that share it
+
+    This is a token bucket: each request adds `ratio` tokens to the bucket,
+    up to `capacity` tokens, and each retry takes one token. Moreover,
+    `min_per_second` tokens are added each second, so that occasional errors
+    are always retried. When the bucket is empty, failed requests are not
+    retried. During a server outage, the clients that share a budget send
+    about `ratio` times more requests than without retries, instead of
+    multiplying them by the maximum number of tries.
+
+    Parameters
+    ----------
+    ratio: float, optional
+        Tokens added by each request.
+    capacity: float, optional
+        Maximum number of tokens, which is also the initial number of
+        tokens.
+    min_per_second: float, optional
+        Tokens added each second.
+
+    """
+
+    def __init__(self, ratio=0.2, capacity=100, min_per_second=1.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.min_per_second = min_per_second
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """Number of tokens in the bucket"""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def deposit(self):
+        """Add the tokens of a request"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens + self.ratio, self.capacity)
+
+    def withdraw(self):
+        """Take the token of a retry, and return whether there was one"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.min_per_second, self.capacity)
+        self._updated = now
+
+
+# Retry budget shared by the clients of the process that do not set their own
+DEFAULT_RETRY_BUDGET = RetryBudget()
+
+
+class RetryPolicy:
+    """The rules to retry the requests that failed with a retryable error
+
+    The delay before each retry is drawn with *full jitter*: a uniform
+    random number between zero and an exponential bound, so that the
+    clients that failed at the same time do not retry in lockstep. A
+    ``Retry-After`` header of a *429* or *503* response sets the minimum
+    delay. Retries are limited by a number of tries, a total time and a
+    :py:class:`RetryBudget`, shared by default by all the clients of the
+    process. Unauthorized (*401*) errors, which are retried after a login,
+    do not take tokens from the budget.
+
+    Requests of operations that are not idempotent, such as uploads, are not
+    sent again when the server may have processed them: they are only
+    retried after the errors in `non_idempotent_statuses`, which the server
+    sends before processing a request.
+
+    Parameters
+    ----------
+    max_tries: int, optional
+        Maximum number of tries of a request, including the first one.
+    max_time: float, optional
+        Maximum time, in seconds, since the first try of a request: a
+        request is not retried when the delay before the retry would end
+        after this time.
+    base: float, optional
+        Bound, in seconds, of the delay before the first retry. The bound is
+        multiplied by `factor` after each retry, up to `max_delay`.
+    factor: float, optional
+        Growth factor of the bound of the delay.
+    max_delay: float, optional
+        Maximum bound of the delay, in seconds.
+    jitter: bool, optional
+        When ``False``, the delay is its bound instead of a random number.
+    retry_after: bool, optional
+        When ``True``, the delay is at least the ``Retry-After`` time of the
+        response, up to `max_retry_after` seconds.
+    max_retry_after: float, optional
+        Maximum delay, in seconds, set by a ``Retry-After`` header.
+    budget: RetryBudget, optional
+        Budget of retries. By default, the budget shared by the process.
+        When ``None``, the retries are not limited by a budget.
+    non_idempotent_statuses: iterable of int, optional
+        Status codes of the errors after which the requests of operations
+        that are not idempotent are retried.
+    idempotent_operations: iterable of tuple, optional
+        Operations, as ``(method, resource_path)`` pairs, that can be
+        retried like idempotent methods even though their method is not
+        idempotent.
+
+    """
+
+    def __init__(self, max_tries=10, max_time=30, base=1, factor=2, max_delay=5,
+                 jitter=True, retry_after=True, max_retry_after=60,
+                 budget=DEFAULT_RETRY_BUDGET,
+                 non_idempotent_statuses=(codes.unauthorized, codes.too_many_requests),
+                 idempotent_operations=DEFAULT_IDEMPOTENT_OPERATIONS):
+        self.max_tries = max_tries
+        self.max_time = max_time
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self.non_idempotent_statuses = frozenset(non_idempotent_statuses)
+        self.idempotent_operations = frozenset(idempotent_operations)
+
+    def is_idempotent(self, method, resource_path):
+        """Whether the requests of an operation can be sent again"""
+        method = (method or '').upper()
+        return method in IDEMPOTENT_METHODS or (method, resource_path) in self.idempotent_operations
+
+    def on_request(self):
+        """Take note of a new request for the retry budget"""
+        if self.budget is not None:
+            self.budget.deposit()
+
+    def delay(self, error, tries):
+        """Seconds to wait before retrying a request that failed `tries` times with `error`"""
+        bound = min(self.base * self.factor ** (tries - 1), self.max_delay)
+        wait = random.uniform(0, bound) if self.jitter else bound
+        retry_after = getattr(error, 'retry_after', None)
+        if self.retry_after and retry_after is not None:
+            wait = max(wait, min(retry_after, self.max_retry_after))
+        return wait
+
+    def should_retry(self, error, method, resource_path, tries, elapsed, wait):
+        """Whether to retry a request after `error`
+
+        Parameters
+        ----------
+        error: Exception
+            Error of the last try.
+        method: str
+            HTTP method of the request.
+        resource_path: str
+            Resource path of the request, such as
+            ``/data/workspaces/{wid}/files/``.
+        tries: int
+            Number of tries of the request so far.
+        elapsed: float
+            Seconds since the first try.
+        wait: float
+            Seconds that would be waited before the retry.
+
+        """
+        if not isinstance(error, RetryableException):
+            return False
+        if tries >= self.max_tries or elapsed + wait > self.max_time:
+            logger.debug('Giving up %s %s after %d tries and %.1f seconds', method, resource_path, tries, elapsed)
+            return False
+        if not self.is_idempotent(method, resource_path) and error.status not in self.non_idempotent_statuses:
+            logger.debug('Will not retry %s %s after a %s error, the operation is not idempotent',
+                         method, resource_path, error.status)
+            return False
+        if error.status == codes.unauthorized:
+            logger.debug('Retrying due to unauthorized error')
+            return True
+        if self.budget is not None and not self.budget.withdraw():
+            logger.debug('Will not retry %s %s, the retry budget is exhausted', method, resource_path)
+            return False
+        return True
@@ -0,0 +1,203 @@
+""" Persistence of the access tokens of the Quetzal API
+
+"""
+import base64
+import collections
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+from quetzal.client.utils import get_config_dir
+
+
+logger = logging.getLogger(__name__)
+
+SavedToken = collections.namedtuple('SavedToken', ['token', 'expires'])
+SavedToken.__doc__ = """An access token of a :py:class:`TokenStore`
+
+Attributes
+----------
+token: str
+    Access token.
+expires: float
+    Time, as a Unix timestamp, when the token expires.
+"""
+
+
+def token_expiration(token):
+    """Get the expiration time of a JSON Web Token, without verifying it
+
+    Returns the ``exp`` claim of the token, as a Unix timestamp, or ``None``
+    when the token is not a JSON Web Token or has no expiration time.
+    """
+    parts = token.split('.') if isinstance(token, str) else []
+    if len(parts) != 3:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(parts[1] + '=' * (-len(parts[1]) % 4))
+        exp = json.loads(payload).get('exp')
+    except (ValueError, AttributeError):
+        return None
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+class TokenStore:
+    """A file that keeps the access tokens of each server and user
+
+    Tokens are saved in a JSON file, readable only by the current user,
+    with their expiration time. The expiration time is the ``exp`` claim of
+    the token when it is a JSON Web Token, or `lifetime` seconds after it
+    was saved otherwise. The file is read on each access and replaced
+    atomically, so that concurrent processes, such as the commands of a
+    script, share the same token.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path, optional
+        Path of the JSON file. By default, a file in the directory of
+        :py:func:`quetzal.client.utils.get_config_dir`.
+    lifetime: float, optional
+        Lifetime, in seconds, of tokens without expiration time.
+
+    """
+
+    def __init__(self, path=None, lifetime=3600):
+        if path is None:
+            path = pathlib.Path(get_config_dir()) / 'tokens.json'
+        self.path = pathlib.Path(path)
+        self.lifetime = lifetime
+        self._lock = threading.Lock()
+
+    def get(self, host, username, margin=0):
+        """Get a saved token, or ``None`` when there is none that is valid for `margin` seconds"""
+        entry = self._read().get(self._key(host, username))
+        if entry is None:
+            return None
+        saved = SavedToken(entry['token'], entry['expires'])
+        if saved.expires - margin <= time.time():
+            logger.debug('Saved access token of %s expires in less than %s seconds', username, margin)
+            return None
+        return saved
+
+    def put(self, host, username, token):
+        """Save a token, and return it with its expiration time"""
+        expires = token_expiration(token) or time.time() + self.lifetime
+        with self._lock:
+            entries = self._read()
+            # Remove expired tokens of any server
+            entries = {k: v for k, v in entries.items() if v['expires'] > time.time()}
+            entries[self._key(host, username)] = {'token': token, 'expires': expires}
+            self._write(entries)
+        return SavedToken(token, expires)
+
+    def remove(self, host, username):
+        """Remove the token of a user"""
+        with self._lock:
+            entries = self._read()
+            if entries.pop(self._key(host, username), None) is not None:
+                self._write(entries)
+
+    @staticmethod
+    def _key(host, username):
+        return f'{host}|{username}'
+
+    def _read(self):
+        try:
+            with self.path.open('r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        try:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # mkstemp creates the file readable and writable only by its owner
+            fd, tmp_name = tempfile.mkstemp(dir=str(self.path.parent), prefix=f'{self.path.name}.')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_name, str(self.path))
+        except OSError:
+            logger.debug('Could not save access tokens', exc_info=True)
+
+
+class TokenManager:
+    """The access token of a client, shared by all the threads that use it
+
+    The token and its expiration time are kept together as a
+    :py:class:`SavedToken` that is replaced as a whole, so reading them
+    never blocks and never sees a token with the expiration time of another
+    one. Refreshes are single-flight: when many threads find that the token
+    they used has expired, only the first one obtains a new token and the
+    others use it.
+
+    The manager also keeps the timer of the next background refresh of the
+    token, and whether the token was used since it was set, so that the
+    tokens of idle clients are not renewed.
+    """
+
+    def __init__(self):
+        self._current = None
+        self._used = False
+        self._timer = None
+        self._lock = threading.Lock()
+        self._timer_lock = threading.Lock()
+
+    @property
+    def current(self):
+        """The current :py:class:`SavedToken`, or ``None`` when there is none"""
+        return self._current
+
+    @property
+    def used(self):
+        """Whether the current token was sent by a request since it was set"""
+        return self._used
+
+    def set(self, saved):
+        """Replace the current token by a :py:class:`SavedToken`, or ``None`` to forget it"""
+        self._current = saved
+        self._used = False
+
+    def touch(self):
+        """Mark the current token as used"""
+        self._used = True
+
+    def set_timer(self, timer):
+        """Replace the timer of the next background refresh, cancelling the previous one
+
+        The `timer` is any object with a ``cancel`` method, such as a
+        :py:class:`threading.Timer` or an :py:class:`asyncio.TimerHandle`,
+        or ``None`` to only cancel the previous timer.
+        """
+        with self._timer_lock:
+            timer, self._timer = self._timer, timer
+        if timer is not None:
+            timer.cancel()
+
+    def refresh(self, stale, obtain):
+        """Obtain a new token, unless another thread already replaced the `stale` one
+
+        Parameters
+        ----------
+        stale: str
+            The token found outdated, or ``None`` when there was no token.
+        obtain: callable
+            Function called without arguments, with the refresh lock held,
+            that obtains a new token and sets it with :py:meth:`set`.
+
+        Returns
+        -------
+        SavedToken
+            The current token, or ``None`` when no token could be obtained.
+
+        """
+        with self._lock:
+            current = self._current
+            if current is not None and current.token != stale:
+                logger.debug('Access token was refreshed by another thread')
+                return current
+            obtain()
+            return self._current
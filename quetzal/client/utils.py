@@ -1,8 +1,12 @@
 import atexit
 import code
 import hashlib
+import json
 import logging
+import os
 import pathlib
+import tempfile
+import threading
 
 
 import appdirs
@@ -10,6 +14,15 @@ import appdirs
 
 logger = logging.getLogger(__name__)
 
+# Name of the sidecar file that keeps the checksum of the files of a directory
+CHECKSUM_INDEX_FILENAME = '.quetzal-checksums.json'
+# Minimum number of outdated lines of a checksum index before it is compacted
+_CHECKSUM_INDEX_COMPACT_MIN = 1000
+_checksum_index_lock = threading.Lock()
+# Entries of the checksum indexes read by this process, by index path, so
+# that only the lines appended since the last read are parsed
+_checksum_index_states = {}
+
 
 # readline is special: it works on unix flavors but not on windows; we have
 # to use pyreadline, which only works on windows.
@@ -85,7 +98,7 @@ def get_config_dir():
     )
 
 
-def get_readable_info(file_obj):
+def get_readable_info(file_obj, buffer_size=(64 << 10)):
     """ Extract useful information from reading a file
 
     This function calculates the md5sum and the file size in bytes from a
@@ -99,6 +112,8 @@ def get_readable_info(file_obj):
     ----------
     file_obj: file-like
         File object. It needs the `read` and `tell` methods.
+    buffer_size: int, optional
+        Number of bytes read at each iteration.
 
     Returns
     -------
@@ -110,10 +125,166 @@ def get_readable_info(file_obj):
     position = file_obj.tell()
     hashobj = hashlib.new('md5')
     while True:
-        chunk = file_obj.read(4096)
+        chunk = file_obj.read(buffer_size)
         size += len(chunk)
         if not chunk:
             break
         hashobj.update(chunk)
     file_obj.seek(position)
     return hashobj.hexdigest(), size
+
+
+def get_cached_readable_info(path, buffer_size=(64 << 10)):
+    """ Extract the md5sum and size of a file, avoiding to read it if possible
+
+    This function is similar to :py:func:`get_readable_info`, but it
+    first consults a sidecar index file saved on the same directory as the
+    `path` (see :py:func:`update_checksum_index`). When the index has an
+    entry for this file and its size and modification time have not changed,
+    the saved md5sum is returned without reading the file. Otherwise, the
+    file is read and the index is updated.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path
+        Path of the file.
+    buffer_size: int, optional
+        Number of bytes read at each iteration, when the file is read.
+
+    Returns
+    -------
+    md5sum, size: str, int
+        MD5 sum and size of the file contents
+
+    """
+    path = pathlib.Path(path)
+    stat = path.stat()
+    with _checksum_index_lock:
+        entry = _load_checksum_index(path.parent / CHECKSUM_INDEX_FILENAME).entries.get(path.name)
+    if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        logger.debug('Using checksum index entry for %s', path)
+        return entry['md5'], entry['size']
+
+    with path.open('rb') as f:
+        md5, size = get_readable_info(f, buffer_size)
+    update_checksum_index(path, md5, size)
+    return md5, size
+
+
+def update_checksum_index(path, md5, size):
+    """ Save the md5sum and size of a file on its directory checksum index
+
+    The checksum index is a small file named :py:data:`CHECKSUM_INDEX_FILENAME`
+    that maps filenames to their md5sum, size and modification time. Each
+    update appends a line with one JSON entry, so that saving the checksums
+    of many files of a directory does not rewrite the index each time; the
+    last entry of a filename is the valid one. The index is rewritten
+    atomically without its outdated lines once they outnumber the valid
+    ones.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path
+        Path of the file.
+    md5: str
+        MD5 sum of the file contents.
+    size: int
+        Size of the file contents.
+
+    """
+    path = pathlib.Path(path)
+    index_path = path.parent / CHECKSUM_INDEX_FILENAME
+    entry = {
+        'md5': md5,
+        'size': size,
+        'mtime_ns': path.stat().st_mtime_ns,
+    }
+    with _checksum_index_lock:
+        state = _load_checksum_index(index_path)
+        state.entries[path.name] = entry
+        try:
+            if state.lines - len(state.entries) >= max(len(state.entries), _CHECKSUM_INDEX_COMPACT_MIN):
+                _write_checksum_index(index_path, state)
+            else:
+                _append_checksum_index(index_path, state, dict(entry, name=path.name))
+        except OSError:
+            logger.debug('Could not save checksum index', exc_info=True)
+
+
+class _ChecksumIndexState:
+    """Entries of a checksum index file, read up to an offset"""
+
+    def __init__(self, inode=None):
+        self.inode = inode
+        self.offset = 0
+        self.lines = 0
+        self.entries = {}
+
+
+def _load_checksum_index(index_path):
+    """Read the lines added to a checksum index since its last read
+
+    Must be called with the checksum index lock held.
+    """
+    key = os.path.abspath(str(index_path))
+    try:
+        stat = os.stat(key)
+    except OSError:
+        _checksum_index_states.pop(key, None)
+        return _ChecksumIndexState()
+
+    state = _checksum_index_states.get(key)
+    if state is None or state.inode != stat.st_ino or stat.st_size < state.offset:
+        # The index was replaced, or never read
+        state = _checksum_index_states[key] = _ChecksumIndexState(stat.st_ino)
+    if stat.st_size == state.offset:
+        return state
+
+    try:
+        with open(key, 'rb') as f:
+            f.seek(state.offset)
+            data = f.read()
+    except OSError:
+        return state
+
+    # Only complete lines are read: a line may be being appended
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].splitlines():
+        try:
+            entry = json.loads(line)
+            state.entries[entry.pop('name')] = entry
+        except (ValueError, KeyError, AttributeError, TypeError):
+            continue
+        state.lines += 1
+    state.offset += end
+    return state
+
+
+def _append_checksum_index(index_path, state, entry):
+    line = (json.dumps(entry) + '\n').encode('utf-8')
+    fd = os.open(str(index_path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        stat = os.fstat(fd)
+    finally:
+        os.close(fd)
+    if state.inode in (None, stat.st_ino) and stat.st_size == state.offset + len(line):
+        # Nobody else wrote in the index since it was read
+        state.inode = stat.st_ino
+        state.offset = stat.st_size
+        state.lines += 1
+        _checksum_index_states[os.path.abspath(str(index_path))] = state
+
+
+def _write_checksum_index(index_path, state):
+    data = ''.join(json.dumps(dict(entry, name=name)) + '\n' for name, entry in state.entries.items())
+    fd, tmp_name = tempfile.mkstemp(dir=str(index_path.parent), prefix=f'{CHECKSUM_INDEX_FILENAME}.')
+    with os.fdopen(fd, 'w') as f:
+        f.write(data)
+    os.replace(tmp_name, str(index_path))
+    stat = os.stat(str(index_path))
+    new_state = _ChecksumIndexState(stat.st_ino)
+    new_state.entries = state.entries
+    new_state.offset = stat.st_size
+    new_state.lines = len(state.entries)
+    _checksum_index_states[os.path.abspath(str(index_path))] = new_state
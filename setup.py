@@ -21,7 +21,10 @@ dependencies = [
 ]
 
 setup_requires = dependencies[:]
-# extra_dependencies = []
+extra_dependencies = {
+    'aio': ['aiohttp'],
+    'columnar': ['numpy', 'pandas', 'pyarrow'],
+}
 
 setup_args = dict(
     name='quetzal-client',
@@ -42,6 +45,7 @@ setup_args = dict(
     namespace_packages=['quetzal'],
     python_requires='>=3.6',
     install_requires=dependencies,
+    extras_require=extra_dependencies,
     tests_require=['pytest', ],
     zip_safe=False,
     include_package_data=True,
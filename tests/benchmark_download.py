@@ -0,0 +1,53 @@
+""" Benchmark of file downloads with one or several streams
+
+This script starts a local fake Quetzal server whose responses are throttled
+to a fixed rate per connection, and measures the time needed to download a
+file using a varying number of concurrent streams.
+
+Usage::
+
+    python tests/benchmark_download.py --size 64 --rate 16 --streams 1 2 4 8
+
+"""
+import argparse
+import os
+import tempfile
+import time
+from unittest import mock
+
+from fake_server import FakeQuetzalServer
+from quetzal.client import helpers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', type=int, default=64, help='File size, in Mb.')
+    parser.add_argument('--rate', type=float, default=16, help='Rate per connection, in Mb/s.')
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Number of streams to evaluate.')
+    args = parser.parse_args()
+
+    server = FakeQuetzalServer().start()
+    server.throttle = args.rate * (1 << 20)
+    data = os.urandom(args.size << 20)
+    file_id = server.add_file(data)
+    client = helpers.get_client(server.url, api_key='benchmark')
+
+    print(f'Downloading {args.size} Mb at {args.rate} Mb/s per connection')
+    try:
+        # Allow splitting small files for the purpose of this benchmark
+        with mock.patch('quetzal.client.helpers.file.MIN_RANGE_SIZE', 1 << 20):
+            for streams in args.streams:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    output = os.path.join(tmp_dir, 'output.bin')
+                    start = time.perf_counter()
+                    helpers.file.download(client, file_id, output=output, streams=streams)
+                    elapsed = time.perf_counter() - start
+                print(f'{streams:3d} stream(s): {elapsed:6.2f} s, '
+                      f'{args.size / elapsed:8.2f} Mb/s')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+""" Benchmark of the decoding of paginated responses
+
+This script measures the cost per row of decoding a page of file details,
+either through the models generated by the OpenAPI generator followed by
+their conversion to dictionaries, or directly as plain objects with the raw
+option of the paginated helpers. It then lists all the files of a workspace
+of a local fake Quetzal server with and without the raw option.
+
+Usage::
+
+    python tests/benchmark_paging.py --rows 100000 --per-page 1000
+
+"""
+import argparse
+import hashlib
+import json
+import time
+
+from fake_server import FakeQuetzalServer
+from quetzal.client import helpers
+from quetzal.client.helpers._paging import _Body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=100000, help='Number of files.')
+    parser.add_argument('--per-page', type=int, default=1000, help='Number of files per page.')
+    args = parser.parse_args()
+
+    server = FakeQuetzalServer().start()
+    for i in range(args.rows):
+        server.add_file(hashlib.md5(str(i).encode()).digest(), filename=f'file_{i}.bin', wid=1)
+    client = helpers.get_client(server.url, api_key='benchmark')
+
+    page = json.dumps({
+        'page': 1,
+        'pages': 1,
+        'total': args.per_page,
+        'results': [f['base'] for f in list(server.files.values())[:args.per_page]],
+    }).encode('utf-8')
+
+    def decode_models():
+        response = client.deserialize(_Body(page), 'PaginatedFiles')
+        return [r.to_dict() for r in response.results]
+
+    def decode_raw():
+        return json.loads(page)['results']
+
+    print(f'Decoding a page of {args.per_page} files')
+    for name, func in [('models', decode_models), ('raw', decode_raw)]:
+        repeat = 20
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - start
+        print(f'{name:>8}: {elapsed / repeat / args.per_page * 1e6:8.2f} µs per row')
+
+    print(f'Listing {args.rows} files, {args.per_page} per page')
+    try:
+        for raw in (False, True):
+            start = time.perf_counter()
+            files = helpers.workspace.iter_files(client, 1, per_page=args.per_page, raw=raw)
+            count = sum(1 for _ in files)
+            elapsed = time.perf_counter() - start
+            print(f'{"raw" if raw else "models":>8}: {count} files in {elapsed:6.2f} s, '
+                  f'{elapsed / count * 1e6:8.2f} µs per row')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
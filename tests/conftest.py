@@ -0,0 +1,10 @@
+import pytest
+
+from fake_server import FakeQuetzalServer
+
+
+@pytest.fixture(scope='function')
+def fake_server():
+    server = FakeQuetzalServer().start()
+    yield server
+    server.stop()
@@ -0,0 +1,374 @@
+""" A minimal stand-in of the Quetzal API for tests
+
+This module implements a tiny HTTP server that answers to the subset of the
+Quetzal API needed to test transfers and paginated results: file metadata
+with entity tags, file contents with support for ``Range`` requests, file
+uploads and deletions, file and workspace lists, and metadata queries. It can be configured to
+misbehave, for example by dropping connections in the middle of a transfer or
+by throttling the transfer rate.
+
+"""
+import base64
+import email.parser
+import email.policy
+import hashlib
+import http.server
+import io
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+
+class FakeQuetzalServer:
+
+    def __init__(self):
+        self.files = {}
+        self.workspaces = {}
+        # Rows returned by any metadata query
+        self.query_rows = []
+        self.queries = {}
+        self._last_wid = 0
+        self.requests = []
+        # Number of access tokens issued, and their lifetime in seconds
+        self.tokens_issued = 0
+        self.token_lifetime = 3600
+        # Access tokens rejected with a 401 error
+        self.revoked_tokens = set()
+        # Number of content responses that will be interrupted, and after
+        # how many bytes
+        self.drop_count = 0
+        self.drop_after = 0
+        # Maximum transfer rate, in bytes per second, of each response
+        self.throttle = None
+        # Whether Range headers are honored, or ignored as some servers do
+        self.accept_ranges = True
+        # Error status codes sent, in order, to the next requests, with a
+        # Retry-After header when retry_after is set
+        self.errors = []
+        self.retry_after = None
+        # Delay, in seconds, before sending each page of a paginated response,
+        # and maximum number of these responses prepared at the same time
+        self.page_latency = 0
+        # Maximum page size: larger pages are either reduced to this size, or
+        # rejected with a 413 error when reject_large_pages is set
+        self.max_per_page = None
+        self.reject_large_pages = False
+        self.max_concurrent_pages = 0
+        self._concurrent_pages = 0
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}/api/v1'
+
+    def add_file(self, data, filename='foo.bin', path='', wid=None):
+        file_id = str(uuid.uuid4())
+        self.files[file_id] = {
+            'data': data,
+            'wid': wid,
+            'base': {
+                'id': file_id,
+                'checksum': hashlib.md5(data).hexdigest(),
+                'filename': filename,
+                'path': path,
+                'size': len(data),
+                'state': 'READY',
+                'date': '2020-01-01T00:00:00+00:00',
+                'url': f'file://data/{file_id}',
+            },
+            # Metadata families other than base
+            'families': {},
+        }
+        return file_id
+
+    def add_workspace(self, name, owner='user', status='READY'):
+        self._last_wid += 1
+        wid = self._last_wid
+        self.workspaces[wid] = {
+            'id': wid,
+            'name': name,
+            'owner': owner,
+            'status': status,
+            'description': '',
+            'families': {'base': None},
+            'temporary': False,
+            'creation_date': '2020-01-01T00:00:00+00:00',
+            'data_url': f'gs://bucket/{wid}',
+        }
+        return wid
+
+    def _new_token(self):
+        """Issue an access token, as a JSON Web Token with an expiration time"""
+        with self._lock:
+            self.tokens_issued += 1
+            payload = {'sub': 'user', 'n': self.tokens_issued, 'exp': int(time.time() + self.token_lifetime)}
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).rstrip(b'=').decode('ascii')
+        return f'eyJhbGciOiJub25lIn0.{encoded}.'
+
+    def start(self):
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def content_requests(self):
+        return [r for r in self.requests if r['accept'] == 'application/octet-stream']
+
+    def _next_error(self):
+        with self._lock:
+            if self.errors:
+                return self.errors.pop(0)
+        return None
+
+    def _next_drop(self):
+        with self._lock:
+            if self.drop_count > 0:
+                self.drop_count -= 1
+                return self.drop_after
+        return None
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    _file_re = re.compile(r'^/api/v1/data/(?:workspaces/\d+/)?files/([^/?]+)')
+    _file_list_re = re.compile(r'^/api/v1/data/(?:workspaces/(\d+)/)?files/(?:\?(.*))?$')
+    _upload_re = re.compile(r'^/api/v1/data/workspaces/(\d+)/files/(?:\?(.*))?$')
+    _workspace_list_re = re.compile(r'^/api/v1/data/workspaces/(?:\?(.*))?$')
+    _workspace_re = re.compile(r'^/api/v1/data/workspaces/(\d+)/?$')
+    _query_re = re.compile(r'^/api/v1/data/(?:workspaces/(\d+)/)?queries/(\d+)?(?:\?(.*))?$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self._read_body()
+        self.fake.requests.append({
+            'method': 'POST',
+            'path': self.path,
+            'accept': self.headers.get('Accept', ''),
+            'range': None,
+            'chunked': self.headers.get('Transfer-Encoding') == 'chunked',
+            'body_size': len(body),
+            'authorization': self.headers.get('Authorization'),
+        })
+        error = self.fake._next_error()
+        if error is not None:
+            return self._send_error(error)
+        if self.path == '/api/v1/auth/token':
+            return self._send_json(200, {'token': self.fake._new_token()})
+        if self.path == '/api/v1/auth/logout':
+            return self._send_json(200, {})
+        match = self._query_re.match(self.path)
+        if match:
+            with self.fake._lock:
+                qid = len(self.fake.queries) + 1
+                self.fake.queries[qid] = dict(json.loads(body), id=qid,
+                                              workspace_id=int(match.group(1)) if match.group(1) else None)
+            return self._send_query(qid, dict(urllib.parse.parse_qsl(match.group(3) or '')))
+        match = self._upload_re.match(self.path)
+        if not match:
+            return self._send_json(404, {'status': 404, 'title': 'Not found'})
+
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode('latin-1') + body
+        )
+        content = next(part for part in message.iter_parts()
+                       if part.get_param('name', header='content-disposition') == 'content')
+        query = dict(urllib.parse.parse_qsl(match.group(2) or ''))
+        file_id = self.fake.add_file(content.get_payload(decode=True), filename=content.get_filename(),
+                                     path=query.get('path', ''), wid=int(match.group(1)))
+        self._send_json(201, self.fake.files[file_id]['base'])
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = io.BytesIO()
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return body.getvalue()
+            body.write(self.rfile.read(size))
+            self.rfile.readline()
+
+    def do_DELETE(self):
+        self.fake.requests.append({'method': 'DELETE', 'path': self.path})
+        match = self._file_re.match(self.path)
+        if not match or self.fake.files.pop(match.group(1), None) is None:
+            return self._send_json(404, {'status': 404, 'title': 'Not found'})
+        self._send_json(202, {'id': match.group(1)})
+
+    def do_PATCH(self):
+        body = self._read_body()
+        self.fake.requests.append({'method': 'PATCH', 'path': self.path})
+        match = self._file_re.match(self.path)
+        if not match or match.group(1) not in self.fake.files:
+            return self._send_json(404, {'status': 404, 'title': 'Not found'})
+        file = self.fake.files[match.group(1)]
+        for family, values in json.loads(body)['metadata'].items():
+            file['families'].setdefault(family, {}).update(values)
+        self._send_json(200, self._metadata(file))
+
+    def do_GET(self):
+        accept = self.headers.get('Accept', '')
+        self.fake.requests.append({
+            'method': 'GET',
+            'path': self.path,
+            'accept': accept,
+            'range': self.headers.get('Range'),
+            'if_none_match': self.headers.get('If-None-Match'),
+            'authorization': self.headers.get('Authorization'),
+        })
+        error = self.fake._next_error()
+        if error is not None:
+            return self._send_error(error)
+        authorization = self.headers.get('Authorization') or ''
+        if authorization.startswith('Bearer ') and authorization[7:] in self.fake.revoked_tokens:
+            return self._send_json(401, {'status': 401, 'title': 'Unauthorized'})
+        match = self._query_re.match(self.path)
+        if match and match.group(2):
+            return self._send_query(int(match.group(2)), dict(urllib.parse.parse_qsl(match.group(3) or '')))
+        match = self._workspace_list_re.match(self.path)
+        if match:
+            query = dict(urllib.parse.parse_qsl(match.group(1) or ''))
+            results = [w for w in self.fake.workspaces.values()
+                       if all(str(w.get(k)) == query[k] for k in ('name', 'owner') if k in query) and
+                       (w['status'] != 'DELETED' or query.get('deleted') == 'true')]
+            return self._send_page(results, query)
+        match = self._workspace_re.match(self.path)
+        if match:
+            if int(match.group(1)) not in self.fake.workspaces:
+                return self._send_json(404, {'status': 404, 'title': 'Not found'})
+            return self._send_json(200, self.fake.workspaces[int(match.group(1))])
+        match = self._file_list_re.match(self.path)
+        if match:
+            return self._send_file_list(int(match.group(1)) if match.group(1) else None,
+                                        dict(urllib.parse.parse_qsl(match.group(2) or '')))
+        match = self._file_re.match(self.path)
+        if not match or match.group(1) not in self.fake.files:
+            return self._send_json(404, {'status': 404, 'title': 'Not found'})
+
+        file = self.fake.files[match.group(1)]
+        if accept != 'application/octet-stream':
+            return self._send_metadata(file)
+        self._send_contents(file['data'])
+
+    def _metadata(self, file):
+        return {'id': file['base']['id'], 'metadata': dict(file['families'], base=file['base'])}
+
+    def _send_metadata(self, file):
+        body = self._metadata(file)
+        etag = '"' + hashlib.md5(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send_json(200, body, headers={'ETag': etag})
+
+    def _send_file_list(self, wid, query):
+        filters = dict(f.split('=', 1) for f in query.get('filters', '').split(',') if f)
+        results = [
+            file['base'] for file in self.fake.files.values()
+            if file['wid'] == wid and all(str(file['base'].get(k)) == v for k, v in filters.items())
+        ]
+        self._send_page(results, query)
+
+    def _send_query(self, qid, query):
+        if qid not in self.fake.queries:
+            return self._send_json(404, {'status': 404, 'title': 'Not found'})
+        self._send_page(self.fake.query_rows, query, self.fake.queries[qid])
+
+    def _send_page(self, results, query, extra=None):
+        with self.fake._lock:
+            self.fake._concurrent_pages += 1
+            self.fake.max_concurrent_pages = max(self.fake.max_concurrent_pages, self.fake._concurrent_pages)
+        time.sleep(self.fake.page_latency)
+        with self.fake._lock:
+            self.fake._concurrent_pages -= 1
+
+        page, per_page = int(query.get('page', 1)), int(query.get('per_page', 100))
+        if self.fake.max_per_page and per_page > self.fake.max_per_page:
+            if self.fake.reject_large_pages:
+                return self._send_json(413, {'status': 413, 'title': 'Page too large'})
+            per_page = self.fake.max_per_page
+        self._send_json(200, dict(extra or {}, **{
+            'page': page,
+            'pages': -(-len(results) // per_page),
+            'total': len(results),
+            'results': results[(page - 1) * per_page:page * per_page],
+        }))
+
+    def _send_error(self, status):
+        headers = {}
+        if self.fake.retry_after is not None:
+            headers['Retry-After'] = str(self.fake.retry_after)
+        self._send_json(status, {'status': status, 'title': 'Error'}, headers=headers)
+
+    def _send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_contents(self, data):
+        start, end = 0, len(data) - 1
+        byte_range = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if byte_range and self.fake.accept_ranges:
+            start = int(byte_range.group(1))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range.group(2):
+                end = min(int(byte_range.group(2)), end)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        payload = memoryview(data)[start:end + 1]
+        drop_after = self.fake._next_drop()
+        if drop_after is not None:
+            payload = payload[:drop_after]
+
+        chunk_size = 64 << 10
+        for offset in range(0, len(payload), chunk_size):
+            chunk = payload[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            if self.fake.throttle:
+                time.sleep(len(chunk) / self.fake.throttle)
+
+        if drop_after is not None:
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.close()
@@ -0,0 +1,241 @@
+import asyncio
+import io
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from quetzal.client import Configuration, aio  # noqa: E402
+from quetzal.client.exceptions import QuetzalAPIException  # noqa: E402
+
+
+def _client(fake_server, **kwargs):
+    config = Configuration()
+    config.host = fake_server.url
+    config.api_key = {'X-API-KEY': 'fake-key'}
+    for key, value in kwargs.items():
+        setattr(config, key, value)
+    return aio.AsyncClient(config)
+
+
+def _run(coroutine_func, fake_server, **kwargs):
+    async def main():
+        async with _client(fake_server, **kwargs) as client:
+            return await coroutine_func(client)
+    return asyncio.run(main())
+
+
+def test_shortcut_methods(fake_server):
+    wid = fake_server.add_workspace('ws')
+
+    async def main(client):
+        response = await client.workspace_fetch(name='ws')
+        assert response.results[0].id == wid
+        details = await client.workspace_details(wid)
+        assert details.name == 'ws'
+        with pytest.raises(QuetzalAPIException) as info:
+            await client.workspace_details(wid + 1)
+        assert info.value.status == 404
+
+    _run(main, fake_server)
+
+
+def test_workspace_cache_deleted(fake_server, tmp_path):
+    wid = fake_server.add_workspace('ws', status='DELETED')
+
+    async def main(client):
+        cache = client.workspace_cache
+        cache.put(fake_server.url, 'user', 'ws', wid)
+        await client.workspace_details(wid)
+        return cache.get(fake_server.url, 'user', 'ws')
+
+    assert _run(main, fake_server, workspace_cache=True,
+                workspace_cache_path=tmp_path / 'workspaces.json') is None
+
+
+def test_no_urllib3_pool(fake_server):
+    # Requests are sent with aiohttp only
+    client = _client(fake_server)
+    assert client.rest_client is None
+    assert client.pool_stats is None
+
+
+def test_retry(fake_server):
+    fake_server.add_workspace('ws')
+    fake_server.errors = [503, 503]
+
+    async def main(client):
+        return await client.workspace_fetch()
+
+    assert _run(main, fake_server).total == 1
+    assert len(fake_server.requests) == 3
+
+
+def test_single_login(fake_server):
+    fake_server.add_workspace('ws')
+
+    async def main(client):
+        await asyncio.gather(*[client.workspace_fetch() for _ in range(10)])
+
+    _run(main, fake_server, api_key={}, username='user', password='secret')
+    # Concurrent requests share the same login
+    assert fake_server.tokens_issued == 1
+
+
+def test_download(fake_server, tmp_path):
+    data = os.urandom(500000)
+    file_id = fake_server.add_file(data, filename='data.bin', path='a', wid=1)
+    fake_server.drop_count = 1
+    fake_server.drop_after = 100000
+
+    async def main(client):
+        return await aio.download(client, file_id, 1, output_dir=tmp_path, chunk_size=4096)
+
+    output = _run(main, fake_server)
+    assert output == str(tmp_path / 'a' / 'data.bin')
+    with open(output, 'rb') as f:
+        assert f.read() == data
+    ranges = [r['range'] for r in fake_server.requests if r['accept'] == 'application/octet-stream']
+    assert ranges[0] is None
+    assert ranges[1].startswith('bytes=')
+
+
+def test_download_range_ignored(fake_server, tmp_path):
+    data = os.urandom(500000)
+    file_id = fake_server.add_file(data, filename='data.bin', wid=1)
+    fake_server.drop_count = 1
+    fake_server.drop_after = 100000
+    fake_server.accept_ranges = False
+
+    async def main(client):
+        return await aio.download(client, file_id, 1, output=tmp_path / 'data.bin')
+
+    # The server sends the whole file again, which replaces the partial data
+    output = _run(main, fake_server)
+    with open(output, 'rb') as f:
+        assert f.read() == data
+
+
+def test_upload(fake_server):
+    data = os.urandom(100000)
+    file = io.BytesIO(data)
+    file.name = 'upload.bin'
+
+    async def main(client):
+        return await aio.upload(client, 1, file, path='dir')
+
+    details = _run(main, fake_server)
+    assert details.filename == 'upload.bin'
+    assert fake_server.files[details.id]['data'] == data
+    assert fake_server.requests[-1]['chunked']
+
+
+def test_file_io_outside_event_loop(fake_server, tmp_path, mocker):
+    data = os.urandom(100000)
+    threads = set()
+
+    class File(io.BytesIO):
+        name = 'upload.bin'
+
+        def read(self, *args):
+            threads.add(threading.get_ident())
+            return super().read(*args)
+
+    write_chunk = aio._write_chunk
+
+    def record_write(*args):
+        threads.add(threading.get_ident())
+        write_chunk(*args)
+
+    mocker.patch('quetzal.client.aio._write_chunk', side_effect=record_write)
+
+    async def main(client):
+        details = await aio.upload(client, 1, File(data))
+        await aio.download(client, details.id, 1, output=tmp_path / 'data.bin', chunk_size=4096)
+
+    _run(main, fake_server)
+    assert (tmp_path / 'data.bin').read_bytes() == data
+    assert threads and threading.get_ident() not in threads
+
+
+@pytest.mark.parametrize('limit, prefetch', [(None, 0), (None, 4), (120, 2)])
+def test_iter_query(fake_server, limit, prefetch):
+    fake_server.query_rows = [{'id': i} for i in range(1000)]
+    fake_server.page_latency = 0.01
+
+    async def main(client):
+        rows = aio.iter_query(client, 1, 'SELECT id FROM base', limit=limit, per_page=50, prefetch=prefetch)
+        return [row async for row in rows], rows.total
+
+    rows, total = _run(main, fake_server)
+    assert rows == fake_server.query_rows[:limit]
+    assert total == 1000
+    if prefetch > 1 and limit is None:
+        assert fake_server.max_concurrent_pages > 1
+
+    async def main(client):
+        return await aio.query(client, None, 'SELECT id FROM base', limit=10)
+
+    assert _run(main, fake_server) == (fake_server.query_rows[:10], 1000)
+
+
+@pytest.mark.parametrize('num_rows, max_per_page', [(230, 100), (53, 33)])
+@pytest.mark.parametrize('prefetch', [0, 4])
+def test_iter_query_capped_page_size(fake_server, num_rows, max_per_page, prefetch):
+    fake_server.query_rows = [{'id': i} for i in range(num_rows)]
+    fake_server.max_per_page = max_per_page
+
+    async def main(client):
+        rows = aio.iter_query(client, 1, 'SELECT id FROM base', per_page=200, prefetch=prefetch)
+        return [row async for row in rows]
+
+    assert _run(main, fake_server) == fake_server.query_rows
+
+
+def test_wait_for_workspace(fake_server):
+    wid = fake_server.add_workspace('ws', status='COMMITTING')
+    statuses = []
+
+    def progress(w_details):
+        statuses.append(w_details.status)
+        if len(statuses) == 3:
+            fake_server.workspaces[wid]['status'] = 'READY'
+
+    async def main(client):
+        return await aio.wait_for_workspace(client, wid, lambda w: w.status == 'COMMITTING',
+                                            progress={'func': progress}, interval=0)
+
+    assert _run(main, fake_server).status == 'READY'
+    assert statuses == ['COMMITTING'] * 3 + ['READY']
+
+
+def test_background_refresh(fake_server):
+    fake_server.token_lifetime = 4
+
+    async def main(client):
+        await client.workspace_fetch()
+        first_token = client.access_token
+        for _ in range(100):
+            if client.access_token != first_token:
+                break
+            await asyncio.sleep(0.05)
+        assert client.access_token != first_token
+        await client.workspace_fetch()
+
+    _run(main, fake_server, api_key={}, username='user', password='secret', token_refresh_margin=1)
+    assert fake_server.tokens_issued == 2
+
+
+def test_upload_from_path(fake_server, tmp_path):
+    data = os.urandom(100000)
+    path = tmp_path / 'upload.bin'
+    path.write_bytes(data)
+
+    async def main(client):
+        return await client.workspace_file_create(1, content=str(path))
+
+    details = _run(main, fake_server)
+    assert details.filename == 'upload.bin'
+    assert fake_server.files[details.id]['data'] == data
@@ -0,0 +1,52 @@
+import csv
+import json
+
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from quetzal.client.cli.main import cli
+
+
+ROWS = [{'id': i, 'name': f'file_{i}'} for i in range(250)]
+
+
+def _query(fake_server, *args):
+    runner = CliRunner()
+    return runner.invoke(cli, ['--url', fake_server.url, '--api-key', 'fake-key', 'query', *args],
+                         input='SELECT id, name FROM base\n')
+
+
+@pytest.mark.parametrize('filename, load', [
+    ('out.csv', lambda f: [{'id': int(r['id']), 'name': r['name']} for r in csv.DictReader(f)]),
+    ('out.json', json.load),
+    ('out.jsonl', lambda f: [json.loads(line) for line in f]),
+    ('out.yaml', yaml.safe_load),
+])
+def test_query_output_formats(fake_server, tmp_path, filename, load):
+    fake_server.query_rows = ROWS
+    output = tmp_path / filename
+
+    result = _query(fake_server, '--all', '-o', str(output))
+    assert result.exit_code == 0, result.output
+    assert f'Saved 250 out of 250 results in {output}' in result.output
+    with output.open() as f:
+        assert load(f) == ROWS
+
+
+def test_query_output_json_format(fake_server, tmp_path):
+    # The streamed JSON output is the same as dumping the complete list
+    fake_server.query_rows = ROWS[:3]
+    output = tmp_path / 'out.json'
+
+    _query(fake_server, '--all', '-o', str(output))
+    assert output.read_text() == json.dumps(ROWS[:3], indent=2)
+
+
+def test_query_output_no_results(fake_server, tmp_path):
+    output = tmp_path / 'out.csv'
+
+    result = _query(fake_server, '--all', '-o', str(output))
+    assert result.exit_code == 0
+    assert 'No results.' in result.output
+    assert output.read_text() == ''
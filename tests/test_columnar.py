@@ -0,0 +1,99 @@
+import math
+
+import pytest
+
+from quetzal.client import helpers
+from quetzal.client.helpers.columnar import ColumnarResult
+
+
+ROWS = [
+    {'id': 1, 'size': 10, 'score': 0.5, 'ok': True, 'name': 'a'},
+    {'id': 2, 'size': None, 'score': 1.5, 'ok': False, 'name': 'b'},
+    {'id': 3, 'size': 30, 'score': None, 'ok': True, 'name': None},
+]
+
+
+def test_columnar_types():
+    result = ColumnarResult(ROWS)
+
+    assert len(result) == 3
+    assert result.column_names == ['id', 'size', 'score', 'ok', 'name']
+    assert result._columns['id'].kind == 'int'
+    assert result._columns['size'].kind == 'float'
+    assert result._columns['score'].kind == 'float'
+    assert result._columns['ok'].kind == 'bool'
+    assert result._columns['name'].kind == 'object'
+    assert result['size'] == [10, None, 30]
+    assert result['ok'] == [True, False, True]
+    assert list(result) == ROWS
+
+
+def test_columnar_promotion_and_missing_columns():
+    result = ColumnarResult([{'x': None}, {'x': 1}, {'x': 'two', 'y': 2}])
+
+    assert result['x'] == [None, 1, 'two']
+    assert result['y'] == [None, None, 2]
+    assert len(result) == 3
+
+
+def test_columnar_numpy():
+    np = pytest.importorskip('numpy')
+    result = ColumnarResult(ROWS)
+    arrays = result.to_numpy()
+
+    assert arrays['id'].dtype == np.int64
+    assert arrays['ok'].dtype == np.bool_
+    assert math.isnan(arrays['score'][2])
+    assert not np.shares_memory(arrays['id'], np.frombuffer(result._columns['id'].values, dtype=np.int64))
+    # The arrays are copies, so that more rows can be added
+    result.extend(ROWS)
+    assert list(arrays['id']) == [1, 2, 3]
+    assert len(result) == 6
+
+
+def test_columnar_numpy_no_copy():
+    np = pytest.importorskip('numpy')
+    result = ColumnarResult(ROWS)
+    arrays = result.to_numpy(copy=False)
+
+    assert np.shares_memory(arrays['id'], np.frombuffer(result._columns['id'].values, dtype=np.int64))
+    with pytest.raises(BufferError):
+        result.extend(ROWS)
+    del arrays
+    result.extend(ROWS)
+    assert len(result) == 6
+
+
+def test_columnar_large_integers():
+    large = (1 << 53) + 1
+    result = ColumnarResult([{'x': large}, {'x': None}, {'y': 0.5}, {'y': large}])
+
+    # Promoting these integers to floats would round them
+    assert result._columns['x'].kind == 'object'
+    assert result._columns['y'].kind == 'object'
+    assert result['x'] == [large, None, None, None]
+    assert result['y'] == [None, None, 0.5, large]
+
+    result = ColumnarResult([{'x': 1 << 53}, {'x': None}])
+    assert result._columns['x'].kind == 'float'
+
+
+def test_columnar_arrow(tmp_path):
+    pytest.importorskip('pyarrow')
+    result = ColumnarResult(ROWS)
+    table = result.to_arrow()
+
+    assert table.num_rows == 3
+    assert table.column('size').null_count == 1
+    result.write_parquet(str(tmp_path / 'out.parquet'))
+    assert (tmp_path / 'out.parquet').exists()
+
+
+def test_query_columns(fake_server):
+    fake_server.query_rows = [{'id': i, 'name': f'file_{i}'} for i in range(250)]
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+
+    result = helpers.query_columns(client, None, 'SELECT id, name FROM base', limit=200)
+    assert len(result) == 200
+    assert result.total == 250
+    assert result['id'] == list(range(200))
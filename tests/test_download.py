@@ -0,0 +1,295 @@
+import concurrent.futures
+import hashlib
+import io
+import os
+import uuid
+
+import pytest
+import urllib3
+
+from quetzal.client import helpers, utils
+from quetzal.client.exceptions import QuetzalAPIException
+from quetzal.client.utils import CHECKSUM_INDEX_FILENAME
+
+
+def _fake_metadata(data, filename='foo.bin', path=''):
+    return {
+        'base': {
+            'checksum': hashlib.md5(data).hexdigest(),
+            'filename': filename,
+            'path': path,
+            'size': len(data),
+        }
+    }
+
+
+class _RecordingBytesIO(io.BytesIO):
+    """A BytesIO that records the size of each read request"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_sizes = []
+
+    def read(self, size=-1):
+        self.read_sizes.append(size)
+        return super().read(size)
+
+
+def _fake_response(data):
+    return urllib3.HTTPResponse(body=_RecordingBytesIO(data), status=200, preload_content=False)
+
+
+@pytest.fixture(scope='function')
+def client():
+    return helpers.get_client('https://localhost/api/v1', api_key='fake-key')
+
+
+def test_download_streams_in_chunks(mocker, client, tmp_path):
+    data = os.urandom(10 * 1024 + 17)
+    body = _RecordingBytesIO(data)
+    response = urllib3.HTTPResponse(body=body, status=200, preload_content=False)
+    mocker.patch('quetzal.client.helpers.file.metadata', return_value=_fake_metadata(data))
+    mocker.patch('quetzal.client.base.Client.public_file_details', return_value=response)
+
+    output = tmp_path / 'output.bin'
+    saved = helpers.file.download(client, str(uuid.uuid4()), output=output, chunk_size=1024)
+
+    assert saved == str(output.resolve())
+    assert output.read_bytes() == data
+    assert body.read_sizes
+    assert all(0 < size <= 1024 for size in body.read_sizes)
+    # No temporary files are left behind, and no checksum index unless requested
+    assert [p.name for p in tmp_path.iterdir()] == ['output.bin']
+
+
+def test_download_corrupted_keeps_no_file(mocker, client, tmp_path):
+    data = os.urandom(4096)
+    mocker.patch('quetzal.client.helpers.file.metadata', return_value=_fake_metadata(data))
+    mocker.patch('quetzal.client.base.Client.public_file_details',
+                 return_value=_fake_response(data[:-1] + b'x'))
+
+    output = tmp_path / 'output.bin'
+    with pytest.raises(ValueError):
+        helpers.file.download(client, str(uuid.uuid4()), output=output)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_single_pass_checksum(mocker, client, tmp_path):
+    data = os.urandom(4096)
+    mocker.patch('quetzal.client.helpers.file.metadata', return_value=_fake_metadata(data))
+    details_mock = mocker.patch('quetzal.client.base.Client.public_file_details',
+                                return_value=_fake_response(data))
+    readable_info_mock = mocker.patch('quetzal.client.utils.get_readable_info')
+
+    output = tmp_path / 'output.bin'
+    helpers.file.download(client, str(uuid.uuid4()), output=output, checksum_index=True)
+    assert output.read_bytes() == data
+    assert (tmp_path / CHECKSUM_INDEX_FILENAME).exists()
+
+    # Downloading again uses the checksum index: no download and no reads
+    helpers.file.download(client, str(uuid.uuid4()), output=output, checksum_index=True)
+    assert details_mock.call_count == 1
+    assert readable_info_mock.call_count == 0
+
+
+def test_download_checksum_index_outdated(mocker, client, tmp_path):
+    data = os.urandom(4096)
+    mocker.patch('quetzal.client.helpers.file.metadata', return_value=_fake_metadata(data))
+    details_mock = mocker.patch('quetzal.client.base.Client.public_file_details',
+                                side_effect=lambda *args, **kwargs: _fake_response(data))
+
+    output = tmp_path / 'output.bin'
+    helpers.file.download(client, str(uuid.uuid4()), output=output, checksum_index=True)
+
+    # Modify the file without changing its size: the index must not be trusted
+    output.write_bytes(bytes(len(data)))
+    os.utime(output, ns=(0, 0))
+    helpers.file.download(client, str(uuid.uuid4()), output=output, checksum_index=True)
+
+    assert details_mock.call_count == 2
+    assert output.read_bytes() == data
+
+
+def test_download_resumes_dropped_connection(fake_server, tmp_path):
+    data = os.urandom(1 << 20)
+    file_id = fake_server.add_file(data)
+    fake_server.drop_count = 1
+    fake_server.drop_after = 300 * 1024
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    helpers.file.download(client, file_id, output=output, chunk_size=4096)
+
+    assert output.read_bytes() == data
+    ranges = [r['range'] for r in fake_server.content_requests()]
+    assert len(ranges) == 2
+    assert ranges[0] is None
+    assert ranges[1].startswith('bytes=') and ranges[1] != 'bytes=0-'
+    assert [p.name for p in tmp_path.iterdir()] == ['output.bin']
+
+
+def test_download_resumes_partial_file(fake_server, tmp_path):
+    data = os.urandom(1 << 20)
+    file_id = fake_server.add_file(data)
+    fake_server.drop_count = 1
+    fake_server.drop_after = 500 * 1024
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    with pytest.raises(urllib3.exceptions.HTTPError):
+        helpers.file.download(client, file_id, output=output, chunk_size=4096, max_resumes=0)
+
+    # The partial download and its state are kept for a later call
+    assert not output.exists()
+    part = tmp_path / '.output.bin.part'
+    part_size = part.stat().st_size
+    assert 0 < part_size < len(data)
+    assert (tmp_path / '.output.bin.part.json').exists()
+
+    helpers.file.download(client, file_id, output=output)
+    assert output.read_bytes() == data
+    assert fake_server.content_requests()[-1]['range'] == f'bytes={part_size}-'
+    assert not part.exists()
+
+
+def test_download_complete_partial_file(fake_server, tmp_path):
+    data = os.urandom(1 << 20)
+    file_id = fake_server.add_file(data)
+    fake_server.drop_count = 1
+    fake_server.drop_after = 500 * 1024
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    with pytest.raises(urllib3.exceptions.HTTPError):
+        helpers.file.download(client, file_id, output=output, max_resumes=0)
+
+    # The process ended after writing the last byte, but before renaming
+    # the partial download
+    part = tmp_path / '.output.bin.part'
+    part.write_bytes(data)
+    requests = len(fake_server.content_requests())
+
+    helpers.file.download(client, file_id, output=output)
+    assert output.read_bytes() == data
+    assert len(fake_server.content_requests()) == requests
+    assert not part.exists()
+    assert not (tmp_path / '.output.bin.part.json').exists()
+
+
+
+def test_download_concurrent_same_output(fake_server, tmp_path):
+    data = os.urandom(256 * 1024)
+    file_id = fake_server.add_file(data)
+    fake_server.throttle = 1 << 20
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(helpers.file.download, client, file_id, output=output)
+                   for _ in range(2)]
+        paths = [future.result() for future in futures]
+
+    # The second download used its own partial download file
+    assert paths == [str(output)] * 2
+    assert output.read_bytes() == data
+    assert len(fake_server.content_requests()) == 2
+    assert [p.name for p in tmp_path.iterdir()] == ['output.bin']
+
+
+def test_download_error_keeps_no_partial_file(fake_server, tmp_path):
+    file_id = fake_server.add_file(b'hello')
+    # The metadata request succeeds, the contents request fails
+    fake_server.errors = [None, 404]
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    with pytest.raises(QuetzalAPIException):
+        helpers.file.download(client, file_id, output=output)
+    assert list(tmp_path.iterdir()) == []
+
+def test_download_multiple_streams(mocker, fake_server, tmp_path):
+    mocker.patch('quetzal.client.helpers.file.MIN_RANGE_SIZE', 64 * 1024)
+    data = os.urandom(1 << 20)
+    file_id = fake_server.add_file(data)
+    # One of the ranges will be interrupted, and resumed
+    fake_server.drop_count = 1
+    fake_server.drop_after = 100 * 1024
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    helpers.file.download(client, file_id, output=output, chunk_size=4096, streams=4)
+
+    assert output.read_bytes() == data
+    ranges = [r['range'] for r in fake_server.content_requests()]
+    assert len(ranges) == 5
+    assert {'bytes=0-262143', 'bytes=262144-524287',
+            'bytes=524288-786431', 'bytes=786432-1048575'} <= set(ranges)
+
+
+
+def test_download_multiple_streams_ranges_ignored(mocker, fake_server, tmp_path):
+    mocker.patch('quetzal.client.helpers.file.MIN_RANGE_SIZE', 64 * 1024)
+    data = os.urandom(1 << 20)
+    file_id = fake_server.add_file(data)
+    fake_server.accept_ranges = False
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    output = tmp_path / 'output.bin'
+    helpers.file.download(client, file_id, output=output, chunk_size=4096, streams=4)
+
+    # The file is downloaded again with a single stream
+    assert output.read_bytes() == data
+    assert fake_server.content_requests()[-1]['range'] is None
+    assert [p.name for p in tmp_path.iterdir()] == ['output.bin']
+
+def test_download_many(fake_server, tmp_path):
+    contents = [os.urandom(1024 * i + 1) for i in range(1, 6)]
+    file_ids = [fake_server.add_file(data, filename=f'file_{i}.bin', path='subdir')
+                for i, data in enumerate(contents)]
+    missing_id = str(uuid.uuid4())
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    results = helpers.file.download_many(client, file_ids + [missing_id], output_dir=tmp_path, workers=3)
+
+    assert [r.file_id for r in results] == file_ids + [missing_id]
+    for i, (result, data) in enumerate(zip(results, contents)):
+        assert result.error is None
+        assert result.path == str(tmp_path / 'subdir' / f'file_{i}.bin')
+        assert (tmp_path / 'subdir' / f'file_{i}.bin').read_bytes() == data
+    assert results[-1].path is None
+    assert isinstance(results[-1].error, QuetzalAPIException)
+
+    # Downloading again does not request the contents
+    num_requests = len(fake_server.content_requests())
+    results = helpers.file.download_many(client, file_ids, output_dir=tmp_path, workers=3)
+    assert all(r.error is None for r in results)
+    assert len(fake_server.content_requests()) == num_requests
+
+
+def test_checksum_index_appends(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, '_CHECKSUM_INDEX_COMPACT_MIN', 10)
+    paths = []
+    for i in range(50):
+        path = tmp_path / f'file{i}.bin'
+        path.write_bytes(b'x' * i)
+        paths.append(path)
+        utils.update_checksum_index(path, f'md5-{i}', i)
+
+    # Each update appends a line to the index
+    index = tmp_path / CHECKSUM_INDEX_FILENAME
+    assert len(index.read_text().splitlines()) == 50
+    assert utils.get_cached_readable_info(paths[7]) == ('md5-7', 7)
+
+    # Entries written by another process are read too
+    utils._checksum_index_states.clear()
+    assert utils.get_cached_readable_info(paths[42]) == ('md5-42', 42)
+
+    # The index is compacted once most of its lines are outdated
+    for _ in range(2):
+        for i, path in enumerate(paths):
+            utils.update_checksum_index(path, f'new-{i}', i)
+    assert len(index.read_text().splitlines()) < 150
+    utils._checksum_index_states.clear()
+    assert all(utils.get_cached_readable_info(path) == (f'new-{i}', i) for i, path in enumerate(paths))
+
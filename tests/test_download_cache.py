@@ -0,0 +1,123 @@
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from quetzal.client import helpers
+from quetzal.client.cache import BlobStore
+from quetzal.client.cli import State
+from quetzal.client.cli.main import cli
+
+
+@pytest.fixture(scope='function')
+def client(fake_server, tmp_path):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    client.configuration.download_cache = True
+    client.configuration.download_cache_path = tmp_path / 'blobs'
+    return client
+
+
+def _content_requests(fake_server):
+    return [r for r in fake_server.requests if r['method'] == 'GET' and r['accept'] == 'application/octet-stream']
+
+
+def test_download_cache_across_workspaces(fake_server, client, tmp_path):
+    data = os.urandom(1000)
+    first_id = fake_server.add_file(data, filename='a.bin', wid=1)
+    second_id = fake_server.add_file(data, filename='b.bin', path='other', wid=2)
+
+    first = helpers.file.download(client, first_id, 1, output_dir=tmp_path / 'one')
+    assert len(_content_requests(fake_server)) == 1
+    assert len(client.download_cache) == 1
+
+    # The same contents are not downloaded again
+    second = helpers.file.download(client, second_id, 2, output_dir=tmp_path / 'two')
+    assert len(_content_requests(fake_server)) == 1
+    assert second == str(tmp_path / 'two' / 'other' / 'b.bin')
+    with open(second, 'rb') as f:
+        assert f.read() == data
+    assert os.path.exists(first)
+
+
+def test_download_cache_disabled_by_default(fake_server, tmp_path):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    file_id = fake_server.add_file(b'hello', wid=1)
+
+    assert client.download_cache is None
+    helpers.file.download(client, file_id, 1, output_dir=tmp_path / 'one')
+    helpers.file.download(client, file_id, 1, output_dir=tmp_path / 'two')
+    assert len(_content_requests(fake_server)) == 2
+
+
+@pytest.mark.parametrize('link', ['hardlink', 'copy'])
+def test_blob_store_link(tmp_path, link):
+    source = tmp_path / 'source.bin'
+    source.write_bytes(b'hello')
+    store = BlobStore(tmp_path / 'blobs', link=[link])
+
+    path = store.add(source, 'checksum')
+    assert store.materialize('checksum', tmp_path / 'copy.bin') == link
+    assert (tmp_path / 'copy.bin').read_bytes() == b'hello'
+    assert os.path.samefile(path, tmp_path / 'copy.bin') == (link == 'hardlink')
+    assert store.materialize('unknown', tmp_path / 'other.bin') is None
+
+
+def test_blob_store_modified(tmp_path):
+    source = tmp_path / 'source.bin'
+    source.write_bytes(b'hello')
+    store = BlobStore(tmp_path / 'blobs', link=['hardlink'])
+    store.add(source, 'checksum')
+
+    # A file modified through a hard link is no longer valid
+    with source.open('ab') as f:
+        f.write(b' world')
+    assert 'checksum' not in store
+    assert len(store) == 0
+
+
+def test_blob_store_eviction(tmp_path):
+    store = BlobStore(tmp_path / 'blobs', max_size=30, link=['copy'])
+    for name in 'abc':
+        (tmp_path / name).write_bytes(name.encode() * 10)
+        store.add(tmp_path / name, name)
+    assert store.materialize('a', tmp_path / 'out')
+
+    # The least recently used file is removed
+    (tmp_path / 'd').write_bytes(b'd' * 10)
+    store.add(tmp_path / 'd', 'd')
+    assert store.size == 30
+    assert [e.checksum for e in store.entries()] == ['d', 'a', 'c']
+    assert not store.blob_path('b').exists()
+
+    # Files larger than the store are not added
+    (tmp_path / 'e').write_bytes(b'e' * 40)
+    assert store.add(tmp_path / 'e', 'e') is None
+    assert len(store) == 3
+
+
+def test_cache_command(tmp_path):
+    state = State()
+    state.api_config.download_cache_path = tmp_path / 'blobs'
+    store = BlobStore(tmp_path / 'blobs', link=['copy'])
+    for name in 'ab':
+        (tmp_path / name).write_bytes(name.encode() * 1000)
+        store.add(tmp_path / name, name)
+
+    runner = CliRunner()
+    result = runner.invoke(cli, ['cache', 'info'], obj=state)
+    assert result.exit_code == 0, result.output
+    assert 'Files:     2' in result.output
+    assert 'Size:      2.0 Kb' in result.output
+
+    result = runner.invoke(cli, ['cache', 'list'], obj=state)
+    assert result.exit_code == 0, result.output
+    assert result.output.index(' b ') < result.output.index(' a ')
+
+    result = runner.invoke(cli, ['cache', 'prune', '--max-size', '1K'], obj=state)
+    assert result.exit_code == 0, result.output
+    assert 'Removed 1 files, 1000 bytes.' in result.output
+    assert [e.checksum for e in store.entries()] == ['b']
+
+    result = runner.invoke(cli, ['cache', 'prune', '--all'], obj=state)
+    assert result.exit_code == 0, result.output
+    assert len(store) == 0
@@ -0,0 +1,102 @@
+import pytest
+
+from quetzal.client import helpers
+from quetzal.client.cache import MetadataCache
+from quetzal.client.exceptions import QuetzalAPIException
+
+
+@pytest.fixture(scope='function')
+def client(fake_server, tmp_path):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    client.configuration.metadata_cache = True
+    client.configuration.metadata_cache_path = tmp_path / 'metadata.sqlite3'
+    return client
+
+
+def _metadata_requests(fake_server):
+    return [r for r in fake_server.requests if r['method'] == 'GET' and r['accept'] == 'application/json']
+
+
+def test_metadata_cache_disabled_by_default(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    file_id = fake_server.add_file(b'hello', wid=1)
+
+    assert client.metadata_cache is None
+    for _ in range(2):
+        assert helpers.file.metadata(client, file_id, 1)['base']['size'] == 5
+    assert len(_metadata_requests(fake_server)) == 2
+
+
+def test_metadata_cache_hit(fake_server, client):
+    public_id = fake_server.add_file(b'public')
+    file_id = fake_server.add_file(b'hello', wid=1)
+
+    for _ in range(3):
+        assert helpers.file.metadata(client, public_id)['base']['filename'] == 'foo.bin'
+        assert helpers.file.metadata(client, file_id, 1)['base']['size'] == 5
+    assert len(_metadata_requests(fake_server)) == 2
+
+    # The cache persists across clients
+    other = helpers.get_client(fake_server.url, api_key='fake-key')
+    other.configuration.metadata_cache = True
+    other.configuration.metadata_cache_path = client.configuration.metadata_cache_path
+    assert helpers.file.metadata(other, file_id, 1)['base']['size'] == 5
+    assert len(_metadata_requests(fake_server)) == 2
+
+
+def test_metadata_cache_revalidation(fake_server, client):
+    client.configuration.metadata_cache_ttl = 0
+    file_id = fake_server.add_file(b'hello', wid=1)
+
+    first = helpers.file.metadata(client, file_id, 1)
+    # An expired entry is validated with its entity tag
+    assert helpers.file.metadata(client, file_id, 1) == first
+    requests = _metadata_requests(fake_server)
+    assert requests[0]['if_none_match'] is None
+    assert requests[1]['if_none_match'] is not None
+
+    # Changed metadata is received again
+    fake_server.files[file_id]['base']['path'] = 'new/path'
+    assert helpers.file.metadata(client, file_id, 1)['base']['path'] == 'new/path'
+    assert len(_metadata_requests(fake_server)) == 3
+
+
+def test_metadata_cache_invalidation(fake_server, client):
+    file_id = fake_server.add_file(b'hello', wid=1)
+    key = f'{client.configuration.host}|1|{file_id}'
+
+    helpers.file.metadata(client, file_id, 1)
+    assert client.metadata_cache.get(key) is not None
+    helpers.file.delete(client, file_id, 1)
+    assert client.metadata_cache.get(key) is None
+
+    # Entries of files that no longer exist are removed
+    client.metadata_cache.put(key, {'base': {}}, '"etag"')
+    client.configuration.metadata_cache_ttl = 0
+    with pytest.raises(QuetzalAPIException):
+        helpers.file.metadata(client, file_id, 1)
+    assert client.metadata_cache.get(key) is None
+
+
+def test_metadata_cache_eviction(tmp_path):
+    cache = MetadataCache(tmp_path / 'metadata.sqlite3', max_entries=3)
+    for key in 'abc':
+        cache.put(key, {'key': key})
+    assert cache.get('a').value == {'key': 'a'}
+
+    # The least recently used entry is removed
+    cache.put('d', {'key': 'd'})
+    assert len(cache) == 3
+    assert cache.get('b') is None
+    assert [cache.get(key).value['key'] for key in 'acd'] == ['a', 'c', 'd']
+    cache.close()
+
+
+def test_metadata_cache_update(fake_server, client):
+    file_id = fake_server.add_file(b'hello', wid=1)
+
+    assert 'user' not in helpers.file.metadata(client, file_id, 1)
+    # The cached entry is not used after the metadata is updated
+    helpers.workspace.update_metadata(client, 1, file_id, {'user': {'kind': 'test'}})
+    assert helpers.file.metadata(client, file_id, 1)['user'] == {'kind': 'test'}
+    assert len(_metadata_requests(fake_server)) == 2
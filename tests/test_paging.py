@@ -0,0 +1,225 @@
+import pytest
+
+from quetzal.client import helpers
+from quetzal.client.helpers import _paging
+
+
+@pytest.fixture(scope='function')
+def client(fake_server):
+    return helpers.get_client(fake_server.url, api_key='fake-key')
+
+
+@pytest.fixture(autouse=True)
+def clear_page_size_cache():
+    _paging._max_per_page_cache.clear()
+    yield
+    _paging._max_per_page_cache.clear()
+
+
+def _query_requests(fake_server):
+    return [r for r in fake_server.requests if '/queries/' in r['path']]
+
+
+def test_iter_query_is_lazy(fake_server, client):
+    fake_server.query_rows = [{'id': i} for i in range(250)]
+
+    rows = helpers.iter_query(client, None, 'SELECT id FROM base', per_page=100, prefetch=0)
+    assert rows.total is None
+    assert _query_requests(fake_server) == []
+
+    assert next(rows) == {'id': 0}
+    assert rows.total == 250
+    assert len(_query_requests(fake_server)) == 1
+
+    # The next page is only requested when the first one has been consumed
+    assert [next(rows) for _ in range(99)][-1] == {'id': 99}
+    assert len(_query_requests(fake_server)) == 1
+    assert next(rows) == {'id': 100}
+    assert len(_query_requests(fake_server)) == 2
+
+    assert list(rows) == [{'id': i} for i in range(101, 250)]
+    assert len(_query_requests(fake_server)) == 3
+
+
+def test_iter_query_prefetch(fake_server, client):
+    fake_server.query_rows = [{'id': i} for i in range(1000)]
+    fake_server.page_latency = 0.05
+
+    rows = helpers.iter_query(client, 1, 'SELECT id FROM base', per_page=50, prefetch=4)
+    assert list(rows) == fake_server.query_rows
+    assert rows.total == 1000
+    # Pages were requested concurrently, but never more than the prefetch
+    # pages in addition to the page being consumed
+    assert 1 < fake_server.max_concurrent_pages <= 4
+    pages = sorted(int(r['path'].split('page=')[1].split('&')[0])
+                   for r in _query_requests(fake_server) if r['method'] == 'GET')
+    assert pages == list(range(2, 21))
+
+
+def test_iter_query_prefetch_limit(fake_server, client):
+    fake_server.query_rows = [{'id': i} for i in range(1000)]
+
+    rows = helpers.iter_query(client, None, 'SELECT id FROM base', limit=120, per_page=50, prefetch=8)
+    assert list(rows) == fake_server.query_rows[:120]
+    # Pages beyond the limit are not requested
+    assert len(_query_requests(fake_server)) == 3
+
+
+def test_iter_query_first_page_larger(mocker):
+    # The first page has more rows than per_page, as when the query creation
+    # endpoint does not honor it: rows must not be repeated
+    rows = list(range(95))
+
+    def fetch(page, per_page):
+        if page == 1:
+            return mocker.Mock(results=rows[:25], total=len(rows)), 0
+        return mocker.Mock(results=rows[(page - 1) * per_page:page * per_page], total=len(rows)), 0
+
+    for prefetch in (0, 3):
+        assert list(_paging.PageIterator(fetch, per_page=10, prefetch=prefetch)) == rows
+
+
+def _page_sizes(fake_server):
+    return [int(r['path'].split('per_page=')[1].split('&')[0])
+            for r in _query_requests(fake_server) if r['method'] == 'GET']
+
+
+def test_iter_query_adaptive_page_size(fake_server, client):
+    fake_server.query_rows = [{'id': i} for i in range(5000)]
+
+    rows = helpers.iter_query(client, None, 'SELECT id FROM base', prefetch=0)
+    assert list(rows) == fake_server.query_rows
+    # Fast and small pages make the page size grow
+    page_sizes = _page_sizes(fake_server)
+    assert page_sizes[0] == 100
+    assert max(page_sizes) > 100
+    assert len(page_sizes) < 49
+
+
+def test_iter_query_adaptive_page_size_shrinks(mocker):
+    rows = list(range(1000))
+    sizes = []
+
+    def fetch(page, per_page):
+        sizes.append(per_page)
+        # Responses larger than 50 items are too large
+        return mocker.Mock(results=rows[(page - 1) * per_page:page * per_page], total=len(rows)), per_page * 1000
+
+    sizer = _paging.PageSizer(100, target_bytes=50000)
+    assert list(_paging.PageIterator(fetch, per_page=sizer)) == rows
+    assert sizes[:3] == [100, 50, 50]
+
+
+
+def test_iter_query_shrinking_results(mocker):
+    # Items are removed during the iteration, but the total is not updated:
+    # the empty pages past the remaining items end the iteration
+    rows = list(range(1000))
+
+    def fetch(page, per_page):
+        if page > 1:
+            del rows[500:]
+        return mocker.Mock(results=rows[(page - 1) * per_page:page * per_page], total=1000), 0
+
+    for prefetch in (0, 3):
+        rows[:] = range(1000)
+        sizer = _paging.PageSizer(100)
+        assert list(_paging.PageIterator(fetch, per_page=sizer, prefetch=prefetch)) == list(range(500))
+
+@pytest.mark.parametrize('reject', [False, True])
+def test_iter_query_learns_max_page_size(fake_server, client, reject):
+    fake_server.query_rows = [{'id': i} for i in range(3000)]
+    fake_server.max_per_page = 300
+    fake_server.reject_large_pages = reject
+
+    for prefetch in (0, 4):
+        rows = helpers.iter_query(client, 1, 'SELECT id FROM base', prefetch=prefetch)
+        assert list(rows) == fake_server.query_rows
+
+    # The maximum is learned and not exceeded afterwards
+    assert _paging._max_per_page_cache[(client.configuration.host, 'workspace_query_details')] <= 300
+    num_pages = len(_page_sizes(fake_server))
+    assert len(list(helpers.iter_query(client, 1, 'SELECT id FROM base'))) == 3000
+    assert max(_page_sizes(fake_server)[num_pages:]) <= 300
+
+
+
+@pytest.mark.parametrize('num_rows,max_per_page', [(230, 100), (53, 33), (250, 50), (80, 7)])
+@pytest.mark.parametrize('per_page', [None, 100])
+def test_iter_query_capped_page_size(fake_server, client, num_rows, max_per_page, per_page):
+    # The total is not a multiple of the page size of the server, which
+    # computes the offsets of its pages with this page size
+    fake_server.query_rows = [{'id': i} for i in range(num_rows)]
+    fake_server.max_per_page = max_per_page
+
+    for prefetch in (0, 4):
+        rows = helpers.iter_query(client, 1, 'SELECT id FROM base', per_page=per_page, prefetch=prefetch)
+        assert list(rows) == fake_server.query_rows
+    assert helpers.query(client, 1, 'SELECT id FROM base') == (fake_server.query_rows, num_rows)
+
+def test_query_limit(fake_server, client):
+    fake_server.query_rows = [{'id': i} for i in range(250)]
+
+    results, total = helpers.query(client, 1, 'SELECT id FROM base', limit=120)
+    assert results == [{'id': i} for i in range(120)]
+    assert total == 250
+
+    fake_server.query_rows = []
+    assert helpers.query(client, None, 'SELECT id FROM base') == ([], 0)
+
+
+def test_iter_workspaces(fake_server, client):
+    for i in range(25):
+        fake_server.add_workspace(f'ws-{i}', owner='alice' if i % 2 else 'bob')
+
+    workspaces = helpers.workspace.iter_workspaces(client, owner='alice', per_page=5)
+    assert [w['name'] for w in workspaces] == [f'ws-{i}' for i in range(1, 25, 2)]
+    assert workspaces.total == 12
+
+    results, total = helpers.workspace.list_(client, per_page=10, limit=15)
+    assert len(results) == 15
+    assert total == 25
+
+
+def test_iter_files(fake_server, client):
+    for i in range(30):
+        fake_server.add_file(b'x' * i, filename=f'file_{i}.bin', path='a' if i < 20 else 'b', wid=1)
+
+    files = helpers.workspace.iter_files(client, 1, per_page=7, path='a')
+    assert [f['filename'] for f in files] == [f'file_{i}.bin' for i in range(20)]
+    assert files.total == 20
+
+    file_list, total = helpers.workspace.files(client, 1, limit=5)
+    assert len(file_list) == 5
+    assert total == 30
+
+
+def test_iter_files_raw(fake_server, client, mocker):
+    for i in range(30):
+        fake_server.add_file(b'x' * i, filename=f'file_{i}.bin', wid=1)
+    deserialize = mocker.spy(client, 'deserialize')
+
+    files = list(helpers.workspace.iter_files(client, 1, raw=True))
+    assert files == [f['base'] for f in fake_server.files.values()]
+    assert deserialize.call_count == 0
+
+    # Without the raw option, the files are the dictionaries of the models
+    assert list(helpers.workspace.iter_files(client, 1)) == files
+    assert deserialize.call_count > 0
+
+
+def test_iter_workspaces_raw(fake_server, client):
+    fake_server.add_workspace('ws')
+
+    workspace, = helpers.workspace.iter_workspaces(client, raw=True)
+    assert workspace['creation_date'] == '2020-01-01T00:00:00+00:00'
+    workspace, = helpers.workspace.iter_workspaces(client)
+    assert workspace['creation_date'].year == 2020
+
+
+def test_call_api_json(fake_server, client):
+    wid = fake_server.add_workspace('ws')
+
+    page = client.call_api_json(client.workspace_fetch, name='ws')
+    assert page['total'] == 1
+    assert page['results'] == [fake_server.workspaces[wid]]
@@ -0,0 +1,60 @@
+import concurrent.futures
+import socket
+
+from quetzal.client import helpers
+
+
+def _fetch_concurrently(client, threads, requests):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: client.workspace_fetch(), range(requests)))
+
+
+def test_connections_reused(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    for _ in range(5):
+        client.workspace_fetch()
+
+    stats = client.pool_stats
+    assert stats.requests == 5
+    assert stats.connections_created == 1
+    assert stats.connections_reused == 4
+    assert stats.as_dict()['connections_discarded'] == 0
+
+
+def test_pool_block(fake_server):
+    fake_server.page_latency = 0.05
+    client = helpers.get_client(fake_server.url, api_key='fake-key', pool_maxsize=2, pool_block=True)
+    _fetch_concurrently(client, 8, 16)
+
+    # Requests wait for one of the connections of the pool
+    stats = client.pool_stats
+    assert stats.requests == 16
+    assert stats.connections_created <= 2
+    assert stats.connections_discarded == 0
+    assert stats.waits > 0
+    assert stats.wait_time > 0
+
+
+def test_pool_too_small(fake_server):
+    fake_server.page_latency = 0.05
+    client = helpers.get_client(fake_server.url, api_key='fake-key', pool_maxsize=2)
+    _fetch_concurrently(client, 8, 16)
+
+    # Requests open new connections that do not fit in the pool
+    stats = client.pool_stats
+    assert stats.connections_created > 2
+    assert stats.connections_discarded > 0
+    assert stats.waits == 0
+
+
+def test_pool_options(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key', pools=2, pool_maxsize=64)
+    manager = client.rest_client.pool_manager
+    assert manager.pools._maxsize == 2
+    assert manager.connection_pool_kw['maxsize'] == 64
+    assert manager.connection_pool_kw['block'] is False
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in manager.connection_pool_kw['socket_options']
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key', keep_alive=False)
+    assert 'socket_options' not in client.rest_client.pool_manager.connection_pool_kw
+    client.workspace_fetch()
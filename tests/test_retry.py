@@ -1,10 +1,14 @@
 import collections
+import email.utils
+import io
+import time
 import uuid
 
 import pytest
 
 from quetzal.client import helpers
-from quetzal.client.exceptions import QuetzalAPIException
+from quetzal.client.exceptions import QuetzalAPIException, RetryableException
+from quetzal.client.retry import RetryBudget, RetryPolicy
 from quetzal.openapi_client.rest import ApiException
 
 
@@ -64,3 +68,91 @@ def test_auth_retry(mocker):
     assert call_api_mock.call_count >= 10
 
 
+def _client(fake_server, **kwargs):
+    policy = RetryPolicy(**dict({'base': 0.01, 'budget': None}, **kwargs))
+    return helpers.get_client(fake_server.url, api_key='fake-key', retry_policy=policy)
+
+
+def test_full_jitter():
+    policy = RetryPolicy(base=1, factor=2, max_delay=5)
+    delays = [policy.delay(None, 3) for _ in range(100)]
+    assert all(0 <= d <= 4 for d in delays)
+    assert len(set(delays)) > 1
+    assert all(0 <= policy.delay(None, 10) <= 5 for _ in range(100))
+    assert RetryPolicy(jitter=False).delay(None, 2) == 2
+
+    # Retry-After sets the minimum delay, up to a maximum
+    error = RetryableException(503, 'Error', None)
+    error.retry_after = 100
+    assert policy.delay(error, 1) == 60
+    assert RetryPolicy(max_retry_after=200).delay(error, 1) == 100
+
+
+def test_retry(fake_server):
+    fake_server.add_workspace('ws')
+    fake_server.errors = [503, 502]
+    client = _client(fake_server)
+    assert client.workspace_fetch().total == 1
+    assert len(fake_server.requests) == 3
+
+    fake_server.errors = [503] * 3
+    with pytest.raises(RetryableException):
+        _client(fake_server, max_tries=2).workspace_fetch()
+    assert fake_server.errors == [503]
+
+
+@pytest.mark.parametrize('retry_after', ['1', 'date'])
+def test_retry_after(fake_server, retry_after):
+    if retry_after == 'date':
+        retry_after = email.utils.formatdate(time.time() + 2, usegmt=True)
+    fake_server.errors = [429]
+    fake_server.retry_after = retry_after
+    client = _client(fake_server)
+
+    start = time.monotonic()
+    client.workspace_fetch()
+    assert time.monotonic() - start >= 0.9
+
+    # Retry-After is ignored when the policy does not honor it
+    fake_server.errors = [503]
+    start = time.monotonic()
+    _client(fake_server, retry_after=False).workspace_fetch()
+    assert time.monotonic() - start < 0.5
+
+
+def test_retry_budget(fake_server):
+    budget = RetryBudget(ratio=0.5, capacity=2, min_per_second=0)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+    # Once the budget is exhausted, errors are not retried
+    budget = RetryBudget(ratio=0, capacity=1, min_per_second=0)
+    client = _client(fake_server, budget=budget)
+    fake_server.errors = [503] * 5
+    with pytest.raises(RetryableException):
+        client.workspace_fetch()
+    assert len(fake_server.requests) == 2
+
+
+def _file(data):
+    file_obj = io.BytesIO(data)
+    file_obj.name = 'upload.bin'
+    return file_obj
+
+
+def test_upload_not_replayed(fake_server):
+    client = _client(fake_server)
+    fake_server.errors = [503]
+    with pytest.raises(QuetzalAPIException) as info:
+        helpers.workspace.upload(client, 1, _file(b'data'))
+    assert info.value.status == 503
+    assert len(fake_server.requests) == 1
+
+    # Operations declared as idempotent are retried
+    client = _client(fake_server, idempotent_operations=[('POST', '/data/workspaces/{wid}/files/')])
+    fake_server.errors = [503]
+    details = helpers.workspace.upload(client, 1, _file(b'data'))
+    assert fake_server.files[details.id]['data'] == b'data'
@@ -0,0 +1,179 @@
+import base64
+import concurrent.futures
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from quetzal.client import Client, helpers
+from quetzal.client.tokens import TokenStore, token_expiration
+
+
+def _client(fake_server, path):
+    client = helpers.get_client(fake_server.url, username='user', password='secret')
+    client.configuration.api_key = {}
+    client.configuration.token_cache = True
+    client.configuration.token_cache_path = path
+    return client
+
+
+def _bearer_tokens(fake_server):
+    return [r['authorization'] for r in fake_server.requests
+            if r['method'] == 'GET' and (r.get('authorization') or '').startswith('Bearer')]
+
+
+def test_token_reused_across_clients(fake_server, tmp_path):
+    path = tmp_path / 'tokens.json'
+    for _ in range(3):
+        client = _client(fake_server, path)
+        client.workspace_fetch()
+    assert fake_server.tokens_issued == 1
+    assert len(set(_bearer_tokens(fake_server))) == 1
+
+    # Only its owner can read the file
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_token_refreshed_before_expiration(fake_server, tmp_path):
+    # Tokens that expire within the refresh margin are renewed
+    fake_server.token_lifetime = 30
+    client = _client(fake_server, tmp_path / 'tokens.json')
+    client.workspace_fetch()
+    client.workspace_fetch()
+    assert fake_server.tokens_issued == 2
+
+    _client(fake_server, tmp_path / 'tokens.json').workspace_fetch()
+    assert fake_server.tokens_issued == 3
+
+
+def test_token_cache_disabled_by_default(fake_server):
+    client = helpers.get_client(fake_server.url, username='user', password='secret')
+    client.configuration.api_key = {}
+    assert client.token_store is None
+    client.workspace_fetch()
+
+    other = helpers.get_client(fake_server.url, username='user', password='secret')
+    other.configuration.api_key = {}
+    other.workspace_fetch()
+    assert fake_server.tokens_issued == 2
+
+
+def test_logout_removes_token(fake_server, tmp_path):
+    path = tmp_path / 'tokens.json'
+    client = _client(fake_server, path)
+    helpers.auth.login(client)
+    assert client.token_store.get(client.configuration.host, 'user') is not None
+
+    helpers.auth.logout(client)
+    assert client.token_store.get(client.configuration.host, 'user') is None
+    _client(fake_server, path).workspace_fetch()
+    assert fake_server.tokens_issued == 2
+
+
+def test_token_store_expiration(tmp_path):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': 2000000000}).encode()).decode().rstrip('=')
+    assert token_expiration(f'header.{payload}.signature') == 2000000000
+    assert token_expiration('opaque-token') is None
+
+    # Tokens without expiration last for the lifetime of the store
+    store = TokenStore(tmp_path / 'tokens.json', lifetime=100)
+    saved = store.put('host', 'user', 'opaque-token')
+    assert saved.expires == pytest.approx(time.time() + 100, abs=5)
+    assert store.get('host', 'user').token == 'opaque-token'
+    assert store.get('host', 'user', margin=200) is None
+    assert store.get('host', 'other') is None
+
+
+def _fetch_concurrently(client, threads):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(lambda _: client.workspace_fetch(), range(threads)))
+
+
+def test_concurrent_login(fake_server):
+    fake_server.page_latency = 0.01
+    client = helpers.get_client(fake_server.url, username='user', password='secret')
+    _fetch_concurrently(client, 32)
+    # Only one thread logged in
+    assert fake_server.tokens_issued == 1
+
+
+def test_concurrent_refresh_of_rejected_token(fake_server):
+    fake_server.page_latency = 0.01
+    client = helpers.get_client(fake_server.url, username='user', password='secret')
+    client.workspace_fetch()
+    fake_server.revoked_tokens.add(client.access_token)
+
+    _fetch_concurrently(client, 32)
+    # All the threads got a 401 error, but the token was replaced only once
+    assert fake_server.tokens_issued == 2
+    assert client.access_token not in fake_server.revoked_tokens
+
+
+def test_clients_isolated(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    other = helpers.get_client(fake_server.url, username='user', password='secret')
+    assert client.configuration.api_key == {'X-API-KEY': 'fake-key'}
+    assert other.configuration.api_key == {}
+
+    # Clients that share a configuration use their own token
+    first, second = Client(other.configuration), Client(other.configuration)
+    first.login()
+    second.login()
+    first.workspace_fetch()
+    assert _bearer_tokens(fake_server)[-1] == f'Bearer {first.access_token}'
+    assert first.access_token != second.access_token
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return predicate()
+
+
+def test_background_refresh(fake_server):
+    fake_server.token_lifetime = 4
+    used = helpers.get_client(fake_server.url, username='user', password='secret')
+    used.configuration.token_refresh_margin = 1
+    idle = helpers.get_client(fake_server.url, username='user', password='secret')
+    idle.configuration.token_refresh_margin = 1
+
+    used.workspace_fetch()
+    helpers.auth.login(idle)
+    first_token = used.access_token
+    assert fake_server.tokens_issued == 2
+
+    # The token of the client that sent requests is renewed before it
+    # expires, and the next request does not need a login
+    assert _wait_for(lambda: used.access_token != first_token)
+    issued = fake_server.tokens_issued
+    used.workspace_fetch()
+    assert fake_server.tokens_issued == issued
+    assert _bearer_tokens(fake_server)[-1] == f'Bearer {used.access_token}'
+
+    # The token of the idle client is not renewed
+    time.sleep(0.5)
+    assert fake_server.tokens_issued == issued == 3
+
+
+def test_background_refresh_disabled(fake_server):
+    fake_server.token_lifetime = 2
+    client = helpers.get_client(fake_server.url, username='user', password='secret')
+    client.configuration.token_refresh_margin = 1
+    client.configuration.token_background_refresh = False
+    client.workspace_fetch()
+    time.sleep(1.5)
+    assert fake_server.tokens_issued == 1
+
+
+def test_sent_token_fallback():
+    # Before Python 3.7, the token sent by each thread is kept in a
+    # thread-local variable
+    from quetzal.client.base import _ThreadLocalVar
+    var = _ThreadLocalVar()
+    var.set('main')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(var.get, None).result() is None
+    assert var.get(None) == 'main'
@@ -0,0 +1,171 @@
+import io
+import os
+import threading
+import time
+
+import quetzal.openapi_client
+from quetzal.client import helpers
+from quetzal.client.base import Client, TransferBudget, TransferListener, _chunked_body_generator
+
+
+class _RecordingListener(TransferListener):
+
+    def __init__(self):
+        self.events = []
+
+    def on_start(self, transfer):
+        self.events.append(('start', transfer.direction, transfer.name, transfer.total))
+
+    def on_chunk(self, transfer, num_bytes):
+        self.events.append(('chunk', num_bytes))
+
+    def on_retry(self, transfer, error):
+        self.events.append(('retry', transfer.transferred))
+
+    def on_finish(self, transfer):
+        self.events.append(('finish', transfer.transferred, transfer.elapsed >= 0))
+
+    def on_error(self, transfer, error):
+        self.events.append(('error', type(error)))
+
+
+def test_transfer_budget_blocks():
+    budget = TransferBudget(max_bytes=100)
+    budget.acquire(60)
+    acquired = threading.Event()
+
+    def acquire_more():
+        budget.acquire(60)
+        acquired.set()
+
+    thread = threading.Thread(target=acquire_more)
+    thread.start()
+    time.sleep(0.1)
+    assert not acquired.is_set()
+
+    budget.release(60)
+    thread.join(timeout=1)
+    assert acquired.is_set()
+    assert budget.in_flight == 60
+
+
+def test_transfer_budget_large_chunk():
+    # A chunk larger than the limit does not block when nothing else is in flight
+    budget = TransferBudget(max_bytes=100)
+    budget.acquire(1000)
+    assert budget.in_flight == 1000
+    budget.release(1000)
+    assert budget.in_flight == 0
+
+
+def test_transfer_budget_unlimited():
+    budget = TransferBudget()
+    for _ in range(10):
+        budget.acquire(1 << 30)
+    assert budget.in_flight == 0
+
+
+def test_transfer_budget_shared_by_clients(fake_server):
+    clients = [helpers.get_client(fake_server.url, api_key='fake-key') for _ in range(2)]
+    for client in clients:
+        client.transfer_budget.max_bytes = 100
+    clients[0].transfer_budget.acquire(60)
+    acquired = threading.Event()
+
+    def acquire_more():
+        clients[1].transfer_budget.acquire(60)
+        acquired.set()
+
+    thread = threading.Thread(target=acquire_more)
+    thread.start()
+    time.sleep(0.1)
+    assert not acquired.is_set()
+
+    clients[0].transfer_budget.release(60)
+    thread.join(timeout=1)
+    assert acquired.is_set()
+    clients[1].transfer_budget.release(60)
+    assert clients[0].transfer_budget.in_flight == 0
+
+
+def test_chunked_body_chunk_size(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    client.configuration.chunk_size = 4
+    client.rest_client = client._new_rest_client()
+    assert client.rest_client.pool_manager.chunk_size == 4
+    assert list(_chunked_body_generator(b'0123456789', 4)) == [b'0123', b'4567', b'89']
+
+
+def test_generated_configuration(fake_server, tmp_path):
+    # The configuration of the generated client does not have the options of
+    # quetzal.client.Configuration: their default values are used
+    data = os.urandom(10 * 1024)
+    file_id = fake_server.add_file(data, filename='data.bin')
+    config = quetzal.openapi_client.Configuration()
+    config.host = fake_server.url
+    config.api_key = {'X-API-KEY': 'fake-key'}
+    client = Client(config)
+
+    assert client.metadata_cache is None and client.workspace_cache is None
+    output = tmp_path / 'data.bin'
+    helpers.file.download(client, file_id, output=output)
+    assert output.read_bytes() == data
+    with output.open('rb') as f:
+        details = helpers.workspace.upload(client, 1, f, deduplicate=True)
+    assert details.id == file_id
+
+
+def test_transfer_events_download(fake_server, tmp_path):
+    data = os.urandom(100 * 1024)
+    file_id = fake_server.add_file(data, filename='data.bin')
+    fake_server.drop_count = 1
+    fake_server.drop_after = 40 * 1024
+
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    listener = _RecordingListener()
+    client.add_transfer_listener(listener)
+    helpers.file.download(client, file_id, output=tmp_path / 'data.bin', chunk_size=4096)
+
+    assert listener.events[0] == ('start', 'download', 'data.bin', len(data))
+    assert listener.events[-1] == ('finish', len(data), True)
+    retries = [i for i, e in enumerate(listener.events) if e[0] == 'retry']
+    assert len(retries) == 1
+    # The download resumes from the bytes received before the connection dropped
+    offset = listener.events[retries[0]][1]
+    assert offset == sum(e[1] for e in listener.events[:retries[0]] if e[0] == 'chunk')
+    assert offset + sum(e[1] for e in listener.events[retries[0]:] if e[0] == 'chunk') == len(data)
+
+
+def test_transfer_events_upload(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    client.configuration.chunk_size = 4096
+    listener = _RecordingListener()
+    client.add_transfer_listener(listener)
+    # The first attempt is rejected with an error that is retried even for
+    # uploads, so the body is sent twice
+    fake_server.errors = [429]
+    data = os.urandom(10 * 1024)
+    file_obj = io.BytesIO(data)
+    file_obj.name = 'upload.bin'
+    helpers.workspace.upload(client, 1, file_obj)
+
+    assert listener.events[0] == ('start', 'upload', 'upload.bin', len(data))
+    assert ('retry', 0) in listener.events
+    assert listener.events[-1] == ('finish', len(data), True)
+
+
+def test_transfer_events_listener_errors_are_ignored(fake_server, tmp_path):
+    class FailingListener(TransferListener):
+        def on_chunk(self, transfer, num_bytes):
+            raise RuntimeError('listener failure')
+
+    data = os.urandom(1024)
+    file_id = fake_server.add_file(data)
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    client.add_transfer_listener(FailingListener())
+    listener = _RecordingListener()
+    client.add_transfer_listener(listener)
+    helpers.file.download(client, file_id, output=tmp_path / 'data.bin')
+
+    assert (tmp_path / 'data.bin').read_bytes() == data
+    assert listener.events[-1][0] == 'finish'
@@ -0,0 +1,155 @@
+import io
+import os
+import pathlib
+
+import pytest
+
+from quetzal.client import helpers
+
+
+class _RecordingBytesIO(io.BytesIO):
+    """A BytesIO that records the size of each read request"""
+
+    def __init__(self, *args, name='foo.bin', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+        self.read_sizes = []
+
+    def read(self, size=-1):
+        self.read_sizes.append(size)
+        return super().read(size)
+
+
+@pytest.fixture(scope='function')
+def client(fake_server):
+    return helpers.get_client(fake_server.url, api_key='fake-key')
+
+
+def test_upload_streams_in_chunks(fake_server, client):
+    client.configuration.chunk_size = 4096
+    data = os.urandom(100 * 1024 + 3)
+    file_obj = _RecordingBytesIO(data, name='/some/dir/upload.bin')
+
+    details = helpers.workspace.upload(client, 1, file_obj, path='a/b')
+
+    assert fake_server.files[details.id]['data'] == data
+    assert details.filename == 'upload.bin'
+    assert details.path == 'a/b'
+    assert all(0 < size <= 4096 for size in file_obj.read_sizes)
+    request = fake_server.requests[-1]
+    assert request['chunked']
+
+
+def test_upload_retry_sends_complete_body(fake_server, client):
+    data = os.urandom(10 * 1024)
+    file_obj = _RecordingBytesIO(data)
+    file_obj.seek(1024)
+    fake_server.errors = [429]
+
+    details = helpers.workspace.upload(client, 1, file_obj)
+
+    # The body of the retried request starts again from the initial position
+    assert [r['method'] for r in fake_server.requests] == ['POST', 'POST']
+    assert fake_server.files[details.id]['data'] == data[1024:]
+
+
+def test_upload_many(fake_server, client, tmp_path):
+    contents = {
+        'a.bin': os.urandom(100),
+        'sub/b.bin': os.urandom(200),
+        'sub/deeper/c.bin': os.urandom(300),
+    }
+    for filename, data in contents.items():
+        (tmp_path / filename).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / filename).write_bytes(data)
+
+    calls = []
+    progress = {'func': lambda result, done, total: calls.append((done, total))}
+    results = helpers.workspace.upload_many(client, 1, tmp_path, workers=2, progress=progress)
+
+    assert [r.filename for r in results] == sorted(str(pathlib.Path(f)) for f in contents)
+    assert all(r.error is None for r in results)
+    assert sorted(calls) == [(1, 3), (2, 3), (3, 3)]
+    uploaded = {(f['base']['path'], f['base']['filename']): f['data'] for f in fake_server.files.values()}
+    assert uploaded == {
+        ('', 'a.bin'): contents['a.bin'],
+        ('sub', 'b.bin'): contents['sub/b.bin'],
+        ('sub/deeper', 'c.bin'): contents['sub/deeper/c.bin'],
+    }
+
+
+def test_upload_deduplicate(fake_server, client):
+    data = os.urandom(1024)
+    committed_id = fake_server.add_file(data, filename='foo.bin')
+
+    # Same contents as a committed file
+    details = helpers.workspace.upload(client, 1, _RecordingBytesIO(data), deduplicate=True)
+    assert details.id == committed_id
+    assert len(fake_server.files) == 1
+
+    # Same contents but another filename or path
+    for name, path in [('bar.bin', ''), ('foo.bin', 'sub')]:
+        details = helpers.workspace.upload(client, 1, _RecordingBytesIO(data, name=name), path=path,
+                                           deduplicate=True)
+        assert (details.filename, details.path) == (name, path)
+    assert len(fake_server.files) == 3
+
+    # Same contents as a file in the workspace
+    other_data = os.urandom(1024)
+    uploaded = helpers.workspace.upload(client, 1, _RecordingBytesIO(other_data), deduplicate=True)
+    assert len(fake_server.files) == 4
+    details = helpers.workspace.upload(client, 1, _RecordingBytesIO(other_data), deduplicate=True)
+    assert details.id == uploaded.id
+    assert len(fake_server.files) == 4
+
+    # Deleted files do not count
+    fake_server.files[uploaded.id]['base']['state'] = 'DELETED'
+    details = helpers.workspace.upload(client, 1, _RecordingBytesIO(other_data), deduplicate=True)
+    assert details.id != uploaded.id
+    assert fake_server.files[details.id]['data'] == other_data
+
+
+def test_upload_deduplicate_all_pages(fake_server, client):
+    fake_server.max_per_page = 2
+    data = os.urandom(1024)
+    file_ids = [fake_server.add_file(data, filename=f'{i}.bin') for i in range(7)]
+
+    details = helpers.workspace.upload(client, 1, _RecordingBytesIO(data, name='6.bin'), deduplicate=True)
+    assert details.id == file_ids[-1]
+    assert len(fake_server.files) == 7
+
+
+def test_upload_many_deduplicate(fake_server, client, tmp_path):
+    data = os.urandom(1024)
+    existing_id = fake_server.add_file(data, filename='a.bin', path='sub')
+    for filename in ['sub/a.bin', 'sub/b.bin', 'a.bin']:
+        (tmp_path / filename).parent.mkdir(exist_ok=True)
+        (tmp_path / filename).write_bytes(data)
+
+    results = helpers.workspace.upload_many(client, 1, tmp_path, deduplicate=True)
+
+    assert all(r.error is None for r in results)
+    duplicates = {r.filename: r.details.id for r in results if r.duplicate}
+    assert duplicates == {str(pathlib.Path('sub/a.bin')): existing_id}
+    uploaded = {(f['base']['path'], f['base']['filename']) for f in fake_server.files.values()}
+    assert uploaded == {('sub', 'a.bin'), ('sub', 'b.bin'), ('', 'a.bin')}
+
+
+def test_upload_many_memory_budget(mocker, fake_server, client, tmp_path):
+    for i in range(8):
+        (tmp_path / f'{i}.bin').write_bytes(os.urandom(64 * 1024))
+    client.configuration.chunk_size = 4096
+    client.transfer_budget.max_bytes = 8192
+
+    peak = []
+    original_acquire = client.transfer_budget.acquire
+
+    def acquire(num_bytes):
+        original_acquire(num_bytes)
+        peak.append(client.transfer_budget.in_flight)
+
+    mocker.patch.object(client.transfer_budget, 'acquire', side_effect=acquire)
+    results = helpers.workspace.upload_many(client, 1, tmp_path, workers=8)
+
+    assert all(r.error is None for r in results)
+    assert max(peak) <= 8192
@@ -0,0 +1,103 @@
+import pytest
+from click.testing import CliRunner
+
+from quetzal.client import helpers
+from quetzal.client.cli import State
+from quetzal.client.cli.main import cli
+from quetzal.client.exceptions import QuetzalAPIException
+
+
+@pytest.fixture(scope='function')
+def client(fake_server, tmp_path):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    client.configuration.workspace_cache = True
+    client.configuration.workspace_cache_path = tmp_path / 'workspaces.json'
+    return client
+
+
+def _fetch_requests(fake_server):
+    return [r for r in fake_server.requests if '/workspaces/?' in r['path']]
+
+
+def test_resolve_cached(fake_server, client):
+    wid = fake_server.add_workspace('ws')
+
+    assert helpers.workspace.resolve(client, name='ws') == wid
+    assert helpers.workspace.resolve(client, name='ws') == wid
+    assert len(_fetch_requests(fake_server)) == 1
+
+    # The cache persists across clients
+    other = helpers.get_client(fake_server.url, api_key='fake-key')
+    other.configuration.workspace_cache = True
+    other.configuration.workspace_cache_path = client.configuration.workspace_cache_path
+    assert helpers.workspace.resolve(other, name='ws') == wid
+    assert len(_fetch_requests(fake_server)) == 1
+
+    assert helpers.workspace.resolve(client, name='unknown') is None
+    assert helpers.workspace.resolve(client, wid=123) == 123
+
+
+def test_resolve_disabled_by_default(fake_server):
+    client = helpers.get_client(fake_server.url, api_key='fake-key')
+    fake_server.add_workspace('ws')
+
+    assert client.workspace_cache is None
+    for _ in range(2):
+        helpers.workspace.resolve(client, name='ws')
+    assert len(_fetch_requests(fake_server)) == 2
+
+
+def test_resolve_invalidated_on_not_found(fake_server, client):
+    old_wid = fake_server.add_workspace('ws')
+    assert helpers.workspace.resolve(client, name='ws') == old_wid
+
+    # The workspace is replaced by another one with the same name
+    del fake_server.workspaces[old_wid]
+    new_wid = fake_server.add_workspace('ws')
+    with pytest.raises(QuetzalAPIException):
+        client.workspace_details(helpers.workspace.resolve(client, name='ws'))
+    assert helpers.workspace.resolve(client, name='ws') == new_wid
+    assert len(_fetch_requests(fake_server)) == 2
+
+
+def test_cli_uses_cache(fake_server, client):
+    fake_server.add_workspace('ws')
+    fake_server.add_file(b'hello', filename='hello.txt', wid=1)
+    state = State()
+    state.api_config.username = 'user'
+    state.api_config.workspace_cache = True
+    state.api_config.workspace_cache_path = client.configuration.workspace_cache_path
+
+    runner = CliRunner()
+    for _ in range(3):
+        result = runner.invoke(cli, ['--url', fake_server.url, '--api-key', 'fake-key',
+                                     'workspace', 'files', '--name', 'ws'], obj=state)
+        assert result.exit_code == 0, result.output
+        assert 'hello.txt' in result.output
+    assert len(_fetch_requests(fake_server)) == 1
+
+
+def test_resolve_invalidated_on_deleted(fake_server, client):
+    old_wid = fake_server.add_workspace('ws')
+    assert helpers.workspace.resolve(client, name='ws') == old_wid
+
+    # The workspace is deleted elsewhere and recreated with the same name
+    fake_server.workspaces[old_wid]['status'] = 'DELETED'
+    new_wid = fake_server.add_workspace('ws')
+    details = client.workspace_details(helpers.workspace.resolve(client, name='ws'))
+    assert details.status == 'DELETED'
+    assert helpers.workspace.resolve(client, name='ws') == new_wid
+    assert len(_fetch_requests(fake_server)) == 2
+
+
+@pytest.mark.parametrize('status', [400, 412])
+def test_resolve_invalidated_on_rejected(fake_server, client, status):
+    wid = fake_server.add_workspace('ws')
+    fake_server.add_file(b'hello', filename='hello.txt', wid=wid)
+    assert helpers.workspace.resolve(client, name='ws') == wid
+
+    fake_server.errors = [status]
+    with pytest.raises(QuetzalAPIException):
+        client.workspace_file_fetch(helpers.workspace.resolve(client, name='ws'))
+    assert helpers.workspace.resolve(client, name='ws') == wid
+    assert len(_fetch_requests(fake_server)) == 2